@@ -0,0 +1,135 @@
+"""Asynchronous, batched activity log for the web chat.
+
+ActivityLog.log() stamps an entry and puts it on a queue. A background task
+drains the queue at a fixed cadence into a bounded ring and sends each batch
+to subscribers only. Subscribers with the same event and room filters share
+a Socket.IO room, so a batch is filtered and emitted once per filter group.
+Entry ids are assigned as the queue is drained, so they increase by one in
+ring order and since() can catch up from any id.
+"""
+
+import datetime
+import itertools
+import time
+from collections import Counter, deque
+from itertools import islice
+
+ACTIVITY_ROOM = 'activity'
+DEFAULT_MAXLEN = 2000  # Entries kept in memory
+DEFAULT_INTERVAL = 0.5  # Seconds between batches
+
+
+class ActivityLog:
+    """Bounded activity log fed through a background batching queue"""
+
+    def __init__(self, socketio, maxlen=DEFAULT_MAXLEN, interval=DEFAULT_INTERVAL):
+        self.socketio = socketio
+        self.interval = interval
+        self.entries = deque(maxlen=maxlen)
+        self._queue = deque()  # Appends and pops are thread-safe, no lock needed
+        self._ids = itertools.count(1)
+        self._task = None
+        self._subscriptions = {}  # {sid: filter key}
+        self._groups = Counter()  # {filter key: subscriber count}
+
+    def log(self, event_type, description, meta=None):
+        """Queue an activity entry, it is published with the next batch."""
+        entry = {
+            'event': event_type,
+            'description': description,
+            'meta': meta or {},
+            'time': time.time()
+        }
+        self._queue.append(entry)
+        if self._task is None:
+            self.start()
+        return entry
+
+    def start(self):
+        """Start the batching task now instead of on the first entry."""
+        if self._task is None:
+            self._task = self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    def flush(self):
+        """Move queued entries into the log and emit them as one batch.
+
+        Only the batching task calls this, so entries are numbered in order.
+        """
+        batch = []
+        while self._queue:
+            entry = self._queue.popleft()
+            # Numbered here rather than in log(), which runs on several threads at once
+            entry['id'] = next(self._ids)
+            entry['timestamp'] = datetime.datetime.fromtimestamp(entry.pop('time')).strftime('%Y-%m-%d %H:%M:%S')
+            batch.append(entry)
+        if not batch:
+            return
+        self.entries.extend(batch)
+        for key in list(self._groups):
+            entries = [e for e in batch if matches(e, *key)]
+            if entries:
+                self.socketio.emit('activity_batch', {'entries': entries}, to=group_room(key))
+
+    def subscribe(self, sid, events=None, rooms=None):
+        """Register sid for live entries matching the filters, return the Socket.IO room to join."""
+        key = (frozenset(events) if events else None, frozenset(rooms) if rooms else None)
+        self._subscriptions[sid] = key
+        self._groups[key] += 1
+        return group_room(key)
+
+    def unsubscribe(self, sid):
+        """Forget sid's subscription, return the Socket.IO room it should leave or None."""
+        key = self._subscriptions.pop(sid, None)
+        if key is None:
+            return None
+        self._groups[key] -= 1
+        if not self._groups[key]:
+            del self._groups[key]
+        return group_room(key)
+
+    def since(self, cursor=None, limit=100, events=None, rooms=None):
+        """Return up to limit matching entries newer than cursor, and whether more remain.
+
+        Without a cursor the newest matching entries are returned, oldest first.
+        """
+        events = frozenset(events) if events else None
+        rooms = frozenset(rooms) if rooms else None
+        entries = list(self.entries)
+        if cursor is None:
+            candidates = reversed(entries)
+        else:
+            # Ids are consecutive, so the cursor maps straight to a position
+            start = cursor - entries[0]['id'] + 1 if entries else 0
+            candidates = islice(entries, max(start, 0), None)
+        result = []
+        for entry in candidates:
+            if matches(entry, events, rooms):
+                if len(result) == limit:
+                    return (result if cursor is not None else result[::-1]), True
+                result.append(entry)
+        return (result if cursor is not None else result[::-1]), False
+
+
+def matches(entry, events, rooms):
+    """Whether an entry passes an event type filter and a room filter (None allows all)."""
+    if events is not None and entry['event'] not in events:
+        return False
+    if rooms is not None and entry['meta'].get('room') not in rooms:
+        return False
+    return True
+
+
+def group_room(key):
+    """Socket.IO room shared by the subscribers of one filter key."""
+    events, rooms = key
+    if events is None and rooms is None:
+        return ACTIVITY_ROOM
+    return '{}:{}|{}'.format(ACTIVITY_ROOM, ','.join(sorted(events or ())), ','.join(sorted(rooms or ())))
@@ -1,22 +1,37 @@
+import atexit
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory
+import signal
+import sys
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from datetime import datetime
+from sqlalchemy.orm import joinedload, selectinload
 import emoji
 import json
 
+from upload_store import UploadStore, send_upload
+from write_behind import WriteBehind, use_wal
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key'  # Change this in production
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///chat.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('CHAT_DATABASE_URL', 'sqlite:///chat.db')
+app.config['HISTORY_PAGE_SIZE'] = 50  # messages per history page
+app.config['MAX_HISTORY_PAGE_SIZE'] = 200
+app.config['WRITE_FLUSH_INTERVAL'] = 0.5  # seconds messages and reactions wait before they are written
+app.config['WRITE_FLUSH_ROWS'] = 500  # rows waiting before they are written anyway
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# let a fronting server (Apache mod_xsendfile, lighttpd) send uploads with sendfile()
+app.config['USE_X_SENDFILE'] = os.environ.get('CHAT_X_SENDFILE') == '1'
 
 # Initialize extensions
 socketio = SocketIO(app)
+# Uploads are named by content hash, so a name never points at different bytes
+upload_store = UploadStore(os.path.join(app.root_path, app.config['UPLOAD_FOLDER']))
 db = SQLAlchemy(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -38,9 +53,12 @@ class Room(db.Model):
     name = db.Column(db.String(80), unique=True, nullable=False)
     description = db.Column(db.String(200))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    messages = db.relationship('Message', backref='room', lazy=True)
+    # A busy room has far too many messages to load at once, page through history_page() instead
+    messages = db.relationship('Message', backref='room', lazy='dynamic')
 
 class Message(db.Model):
+    # History is read newest first within a room, keyed on (room_id, timestamp, id)
+    __table_args__ = (db.Index('ix_message_room_timestamp_id', 'room_id', 'timestamp', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
@@ -49,13 +67,59 @@ class Message(db.Model):
     type = db.Column(db.String(20), default='text')  # text, image, file
     file_url = db.Column(db.String(200))
     edited = db.Column(db.Boolean, default=False)
-    reactions = db.relationship('Reaction', backref='message', lazy=True)
+    # Loaded for a whole page of messages in one extra query rather than one query per message
+    reactions = db.relationship('Reaction', backref='message', lazy='selectin')
 
 class Reaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     emoji = db.Column(db.String(20), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    message_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=False)
+    message_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=False, index=True)
+
+
+def serialize_message(message):
+    return {
+        'id': message.id,
+        'content': message.content,
+        'username': message.author.username,
+        'timestamp': message.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+        'type': message.type,
+        'file_url': message.file_url,
+        'user_id': message.user_id,
+        'edited': message.edited,
+        'reactions': [{'emoji': r.emoji, 'user_id': r.user_id} for r in message.reactions]
+    }
+
+
+def encode_cursor(message):
+    return f"{message.timestamp.isoformat()}_{message.id}"
+
+
+def decode_cursor(cursor):
+    """Turn a cursor from encode_cursor back into (timestamp, id), raises ValueError."""
+    timestamp, _, message_id = cursor.rpartition('_')
+    return datetime.fromisoformat(timestamp), int(message_id)
+
+
+def history_page(room_id, before=None, limit=50):
+    """Return up to limit messages of a room older than the before cursor, newest page by default.
+
+    The result is (messages oldest first, cursor of the next older page or None).
+    Pages are found by seeking ix_message_room_timestamp_id rather than by
+    OFFSET, so deep pages cost as little as the first one. Authors are joined
+    in and reactions loaded in one batch.
+    """
+    query = (Message.query
+             .options(joinedload(Message.author), selectinload(Message.reactions))
+             .filter(Message.room_id == room_id))
+    if before:
+        timestamp, message_id = decode_cursor(before)
+        query = query.filter(db.tuple_(Message.timestamp, Message.id) < (timestamp, message_id))
+    messages = query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit + 1).all()
+    cursor = encode_cursor(messages[limit - 1]) if len(messages) > limit else None
+    messages = messages[:limit]
+    messages.reverse()
+    return messages, cursor
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -167,26 +231,29 @@ def handle_leave_room(data):
 
 @socketio.on('message')
 def handle_message(data):
-    content = emoji.emojize(data.get('message'))
     room_id = data.get('room')
+    if not data.get('message') or room_id is None:
+        return  # the buffered insert would only fail later
+    content = emoji.emojize(data.get('message'))
     msg_type = data.get('type', 'text')
     file_url = data.get('file_url')
     
-    message = Message(
-        content=content,
-        user_id=current_user.id,
-        room_id=room_id,
-        type=msg_type,
-        file_url=file_url
-    )
-    db.session.add(message)
-    db.session.commit()
+    # Written by the write-behind buffer, the room sees the message right away
+    message = writes.add(Message.__table__, {
+        'content': content,
+        'timestamp': datetime.utcnow(),
+        'user_id': current_user.id,
+        'room_id': room_id,
+        'type': msg_type,
+        'file_url': file_url,
+        'edited': False
+    })
     
     emit('message', {
-        'id': message.id,
+        'id': message['id'],
         'content': content,
         'username': current_user.username,
-        'timestamp': message.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+        'timestamp': message['timestamp'].strftime('%Y-%m-%d %H:%M:%S'),
         'type': msg_type,
         'file_url': file_url,
         'user_id': current_user.id
@@ -196,14 +263,14 @@ def handle_message(data):
 def handle_reaction(data):
     message_id = data.get('message_id')
     emoji_code = data.get('emoji')
+    if not emoji_code or message_id is None:
+        return
     
-    reaction = Reaction(
-        emoji=emoji_code,
-        user_id=current_user.id,
-        message_id=message_id
-    )
-    db.session.add(reaction)
-    db.session.commit()
+    writes.add(Reaction.__table__, {
+        'emoji': emoji_code,
+        'user_id': current_user.id,
+        'message_id': message_id
+    })
     
     emit('reaction_update', {
         'message_id': message_id,
@@ -223,17 +290,39 @@ def upload_file():
         return jsonify({'error': 'No selected file'}), 400
     
     if file:
-        filename = secure_filename(file.filename)
-        file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+        filename = upload_store.save(file.stream, file.filename)
         return jsonify({'url': url_for('uploaded_file', filename=filename)})
 
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return send_upload(app.config['UPLOAD_FOLDER'], filename)
+
+@app.route('/rooms/<int:room_id>/messages')
+@login_required
+def room_history(room_id):
+    # ?before=<cursor> pages back through older messages
+    writes.flush()  # include messages still waiting in the write-behind buffer
+    try:
+        limit = int(request.args.get('limit') or app.config['HISTORY_PAGE_SIZE'])
+        messages, cursor = history_page(room_id, request.args.get('before'),
+                                        max(1, min(limit, app.config['MAX_HISTORY_PAGE_SIZE'])))
+    except ValueError:
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+    return jsonify({'messages': [serialize_message(m) for m in messages], 'next_cursor': cursor})
 
 # Initialize database
 with app.app_context():
+    use_wal(db.engine)
     db.create_all()
+    # create_all() skips tables that already exist, so add indexes missing from older databases
+    for table in (Message.__table__, Reaction.__table__):
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    writes = WriteBehind(db.engine, app.config['WRITE_FLUSH_INTERVAL'], app.config['WRITE_FLUSH_ROWS'])
+writes.start(socketio.start_background_task, socketio.sleep)
+# Normal exits, Ctrl+C and SIGTERM all write out the buffer first
+atexit.register(writes.stop)
 
 if __name__ == '__main__':
+    signal.signal(signal.SIGTERM, lambda sig, frame: sys.exit(0))
     socketio.run(app, debug=True)
\ No newline at end of file
@@ -0,0 +1,82 @@
+"""Microbenchmark: per-recipient CPU cost of ChatServer.broadcast.
+
+Fills a room with in-memory connections that queue frames exactly like the
+real engines (an OutboundQueue per client, nothing written to a socket) and
+times one broadcast into it. The "legacy" column re-encodes the message for
+every recipient, as broadcast did before payloads were serialized once.
+
+    python benchmarks/bench_broadcast.py [--rounds N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from framing import encode_frame  # noqa: E402
+from outbound import OutboundQueue  # noqa: E402
+from server import ChatServer, timestamp  # noqa: E402
+
+ROOM_SIZES = (10, 1_000, 10_000)
+
+
+class QueueOnlyConnection:
+    """Stand-in client that queues frames and never writes them anywhere"""
+
+    def __init__(self):
+        self.queue = OutboundQueue(high_water=1 << 40)
+
+    def send(self, data):
+        self.queue.push(data)
+        return len(data)
+
+    def close(self):
+        pass
+
+
+def build_room(server, size):
+    members = []
+    for i in range(size):
+        conn = QueueOnlyConnection()
+        server.state.add_client(conn, {"username": f"user{i}", "join_time": None, "msgs_sent": 0})
+        server.state.join(conn, "bench")
+        members.append(conn)
+    return members
+
+
+def legacy_broadcast(server, message, room):
+    """broadcast() as it was: timestamp and encode for every recipient"""
+    for client in server.state.members(room):
+        client.send(encode_frame(f"[{timestamp()}] {message}"))
+
+
+def measure(fn, members, rounds):
+    cpu = 0.0
+    for _ in range(rounds):
+        for conn in members:
+            conn.queue.clear()
+        start = time.process_time()
+        fn()
+        cpu += time.process_time() - start
+    return cpu / rounds / len(members) * 1e9  # ns per recipient
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=20, help="Broadcasts timed per room size")
+    args = parser.parse_args()
+
+    message = "alice: " + "hello room 🎉 " * 8
+    print(f"{'members':>8} {'broadcast ns/recipient':>24} {'legacy ns/recipient':>21}")
+    for size in ROOM_SIZES:
+        server = ChatServer()
+        members = build_room(server, size)
+        current = measure(lambda: server.broadcast(message, room="bench"), members, args.rounds)
+        legacy = measure(lambda: legacy_broadcast(server, message, "bench"), members, args.rounds)
+        print(f"{size:>8} {current:>24.0f} {legacy:>21.0f}")
+
+
+if __name__ == "__main__":
+    main()
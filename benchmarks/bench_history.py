@@ -0,0 +1,127 @@
+"""Benchmark: loading a room's history from the app.py database.
+
+Seeds a SQLite database with a million messages spread over many rooms,
+some of them with reactions, then times one page of history:
+
+- legacy: no indexes, the room's messages loaded and sorted in full and
+  reactions fetched per message, as the lazy relationships did before
+- current: history_page(), which seeks the (room_id, timestamp, id) index
+  and batch-loads reactions
+- page 21: history_page() 20 pages back, which costs the same as the first
+
+    python benchmarks/bench_history.py [--messages N] [--rooms N] [--rounds N]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DIRECTORY = tempfile.mkdtemp()
+os.environ['CHAT_DATABASE_URL'] = 'sqlite:///' + os.path.join(DIRECTORY, 'bench.db')
+
+from sqlalchemy import event  # noqa: E402
+
+from app import Message, Reaction, Room, User, app, db, history_page  # noqa: E402
+
+PAGE = 50
+CHUNK = 50_000
+
+
+def seed(messages, rooms):
+    users = 100
+    db.session.execute(db.insert(User), [
+        {'username': f'user{i}', 'email': f'user{i}@example.com'} for i in range(users)])
+    db.session.execute(db.insert(Room), [{'name': f'room{i}'} for i in range(rooms)])
+    start = datetime(2024, 1, 1)
+    message_id = 0
+    while message_id < messages:
+        rows = []
+        reactions = []
+        for _ in range(min(CHUNK, messages - message_id)):
+            message_id += 1
+            rows.append({'id': message_id, 'content': f'message {message_id}',
+                         'timestamp': start + timedelta(seconds=message_id),
+                         'user_id': random.randint(1, users), 'room_id': random.randint(1, rooms)})
+            if message_id % 10 == 0:
+                reactions.append({'emoji': '👍', 'user_id': random.randint(1, users), 'message_id': message_id})
+        db.session.execute(db.insert(Message), rows)
+        db.session.execute(db.insert(Reaction), reactions)
+    db.session.commit()
+
+
+def legacy_page(room_id):
+    messages = sorted(Message.query.filter_by(room_id=room_id).all(), key=lambda m: (m.timestamp, m.id))[-PAGE:]
+    for message in messages:
+        db.session.execute(db.select(Reaction).filter_by(message_id=message.id)).scalars().all()
+        message.author.username
+    return messages
+
+
+def deep_cursor(room_id, pages=20):
+    """Cursor of the page that many pages back in a room's history"""
+    cursor = None
+    for _ in range(pages):
+        _, cursor = history_page(room_id, cursor, PAGE)
+    return cursor
+
+
+def measure(func, rooms, rounds):
+    """Average seconds and statements per call, on a fresh session each time"""
+    statements = []
+
+    def count(*args):
+        statements.append(1)
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        start = time.perf_counter()
+        for i in range(rounds):
+            db.session.expunge_all()
+            func(1 + i % rooms)
+        elapsed = time.perf_counter() - start
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+    return elapsed / rounds, len(statements) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1_000_000, help="Messages in the database")
+    parser.add_argument("--rooms", type=int, default=100, help="Rooms the messages are spread over")
+    parser.add_argument("--rounds", type=int, default=20, help="History loads timed per variant")
+    args = parser.parse_args()
+
+    try:
+        with app.app_context():
+            start = time.perf_counter()
+            seed(args.messages, args.rooms)
+            print(f"Seeded {args.messages} messages in {time.perf_counter() - start:.1f}s")
+            indexes = list(Message.__table__.indexes) + list(Reaction.__table__.indexes)
+
+            for index in indexes:
+                index.drop(db.engine)
+            results = [('legacy', *measure(legacy_page, args.rooms, max(1, args.rounds // 4)))]
+            for index in indexes:
+                index.create(db.engine)
+            db.session.execute(db.text('ANALYZE'))
+            results.append(('current', *measure(lambda room: history_page(room, None, PAGE), args.rooms, args.rounds)))
+            cursors = {room: deep_cursor(room) for room in range(1, min(args.rooms, args.rounds) + 1)}
+            results.append(('page 21', *measure(lambda room: history_page(room, cursors[room], PAGE),
+                                                args.rooms, args.rounds)))
+
+            print(f"{'variant':>8} {'ms/page':>9} {'queries/page':>13}")
+            for name, seconds, queries in results:
+                print(f"{name:>8} {seconds * 1000:>9.2f} {queries:>13.1f}")
+    finally:
+        shutil.rmtree(DIRECTORY)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Benchmark: repeated room history loads against the upload route.
+
+Every history load renders the images of the room's messages. A browser-like
+client cache keeps responses, reuses them while Cache-Control says they are
+fresh and otherwise revalidates them with If-None-Match. The "legacy" route
+serves uploads with plain send_from_directory() as /uploads did before,
+"current" uses send_upload().
+
+    python benchmarks/bench_uploads.py [--images N] [--size KB] [--loads N]
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, send_from_directory  # noqa: E402
+
+from upload_store import send_upload  # noqa: E402
+
+
+class BrowserCache:
+    """Client-side HTTP cache that follows max-age and revalidates with ETags"""
+
+    def __init__(self, client):
+        self.client = client
+        self.entries = {}  # {url: (etag, expires_at, body)}
+        self.requests = self.not_modified = self.bytes = 0
+
+    def get(self, url):
+        etag, expires, body = self.entries.get(url, (None, 0, None))
+        if body is not None and expires > time.time():
+            return body
+        headers = {'If-None-Match': f'"{etag}"'} if etag else {}
+        response = self.client.get(url, headers=headers)
+        self.requests += 1
+        self.bytes += len(response.data)
+        if response.status_code == 304:
+            self.not_modified += 1
+        else:
+            body = response.data
+        etag = response.get_etag()[0]
+        max_age = response.cache_control.max_age or 0
+        self.entries[url] = (etag, time.time() + max_age, body)
+        return body
+
+
+def make_app(directory):
+    app = Flask(__name__)
+
+    @app.route('/legacy/<path:filename>')
+    def legacy(filename):
+        return send_from_directory(directory, filename)
+
+    @app.route('/current/<path:filename>')
+    def current(filename):
+        return send_upload(directory, filename)
+
+    return app
+
+
+def run(app, prefix, names, loads):
+    cache = BrowserCache(app.test_client())
+    start = time.perf_counter()
+    for _ in range(loads):
+        for name in names:
+            cache.get(f'/{prefix}/{name}')
+    return time.perf_counter() - start, cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=50, help="Images in the room's history")
+    parser.add_argument("--size", type=int, default=200, help="Image size in KB")
+    parser.add_argument("--loads", type=int, default=20, help="History loads per client")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        names = []
+        for _ in range(args.images):
+            data = os.urandom(args.size * 1024)
+            name = hashlib.sha256(data).hexdigest() + '.png'
+            with open(os.path.join(directory, name), 'wb') as f:
+                f.write(data)
+            names.append(name)
+        app = make_app(directory)
+
+        print(f"{'route':>8} {'seconds':>8} {'requests':>9} {'304s':>6} {'MB sent':>8}")
+        for prefix in ('legacy', 'current'):
+            elapsed, cache = run(app, prefix, names, args.loads)
+            print(f"{prefix:>8} {elapsed:>8.3f} {cache.requests:>9} {cache.not_modified:>6} "
+                  f"{cache.bytes / 1e6:>8.1f}")
+
+        # A partial request, as sent by a client resuming a download or seeking
+        response = app.test_client().get(f'/current/{names[0]}', headers={'Range': 'bytes=0-1023'})
+        print(f"Range bytes=0-1023 -> {response.status_code}, {len(response.data)} bytes")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
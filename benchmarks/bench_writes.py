@@ -0,0 +1,87 @@
+"""Benchmark: persisting chat messages from app.py to SQLite.
+
+Writes the same stream of messages to a fresh database file three ways:
+
+- legacy: one session.add() + commit() per message, default journal, as
+  handle_message did before
+- wal: the same per-message commits with the database in WAL mode
+- current: WriteBehind, rows batched into one transaction per flush
+
+    python benchmarks/bench_writes.py [--messages N] [--max-rows N]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DIRECTORY = tempfile.mkdtemp()
+os.environ['CHAT_DATABASE_URL'] = 'sqlite:///' + os.path.join(DIRECTORY, 'app.db')
+
+from sqlalchemy import create_engine, func, insert, select  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from app import Message, Room, User, db  # noqa: E402
+from write_behind import WriteBehind, use_wal  # noqa: E402
+
+
+def make_engine(name, wal):
+    engine = create_engine('sqlite:///' + os.path.join(DIRECTORY, name))
+    if wal:
+        use_wal(engine)
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(User.__table__), [{'username': 'user', 'email': 'user@example.com'}])
+        connection.execute(insert(Room.__table__), [{'name': 'room'}])
+    return engine
+
+
+def per_commit(engine, messages):
+    with Session(engine) as session:
+        for i in range(messages):
+            session.add(Message(content=f'message {i}', user_id=1, room_id=1))
+            session.commit()
+
+
+def write_behind(engine, messages, max_rows):
+    writes = WriteBehind(engine, max_rows=max_rows)
+    for i in range(messages):
+        writes.add(Message.__table__, {'content': f'message {i}', 'timestamp': datetime.utcnow(),
+                                       'user_id': 1, 'room_id': 1, 'type': 'text', 'file_url': None,
+                                       'edited': False})
+    writes.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=5000, help="Messages written per variant")
+    parser.add_argument("--max-rows", type=int, default=500, help="WriteBehind rows per transaction")
+    args = parser.parse_args()
+
+    variants = [
+        ('legacy', False, lambda engine: per_commit(engine, args.messages)),
+        ('wal', True, lambda engine: per_commit(engine, args.messages)),
+        ('current', True, lambda engine: write_behind(engine, args.messages, args.max_rows)),
+    ]
+    try:
+        print(f"{'variant':>8} {'seconds':>8} {'messages/s':>11}")
+        for name, wal, run in variants:
+            engine = make_engine(f'{name}.db', wal)
+            start = time.perf_counter()
+            run(engine)
+            elapsed = time.perf_counter() - start
+            with engine.connect() as connection:
+                assert connection.execute(select(func.count()).select_from(Message.__table__)).scalar() == args.messages
+            engine.dispose()
+            print(f"{name:>8} {elapsed:>8.2f} {args.messages / elapsed:>11.0f}")
+    finally:
+        shutil.rmtree(DIRECTORY)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,484 @@
+"""Load generator: simulated chat users against server.py or web_server.py.
+
+Runs the workload described by a scenario file (see benchmarks/scenarios)
+and reports what the server sustained:
+
+- throughput: messages sent and delivered per second, and the share of
+  expected deliveries that arrived
+- fan-out latency: p50/p99/max from a message being sent until each
+  recipient has read it
+- server CPU (percent of one core) and memory per connection, read from
+  /proc, so Linux only
+- CPU used by the load generator itself, to tell when it is the bottleneck
+
+Every simulated user logs in, joins one of the scenario's rooms and then
+sends messages at a fixed rate, a share of them private messages to a
+random other user. TCP users speak the client.py protocol (newline frames,
+/join, /say, /msg). Web users log in over HTTP, connect with a Socket.IO
+client and use the join and message events. web_server.py has no private
+messages, so invites, which are delivered to one user, stand in for them.
+
+The scenario can start the server itself, otherwise point --host/--port at
+a running one and pass --pid for the CPU and memory figures. Results can be
+saved with --output and compared with an earlier run with --baseline, which
+exits with status 1 when a figure got worse by more than --tolerance.
+
+    python benchmarks/loadgen.py benchmarks/scenarios/tcp_rooms.json [--clients N]
+        [--duration S] [--processes N] [--output results.json] [--baseline old.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from framing import FrameDecoder, encode_frame  # noqa: E402
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULTS = {
+    'target': 'tcp',  # tcp (server.py) or web (web_server.py)
+    'host': '127.0.0.1',
+    'port': 9090,
+    'clients': 100,
+    'rooms': 4,
+    'ramp': 5,  # Seconds over which the users connect
+    'duration': 20,  # Seconds of chat measured after the ramp
+    'drain': 2,  # Seconds to wait for deliveries still in flight
+    'message_rate': 1.0,  # Messages per user per second
+    'private_ratio': 0.0,  # Share of messages sent privately
+    'message_size': 64,  # Bytes of padding per message
+    'server': None,  # Command that starts the server, see load_scenario()
+}
+PAYLOAD = re.compile(r'~lg ([rp]) (\d+) ([\d.]+)')  # Marker at the start of every generated message
+MAX_SAMPLES = 200_000  # Latency samples kept per process
+# (metric, True if bigger is better) compared against a --baseline
+COMPARED = [
+    ('delivered_per_s', True),
+    ('delivered_ratio', True),
+    ('latency_p50_ms', False),
+    ('latency_p99_ms', False),
+    ('server_cpu_percent', False),
+    ('kb_per_connection', False),
+]
+
+
+class Stats:
+    """What one process's users saw, merged by the driver"""
+
+    def __init__(self):
+        self.connected = 0
+        self.failed = 0
+        self.connect_times = []
+        self.sent = {}  # {room or '~private': messages sent}
+        self.members = {}  # {room: users that joined it}
+        self.received = 0
+        self.latencies = []
+        self.lock = threading.Lock()
+
+    def record(self, sent_at):
+        latency = time.time() - sent_at
+        with self.lock:
+            self.received += 1
+            if len(self.latencies) < MAX_SAMPLES:
+                self.latencies.append(latency)
+            else:
+                # Reservoir sampling keeps a fair sample of long runs
+                i = random.randrange(self.received)
+                if i < MAX_SAMPLES:
+                    self.latencies[i] = latency
+
+    def count_sent(self, key):
+        with self.lock:
+            self.sent[key] = self.sent.get(key, 0) + 1
+
+    def result(self):
+        return {'connected': self.connected, 'failed': self.failed, 'connect_times': self.connect_times,
+                'sent': self.sent, 'members': self.members, 'received': self.received,
+                'latencies': self.latencies}
+
+
+class User:
+    """Behaviour shared by both kinds of simulated user"""
+
+    def __init__(self, scenario, index, prefix, stats):
+        self.scenario = scenario
+        self.index = index
+        self.prefix = prefix
+        self.username = f'{prefix}{index}'
+        self.room = f"lg-room{index % scenario['rooms']}"
+        self.stats = stats
+        self.rng = random.Random(index)
+        self.padding = 'x' * scenario['message_size']
+
+    def on_text(self, text):
+        match = PAYLOAD.search(text)
+        # Our own messages come back from some servers (web rooms, /msg echoes), they are not deliveries
+        if match and int(match.group(2)) != self.index:
+            self.stats.record(float(match.group(3)))
+
+    def next_message(self):
+        """Return (kind, target username or room, text) of the next message to send"""
+        clients = self.scenario['clients']
+        if clients > 1 and self.rng.random() < self.scenario['private_ratio']:
+            target = self.rng.randrange(clients - 1)
+            target += target >= self.index
+            kind, key, to = 'p', '~private', f'{self.prefix}{target}'
+        else:
+            kind, key, to = 'r', self.room, self.room
+        self.stats.count_sent(key)
+        return kind, to, f'~lg {kind} {self.index} {time.time():.6f} {self.padding}'
+
+    def schedule(self, measure_at, end_at):
+        """Send times of this user, evenly spaced with a random phase"""
+        interval = 1 / self.scenario['message_rate']
+        at = measure_at + self.rng.random() * interval
+        while at < end_at:
+            yield at
+            at += interval
+
+
+class TcpUser(User):
+    async def run(self, connect_at, measure_at, end_at):
+        await asyncio.sleep(max(0, connect_at - time.time()))
+        started = time.perf_counter()
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.scenario['host'], self.scenario['port']), 10)
+        except (OSError, asyncio.TimeoutError):
+            self.stats.failed += 1
+            return
+        self.reader = reader
+        self.writer = writer
+        self.decoder = FrameDecoder()
+        self.frames = []
+        try:
+            await self.expect('Enter your username')
+            writer.write(encode_frame(self.username))
+            await self.expect('Welcome')
+            writer.write(encode_frame(f'/join {self.room}'))
+            await self.expect('You joined room')
+        except (OSError, EOFError, asyncio.TimeoutError):
+            self.stats.failed += 1
+            writer.close()
+            return
+        self.stats.connected += 1
+        self.stats.connect_times.append(time.perf_counter() - started)
+        self.stats.members[self.room] = self.stats.members.get(self.room, 0) + 1
+
+        receiver = asyncio.create_task(self.receive())
+        try:
+            for at in self.schedule(measure_at, end_at):
+                await asyncio.sleep(max(0, at - time.time()))
+                kind, to, text = self.next_message()
+                writer.write(encode_frame(f'/say {to} {text}' if kind == 'r' else f'/msg {to} {text}'))
+            await asyncio.sleep(max(0, end_at + self.scenario['drain'] - time.time()))
+        except OSError:
+            pass
+        receiver.cancel()
+        writer.close()
+
+    async def read_frames(self):
+        if not self.frames:
+            data = await self.reader.read(65536)
+            if not data:
+                raise EOFError
+            self.frames = self.decoder.feed(data)
+        frames, self.frames = self.frames, []
+        return frames
+
+    async def expect(self, text, timeout=10):
+        deadline = time.time() + timeout
+        while True:
+            frames = await asyncio.wait_for(self.read_frames(), max(0.01, deadline - time.time()))
+            for i, frame in enumerate(frames):
+                if text in frame:
+                    self.frames = frames[i + 1:]
+                    return
+
+    async def receive(self):
+        try:
+            while True:
+                for frame in await self.read_frames():
+                    if '~lg' in frame:
+                        self.on_text(frame)
+                    elif frame == '/ping':
+                        # server.py's heartbeat, quiet users would be disconnected without an answer
+                        self.writer.write(encode_frame('/pong'))
+        except (OSError, EOFError):
+            pass
+
+
+class WebUser(User):
+    def run(self, connect_at, measure_at, end_at):
+        import requests
+        import socketio
+
+        time.sleep(max(0, connect_at - time.time()))
+        started = time.perf_counter()
+        url = f"http://{self.scenario['host']}:{self.scenario['port']}"
+        client = socketio.Client(reconnection=False)
+        joined = threading.Event()
+        client.on('message', lambda data: self.on_text(data.get('content', '')))
+        client.on('invited', lambda data: self.on_text(data.get('room', '')))
+        client.on('history', lambda data: data.get('room') == self.room and joined.set())
+        try:
+            http = requests.Session()
+            http.post(f'{url}/login', data={'username': self.username}, allow_redirects=False, timeout=10)
+            cookie = '; '.join(f'{name}={value}' for name, value in http.cookies.items())
+            client.connect(url, headers={'Cookie': cookie}, transports=['websocket'], wait_timeout=10)
+            client.emit('join', {'room': self.room})
+            if not joined.wait(10):
+                raise TimeoutError
+        except Exception:
+            self.stats.failed += 1
+            client.disconnect()
+            return
+        with self.stats.lock:
+            self.stats.connected += 1
+            self.stats.connect_times.append(time.perf_counter() - started)
+            self.stats.members[self.room] = self.stats.members.get(self.room, 0) + 1
+
+        try:
+            for at in self.schedule(measure_at, end_at):
+                time.sleep(max(0, at - time.time()))
+                kind, to, text = self.next_message()
+                if kind == 'r':
+                    client.emit('message', {'room': to, 'message': text})
+                else:
+                    client.emit('invite', {'to': to, 'room': text})
+            time.sleep(max(0, end_at + self.scenario['drain'] - time.time()))
+        except Exception:
+            pass
+        client.disconnect()
+
+
+def run_share(scenario, indices, prefix, start_at, measure_at, end_at):
+    """Run some of the users in this process and return their Stats as a dict"""
+    stats = Stats()
+    spread = scenario['ramp'] * 0.8 / max(1, scenario['clients'])
+
+    def connect_at(i):
+        return start_at + i * spread
+
+    if scenario['target'] == 'tcp':
+        async def main():
+            users = [TcpUser(scenario, i, prefix, stats) for i in indices]
+            await asyncio.gather(*(user.run(connect_at(user.index), measure_at, end_at) for user in users))
+        asyncio.run(main())
+    else:
+        threads = [threading.Thread(target=WebUser(scenario, i, prefix, stats).run,
+                                    args=(connect_at(i), measure_at, end_at), daemon=True) for i in indices]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(end_at + scenario['drain'] + 30 - time.time())
+    return stats.result()
+
+
+def proc_cpu_seconds(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    # utime and stime of the process and of its waited-for children, fields 14 to 17
+    return sum(int(value) for value in fields[11:15]) / os.sysconf('SC_CLK_TCK')
+
+
+def proc_rss_bytes(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def sample_process(pid):
+    """(cpu seconds, rss bytes) of a process, or None where /proc is unavailable"""
+    if not pid:
+        return None
+    try:
+        return proc_cpu_seconds(pid), proc_rss_bytes(pid)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def load_scenario(path, overrides):
+    """Read a scenario file over DEFAULTS.
+
+    "server" is a command, as a list, that starts the server. {python},
+    {repo} and {port} in it are replaced by the interpreter, the repository
+    directory and the scenario's port. The server runs in a temporary
+    directory so its log files do not end up in the working tree.
+    """
+    scenario = dict(DEFAULTS)
+    with open(path) as f:
+        scenario.update(json.load(f))
+    scenario.update({key: value for key, value in overrides.items() if value is not None})
+    scenario['name'] = scenario.get('name') or os.path.splitext(os.path.basename(path))[0]
+    if scenario['target'] not in ('tcp', 'web'):
+        raise ValueError(f"Unknown target {scenario['target']!r}, expected tcp or web")
+    return scenario
+
+
+def start_server(scenario, workdir):
+    command = [part.format(python=sys.executable, repo=REPO, port=scenario['port'])
+               for part in scenario['server']]
+    env = dict(os.environ, CHAT_PORT=str(scenario['port']))
+    process = subprocess.Popen(command, cwd=workdir, env=env, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    deadline = time.time() + 20
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}: {' '.join(command)}")
+        try:
+            socket.create_connection((scenario['host'], scenario['port']), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"Server did not accept connections on port {scenario['port']}")
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_scenario(scenario, processes, pid=None):
+    """Run a scenario and return its results as a flat dict of figures"""
+    server = None
+    workdir = tempfile.mkdtemp(prefix='loadgen-')
+    if scenario['server']:
+        server = start_server(scenario, workdir)
+        pid = server.pid
+    try:
+        time.sleep(0.5)  # Let the server settle before measuring its idle footprint
+        idle = sample_process(pid)
+        prefix = f'lg{random.randrange(16 ** 4):04x}u'  # Unique usernames on a shared server
+        start_at = time.time() + 1 + 0.5 * processes  # Time for the workers to start
+        measure_at = start_at + scenario['ramp']
+        end_at = measure_at + scenario['duration']
+        shares = [list(range(scenario['clients']))[p::processes] for p in range(processes)]
+        cpu_before = os.times()
+        with ProcessPoolExecutor(processes) as pool:
+            futures = [pool.submit(run_share, scenario, share, prefix, start_at, measure_at, end_at)
+                       for share in shares if share]
+            time.sleep(max(0, measure_at - time.time()))
+            loaded = sample_process(pid)
+            time.sleep(max(0, end_at - time.time()))
+            finished = sample_process(pid)
+            results = [future.result() for future in futures]
+        cpu_after = os.times()
+    finally:
+        if server:
+            server.terminate()
+            try:
+                server.wait(10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    merged = Stats()
+    for result in results:
+        merged.connected += result['connected']
+        merged.failed += result['failed']
+        merged.connect_times += result['connect_times']
+        merged.received += result['received']
+        merged.latencies += result['latencies']
+        for key, count in result['sent'].items():
+            merged.sent[key] = merged.sent.get(key, 0) + count
+        for room, count in result['members'].items():
+            merged.members[room] = merged.members.get(room, 0) + count
+    # Every other member of the room receives a room message, one user a private one
+    expected = sum(count * (merged.members.get(key, 1) - 1) for key, count in merged.sent.items()
+                   if key != '~private') + merged.sent.get('~private', 0)
+    latencies = sorted(merged.latencies)
+    connect_times = sorted(merged.connect_times)
+    elapsed = scenario['duration']
+    figures = {
+        'clients': scenario['clients'],
+        'connected': merged.connected,
+        'failed': merged.failed,
+        'connect_p99_ms': percentile(connect_times, 0.99) * 1000,
+        'sent_per_s': sum(merged.sent.values()) / elapsed,
+        'delivered_per_s': merged.received / elapsed,
+        'delivered_ratio': merged.received / expected if expected else 0.0,
+        'latency_p50_ms': percentile(latencies, 0.50) * 1000,
+        'latency_p99_ms': percentile(latencies, 0.99) * 1000,
+        'latency_max_ms': (latencies[-1] if latencies else 0.0) * 1000,
+        'loadgen_cpu_percent': (sum(cpu_after[:4]) - sum(cpu_before[:4])) / (end_at + scenario['drain']
+                                                                             - start_at) * 100,
+    }
+    if idle and loaded and finished:
+        figures['server_cpu_percent'] = (finished[0] - loaded[0]) / elapsed * 100
+        figures['server_rss_mb'] = loaded[1] / 1e6
+        figures['kb_per_connection'] = (loaded[1] - idle[1]) / max(1, merged.connected) / 1024
+    return figures
+
+
+def compare(figures, baseline, tolerance):
+    """Print the change against a baseline run and return the metrics that regressed"""
+    regressed = []
+    print(f"\n{'metric':>20} {'baseline':>10} {'now':>10} {'change':>8}")
+    for metric, bigger_is_better in COMPARED:
+        if metric not in figures or metric not in baseline:
+            continue
+        old, new = baseline[metric], figures[metric]
+        change = (new - old) / old if old else 0.0
+        worse = change < -tolerance if bigger_is_better else change > tolerance
+        if worse:
+            regressed.append(metric)
+        print(f"{metric:>20} {old:>10.2f} {new:>10.2f} {change * 100:>+7.1f}%{'  ⚠️' if worse else ''}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("scenario", help="Scenario file (JSON)")
+    parser.add_argument("--clients", type=int, help="Override the number of simulated users")
+    parser.add_argument("--duration", type=float, help="Override the seconds of chat measured")
+    parser.add_argument("--host", help="Override the server host")
+    parser.add_argument("--port", type=int, help="Override the server port")
+    parser.add_argument("--external", action="store_true",
+                        help="Use an already running server instead of the scenario's server command")
+    parser.add_argument("--pid", type=int, help="Process id of an external server, for CPU and memory figures")
+    parser.add_argument("--processes", type=int, default=1, help="Load generator processes sharing the users")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Relative change that counts as a regression against --baseline")
+    args = parser.parse_args()
+
+    overrides = {'clients': args.clients, 'duration': args.duration, 'host': args.host, 'port': args.port}
+    scenario = load_scenario(args.scenario, overrides)
+    if args.external:
+        scenario['server'] = None
+    print(f"Running {scenario['name']}: {scenario['clients']} {scenario['target']} users in "
+          f"{scenario['rooms']} rooms, {scenario['message_rate']} msg/s each for {scenario['duration']}s")
+    figures = run_scenario(scenario, max(1, args.processes), args.pid)
+
+    for metric, value in figures.items():
+        print(f"{metric:>20} {value:>10.2f}" if isinstance(value, float) else f"{metric:>20} {value:>10}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'scenario': scenario, 'results': figures, 'time': time.time()}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        if compare(figures, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Stress test for idle connection reaping in server.py.
+
+Starts server.py with short heartbeat timings, then logs in a crowd of
+clients that go silent and never answer a ping, as if their machines had
+vanished, next to a few that answer like client.py does. Once the ping
+interval and timeout have passed, every silent client must have been
+disconnected and its thread released, and every answering client must
+still be connected.
+
+    python benchmarks/stress_idle.py [--silent N] [--live N] [--engine threads|asyncio]
+"""
+
+import argparse
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from framing import FrameDecoder, encode_frame, iter_frames  # noqa: E402
+from heartbeat import PING_FRAME, PONG_FRAME  # noqa: E402
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_for_port(port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server did not start on port {port}")
+
+
+def login(port, username):
+    sock = socket.create_connection(("127.0.0.1", port))
+    decoder = FrameDecoder()
+    sock.sendall(encode_frame(username))
+    while not any("Welcome" in frame for frame in decoder.feed(sock.recv(65536))):
+        pass
+    return sock
+
+
+def answer_pings(sock, pongs, closed):
+    """Read like client.py does, answering pings, and note when the server hangs up"""
+    try:
+        for frame in iter_frames(sock):
+            if frame == PING_FRAME:
+                sock.sendall(encode_frame(PONG_FRAME))
+                pongs.append(1)
+    except OSError:
+        pass
+    closed.append(sock)
+
+
+def is_closed(sock):
+    """True once the server has closed the connection"""
+    sock.settimeout(0.5)
+    try:
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                return True
+    except socket.timeout:
+        return False
+    except OSError:
+        return True
+
+
+def server_threads(pid):
+    with open(f"/proc/{pid}/status") as f:
+        return int(re.search(r"^Threads:\s+(\d+)", f.read(), re.M).group(1))
+
+
+def metric(port, name):
+    text = urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics").read().decode()
+    return sum(float(value) for value in re.findall(rf"^{name}(?:{{.*}})? (\S+)$", text, re.M))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--silent", type=int, default=500, help="Clients that stop answering")
+    parser.add_argument("--live", type=int, default=20, help="Clients that answer pings")
+    parser.add_argument("--engine", choices=["threads", "asyncio"], default="threads")
+    parser.add_argument("--port", type=int, default=9390)
+    parser.add_argument("--interval", type=int, default=2, help="--ping-interval passed to the server")
+    parser.add_argument("--timeout", type=int, default=2, help="--ping-timeout passed to the server")
+    args = parser.parse_args()
+
+    metrics_port = args.port + 1
+    workdir = tempfile.mkdtemp()
+    server = subprocess.Popen([sys.executable, os.path.join(REPO, "server.py"), "--port", str(args.port),
+                               "--engine", args.engine, "--ping-interval", str(args.interval),
+                               "--ping-timeout", str(args.timeout), "--metrics-port", str(metrics_port)],
+                              cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(args.port)
+        silent = [login(args.port, f"silent{i}") for i in range(args.silent)]
+        live = [login(args.port, f"live{i}") for i in range(args.live)]
+        pongs = []
+        live_closed = []
+        for sock in live:
+            threading.Thread(target=answer_pings, args=(sock, pongs, live_closed), daemon=True).start()
+        threads_before = server_threads(server.pid)
+        print(f"{args.silent + args.live} clients logged in, server has {threads_before} threads")
+
+        # Worst case: a full interval before the ping, the timeout, and a tick of slack on each
+        time.sleep(args.interval + args.timeout + 3)
+
+        closed = sum(is_closed(sock) for sock in silent)
+        alive = args.live - len(live_closed)
+        threads_after = server_threads(server.pid)
+        reaped = metric(metrics_port, "chat_reaped_connections_total")
+        open_connections = metric(metrics_port, "chat_open_connections")
+        print(f"silent clients disconnected: {closed}/{args.silent}")
+        print(f"answering clients still connected: {alive}/{args.live} ({len(pongs)} pongs)")
+        print(f"server threads: {threads_before} -> {threads_after}")
+        print(f"chat_reaped_connections_total {reaped:.0f}, chat_open_connections {open_connections:.0f}")
+        ok = (closed == args.silent and alive == args.live and reaped == args.silent
+              and open_connections == args.live)
+        print("OK" if ok else "FAILED")
+        for sock in silent + live:
+            sock.close()
+        sys.exit(0 if ok else 1)
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Throughput of ChatServer state under concurrent join/leave/broadcast.
+
+Worker threads log clients in, hop between a handful of rooms, broadcast
+into them and disconnect, some of them by failing a send midway through a
+broadcast. Reports the operations completed per second; the consistency
+of the room and client indexes under the same load is checked by
+tests/test_state_concurrency.py.
+
+    python benchmarks/stress_state.py [--threads N] [--seconds S]
+"""
+
+import argparse
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server import ChatServer  # noqa: E402
+
+ROOMS = [f"room{i}" for i in range(8)]
+
+
+class FakeConnection:
+    """In-memory client, optionally failing its sends like a dead socket"""
+
+    def __init__(self, flaky=False):
+        self.flaky = flaky
+        self.closed = False
+
+    def send(self, data):
+        if self.closed or (self.flaky and random.random() < 0.01):
+            raise ConnectionError("Connection reset")
+        return len(data)
+
+    def close(self):
+        self.closed = True
+
+
+def churn(server, names, deadline, counts):
+    ops = {"logins": 0, "joins": 0, "leaves": 0, "broadcasts": 0}
+    while time.monotonic() < deadline:
+        conn = FakeConnection(flaky=random.random() < 0.3)
+        if not server.login_client(conn, f"user{next(names)}"):
+            continue
+        ops["logins"] += 1
+        for _ in range(random.randint(1, 20)):
+            room = random.choice(ROOMS)
+            action = random.random()
+            if action < 0.4:
+                server.cmd_join_room(conn, [room])
+                ops["joins"] += 1
+            elif action < 0.6:
+                server.cmd_leave_room(conn, [room])
+                ops["leaves"] += 1
+            else:
+                server.broadcast("stress message", sender=conn, room=room)
+                ops["broadcasts"] += 1
+        server.remove_client(conn)
+    counts.append(ops)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=32, help="Concurrent worker threads")
+    parser.add_argument("--seconds", type=float, default=5.0, help="How long to run")
+    args = parser.parse_args()
+
+    server = ChatServer()
+    # Sit in on a room so there is always a long-lived member to fan out to
+    watcher = FakeConnection()
+    server.login_client(watcher, "watcher")
+    server.cmd_join_room(watcher, [ROOMS[0]])
+
+    names = itertools.count()
+    counts = []
+    start = time.monotonic()
+    workers = [threading.Thread(target=churn, args=(server, names, start + args.seconds, counts))
+               for _ in range(args.threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - start
+
+    totals = {op: sum(ops[op] for ops in counts) for op in counts[0]} if counts else {}
+    print(f"threads={args.threads} seconds={elapsed:.1f} ops/s={sum(totals.values()) / elapsed:,.0f}")
+    for op, total in totals.items():
+        print(f"  {op:<10} {total / elapsed:>12,.0f}/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Cross-process message bus for multi-worker chat servers.
+
+With --workers N the parent process forks N ChatServer workers that share
+the listening port through SO_REUSEPORT. Each worker is connected to the
+parent over a Unix domain socket pair. Workers publish events (room
+broadcasts, private messages, logins and logouts) as newline framed JSON
+and the parent's BusHub relays every event to all the other workers, so a
+room whose members landed on different workers still sees every message.
+"""
+
+import json
+import logging
+import queue
+import selectors
+import threading
+
+from framing import FrameDecoder, FrameTooLarge, encode_frame, iter_frames
+
+MAX_EVENT_SIZE = 1024 * 1024  # Largest event a worker may publish, in bytes
+MAX_OUTBOX = 64 * 1024 * 1024  # Bytes the hub queues for a worker before dropping its events
+
+
+class BusClient:
+    """A worker's end of the bus"""
+
+    def __init__(self, sock, worker_id):
+        self.sock = sock
+        self.worker_id = worker_id
+        self._outbox = queue.SimpleQueue()  # Frames for the writer thread, None to stop it
+        self._writer = None
+
+    def publish(self, op, **fields):
+        """Queue an event for every other worker, without waiting for it to be sent"""
+        fields["op"] = op
+        fields["worker"] = self.worker_id
+        self._outbox.put(encode_frame(json.dumps(fields, ensure_ascii=False)))
+
+    def start(self, callback):
+        """Deliver events published by other workers to callback on a reader thread"""
+        self._writer = threading.Thread(target=self._write, name="bus-writer", daemon=True)
+        self._writer.start()
+        threading.Thread(target=self._read, args=(callback,), name="bus-reader", daemon=True).start()
+
+    def stop(self, timeout=1.0):
+        """Send the events still queued, waiting at most timeout seconds"""
+        if self._writer is not None:
+            self._outbox.put(None)
+            self._writer.join(timeout)
+
+    def _write(self):
+        while True:
+            frames = [self._outbox.get()]
+            # Everything published meanwhile goes out in the same write
+            while not self._outbox.empty():
+                frames.append(self._outbox.get())
+            stopping = None in frames
+            try:
+                self.sock.sendall(b"".join(frame for frame in frames if frame is not None))
+            except OSError as e:
+                logging.error(f"Lost connection to the message bus: {e}")
+                return
+            if stopping:
+                return
+
+    def _read(self, callback):
+        try:
+            for frame in iter_frames(self.sock, FrameDecoder(MAX_EVENT_SIZE)):
+                try:
+                    callback(json.loads(frame))
+                except Exception as e:
+                    logging.error(f"Error handling bus event: {e}")
+        except OSError as e:
+            logging.error(f"Lost connection to the message bus: {e}")
+
+
+class BusHub:
+    """Parent side of the bus, relays each worker's events to all the others"""
+
+    def __init__(self, sockets):
+        self.selector = selectors.DefaultSelector()
+        self.running = False
+        for sock in sockets:
+            # Never wait on one worker, its events queue in its outbox until it reads them
+            sock.setblocking(False)
+            self.selector.register(sock, selectors.EVENT_READ, HubPeer())
+
+    def run(self):
+        """Relay events until every worker has disconnected or stop() is called"""
+        self.running = True
+        while self.running and self.selector.get_map():
+            for key, events in self.selector.select(timeout=1.0):
+                if events & selectors.EVENT_WRITE:
+                    self.send(key.fileobj, key.data)
+                if events & selectors.EVENT_READ and key.fileobj in self.selector.get_map():
+                    self.receive(key.fileobj, key.data)
+
+    def receive(self, sock, peer):
+        try:
+            data = sock.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        frames = []
+        if data:
+            try:
+                frames = peer.decoder.feed(data)
+            except FrameTooLarge as e:
+                # The rest of its stream cannot be framed reliably, so cut the worker off the bus
+                logging.error(f"Worker on fd {sock.fileno()} sent an event that is too large, disconnecting it: {e}")
+                data = b""
+        if not data:
+            self.selector.unregister(sock)
+            sock.close()
+            return
+        for frame in frames:
+            self.relay(encode_frame(frame), sock)
+
+    def relay(self, frame, origin):
+        for key in list(self.selector.get_map().values()):
+            if key.fileobj is not origin:
+                peer = key.data
+                if len(peer.outbox) + len(frame) > MAX_OUTBOX:
+                    if not peer.overflowing:
+                        logging.error(f"Worker on fd {key.fileobj.fileno()} is not reading the bus, dropping its events")
+                    peer.overflowing = True
+                    continue
+                peer.overflowing = False
+                peer.outbox += frame
+                if len(peer.outbox) == len(frame):
+                    # Nothing was waiting, so try to send straight away
+                    self.send(key.fileobj, peer)
+
+    def send(self, sock, peer):
+        """Write as much of a worker's outbox as its socket takes, and watch for room for the rest"""
+        try:
+            sent = sock.send(peer.outbox)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            peer.outbox.clear()  # Dead workers are unregistered once their EOF is read
+            sent = 0
+        del peer.outbox[:sent]
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if peer.outbox else 0)
+        if self.selector.get_key(sock).events != events:
+            self.selector.modify(sock, events, peer)
+
+    def stop(self, sig=None, frame=None):
+        self.running = False
+
+
+class HubPeer:
+    """The hub's state for one worker"""
+
+    def __init__(self):
+        self.decoder = FrameDecoder(MAX_EVENT_SIZE)
+        self.outbox = bytearray()  # Events not yet written to the worker
+        self.overflowing = False
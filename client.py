@@ -7,6 +7,9 @@ import datetime
 from queue import Queue
 import os
 
+from framing import encode_frame, iter_frames
+from heartbeat import PING_FRAME, PONG_FRAME
+
 class ChatClient:
     def __init__(self, host="127.0.0.1", port=9090):
         self.host = host
@@ -21,6 +24,7 @@ class ChatClient:
             "/list": "List all connected users",
             "/join": "Join a chat room: /join <room>",
             "/leave": "Leave a chat room: /leave <room>",
+            "/say": "Send a message to a room: /say <room> <message>",
             "/rooms": "List all active rooms",
             "/stats": "Show your chat statistics",
             "/clear": "Clear the screen",
@@ -62,7 +66,7 @@ class ChatClient:
                     os.system('clear' if os.name == 'posix' else 'cls')
                     self.display_welcome()
                 else:
-                    self.client.send(message.encode())
+                    self.client.sendall(encode_frame(message))
             except (EOFError, KeyboardInterrupt):
                 self.shutdown()
                 break
@@ -72,27 +76,27 @@ class ChatClient:
 
     def receive_messages(self):
         """Receive and display messages from the server"""
-        while self.connected:
-            try:
-                message = self.client.recv(1024).decode()
-                if not message:
-                    break
-                
+        try:
+            for message in iter_frames(self.client):
+                # Answer the server's heartbeat without showing it
+                if message == PING_FRAME:
+                    self.client.sendall(encode_frame(PONG_FRAME))
+                    continue
+
                 # Handle username prompt
-                if message.strip() == "👤 Enter your username: ":
-                    print(message, end='')
+                if message.strip().endswith("Enter your username:"):
+                    print(f"\r{message}", end='', flush=True)
                     continue
-                
+
                 # Clear line and print message
-                print(f"\r{message}", end='')
-                
+                print(f"\r{message}")
+
                 # Reprint the input prompt
                 print("> ", end='', flush=True)
-                
-            except Exception as e:
-                print(f"\n⚠️ Lost connection to server: {e}")
-                self.connected = False
-                break
+
+        except Exception as e:
+            print(f"\n⚠️ Lost connection to server: {e}")
+            self.connected = False
 
     def shutdown(self, sig=None, frame=None):
         """Gracefully shutdown the client"""
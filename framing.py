@@ -0,0 +1,57 @@
+"""Newline framing for the PyChat TCP protocol.
+
+Every message on the wire is UTF-8 text terminated by a newline. A
+FrameDecoder buffers whatever recv() returns and hands back complete frames
+only, so long messages, several messages arriving in one read and multibyte
+characters split across reads are all reassembled correctly. Multi-line
+messages (such as the /help text) arrive as one frame per line.
+"""
+
+MAX_FRAME_SIZE = 64 * 1024  # Longest frame a peer may send, in bytes
+RECV_SIZE = 64 * 1024  # Bytes requested from the socket per recv()
+
+
+class FrameTooLarge(ValueError):
+    """Raised when a peer sends a frame longer than the decoder allows"""
+
+
+def encode_frame(message):
+    """Encode a message as a newline terminated frame"""
+    return (message.rstrip("\n") + "\n").encode()
+
+
+class FrameDecoder:
+    """Incrementally split a byte stream into newline terminated frames"""
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """Buffer data and return the list of frames it completed"""
+        self._buffer += data
+        frames = []
+        start = 0
+        while True:
+            end = self._buffer.find(b"\n", start)
+            if end == -1:
+                break
+            if end - start > self.max_frame_size:
+                raise FrameTooLarge(f"Frame exceeds {self.max_frame_size} bytes")
+            # b"\n" never occurs inside a UTF-8 sequence, so a complete frame always decodes
+            frames.append(self._buffer[start:end].decode(errors="replace").rstrip("\r"))
+            start = end + 1
+        del self._buffer[:start]
+        if len(self._buffer) > self.max_frame_size:
+            raise FrameTooLarge(f"Frame exceeds {self.max_frame_size} bytes")
+        return frames
+
+
+def iter_frames(sock, decoder=None):
+    """Yield frames read from a blocking socket until the peer closes it"""
+    decoder = decoder or FrameDecoder()
+    while True:
+        data = sock.recv(RECV_SIZE)
+        if not data:
+            return
+        yield from decoder.feed(data)
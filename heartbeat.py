@@ -0,0 +1,148 @@
+"""Idle connection reaping for the TCP chat server.
+
+A Heartbeat sends PING_FRAME to connections quiet for `interval` seconds
+and reaps those that send nothing within `timeout` seconds. Deadlines sit
+on a hashed TimerWheel with O(1) schedule and cancel; traffic only updates
+a connection's last_seen. set_keepalive() turns on TCP keepalive.
+"""
+
+import logging
+import math
+import socket
+import threading
+import time
+
+from metrics import REGISTRY
+
+PING_FRAME = "/ping"  # Sent to a quiet client, which answers with PONG_FRAME
+PONG_FRAME = "/pong"
+DEFAULT_PING_INTERVAL = 30  # Seconds of silence before a client is pinged
+DEFAULT_PING_TIMEOUT = 30  # Seconds a pinged client has to answer before it is reaped
+DEFAULT_KEEPALIVE = 60  # Seconds of silence before the kernel starts TCP keepalive probes
+KEEPALIVE_PROBES = 5
+KEEPALIVE_PROBE_INTERVAL = 10
+
+PINGS = REGISTRY.counter("chat_pings_sent_total", "Heartbeat pings sent to quiet clients")
+REAPED = REGISTRY.counter("chat_reaped_connections_total",
+                          "Connections closed for not answering a ping, by whether they had logged in",
+                          ("stage",))
+
+
+def set_keepalive(sock, idle=DEFAULT_KEEPALIVE, interval=KEEPALIVE_PROBE_INTERVAL, probes=KEEPALIVE_PROBES):
+    """Turn on TCP keepalive with the given timings where the platform allows"""
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for option, value in (("TCP_KEEPIDLE", idle), ("TCP_KEEPINTVL", interval), ("TCP_KEEPCNT", probes)):
+            if hasattr(socket, option):
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+    except OSError:
+        pass  # Not a TCP socket (e.g. a socketpair in tests)
+
+
+class TimerWheel:
+    """Hashed timing wheel of items, each due at some tick"""
+
+    def __init__(self, tick=1.0, slots=256, now=None):
+        self.tick = tick
+        self._slots = [dict() for _ in range(slots)]  # [{item: due tick}]
+        self._where = {}  # {item: slot index}
+        self._current = self._tick_of(time.monotonic() if now is None else now)
+        self._lock = threading.Lock()
+
+    def _tick_of(self, now):
+        return int(now / self.tick)
+
+    def __len__(self):
+        return len(self._where)
+
+    def schedule(self, item, delay, now=None):
+        """(Re)schedule item to expire delay seconds from now"""
+        now = time.monotonic() if now is None else now
+        due = self._tick_of(now) + max(1, math.ceil(delay / self.tick))
+        with self._lock:
+            old = self._where.pop(item, None)
+            if old is not None:
+                self._slots[old].pop(item, None)
+            # Never behind the wheel, or the item would wait a whole turn
+            due = max(due, self._current + 1)
+            index = due % len(self._slots)
+            self._slots[index][item] = due
+            self._where[item] = index
+
+    def cancel(self, item):
+        with self._lock:
+            index = self._where.pop(item, None)
+            if index is not None:
+                self._slots[index].pop(item, None)
+
+    def advance(self, now=None):
+        """Move the wheel up to now and return the items that expired"""
+        target = self._tick_of(time.monotonic() if now is None else now)
+        expired = []
+        with self._lock:
+            # After a long stall, one full turn visits every slot
+            start = max(self._current + 1, target - len(self._slots) + 1)
+            for tick in range(start, target + 1):
+                slot = self._slots[tick % len(self._slots)]
+                # Items due on a later turn of the wheel stay put
+                due_now = [item for item, due in slot.items() if due <= target]
+                for item in due_now:
+                    del slot[item]
+                    del self._where[item]
+                expired.extend(due_now)
+            self._current = max(self._current, target)
+        return expired
+
+
+class Heartbeat:
+    """Pings quiet connections and reaps the ones that never answer.
+
+    send_ping(conn) and reap(conn) are supplied by the server. Connections
+    only need a writable last_seen attribute, a monotonic timestamp that the
+    server refreshes whenever data arrives.
+    """
+
+    def __init__(self, send_ping, reap, interval=DEFAULT_PING_INTERVAL, timeout=DEFAULT_PING_TIMEOUT, tick=1.0):
+        self.send_ping = send_ping
+        self.reap = reap
+        self.interval = interval
+        self.timeout = timeout
+        self.wheel = TimerWheel(tick)
+        self._pinged = {}  # {conn: when it was pinged}
+
+    def track(self, conn):
+        conn.last_seen = time.monotonic()
+        self.wheel.schedule(conn, self.interval)
+
+    def forget(self, conn):
+        self.wheel.cancel(conn)
+        self._pinged.pop(conn, None)
+
+    def check(self, now=None):
+        """Handle every connection whose deadline passed, return how many were reaped"""
+        now = time.monotonic() if now is None else now
+        reaped = 0
+        for conn in self.wheel.advance(now):
+            pinged_at = self._pinged.pop(conn, None)
+            idle = now - conn.last_seen
+            if pinged_at is not None and conn.last_seen < pinged_at:
+                reaped += 1
+                self.reap(conn)
+            elif idle < self.interval:
+                # Heard from since it was scheduled or pinged
+                self.wheel.schedule(conn, self.interval - idle, now)
+            else:
+                self._pinged[conn] = now
+                self.wheel.schedule(conn, self.timeout, now)
+                PINGS.inc()
+                self.send_ping(conn)
+        return reaped
+
+    def run(self):
+        """Check every tick, forever, for a background thread"""
+        while True:
+            time.sleep(self.wheel.tick)
+            try:
+                self.check()
+            except Exception as e:
+                logging.error(f"Heartbeat check failed: {e}")
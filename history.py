@@ -0,0 +1,269 @@
+"""Recent message history for chat rooms.
+
+Each room keeps its latest messages in a fixed-size, array-backed ring
+buffer, so appending is O(1) and memory per room is bounded no matter how
+busy the room gets. Only the most recently used rooms are kept in memory.
+When a directory is configured every message is also appended to a
+per-room segment file by a background writer thread, and a room's ring is
+filled in from the tail of its segments the first time it is replayed after
+a restart or an eviction.
+
+Messages are stored as the already framed bytes that went out on the wire,
+so a replay is a single concatenation handed to one write.
+"""
+
+import logging
+import os
+import queue
+import threading
+from collections import OrderedDict, deque
+from urllib.parse import quote
+
+DEFAULT_HISTORY = 50  # Messages kept and replayed per room
+MAX_ROOMS = 1000  # Rooms whose history stays in memory
+SEGMENT_SIZE = 4 * 1024 * 1024  # Bytes per segment file before it is rolled over
+DEFAULT_SHARDS = 64
+
+
+class RingBuffer:
+    """Fixed-size buffer that keeps the most recent items"""
+
+    __slots__ = ("_items", "_next", "_count")
+
+    def __init__(self, capacity):
+        self._items = [None] * capacity
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, item):
+        self._items[self._next] = item
+        self._next = (self._next + 1) % len(self._items)
+        if self._count < len(self._items):
+            self._count += 1
+
+    def latest(self, n=None):
+        """Return the last n items (all by default), oldest first"""
+        n = self._count if n is None else min(n, self._count)
+        start = self._next - n
+        if start >= 0:
+            return self._items[start:self._next]
+        return self._items[start:] + self._items[:self._next]
+
+
+class RoomRing(RingBuffer):
+    """A room's RingBuffer, counting how many of its frames are on disk"""
+
+    __slots__ = ("loaded", "appended", "written", "previous")
+
+    def __init__(self, capacity, loaded=True, previous=None):
+        super().__init__(capacity)
+        self.loaded = loaded  # False until older frames have been read back from the segments
+        self.appended = 0
+        self.written = 0  # Updated by the SegmentWriter under its lock
+        self.previous = previous  # The evicted ring of the same room, until it is settled
+
+    def append(self, item):
+        super().append(item)
+        self.appended += 1
+
+    def settled(self):
+        """Return True once every frame of this ring and of the rings it replaced is written"""
+        if self.appended > self.written:
+            return False
+        if self.appended:
+            # Frames are written in the order they were queued, so the older rings are done too
+            self.previous = None
+        return self.previous is None or self.previous.settled()
+
+    def unwritten(self):
+        """Return the frames still queued for the writer"""
+        pending = self.appended - self.written
+        return self.latest(pending) if pending else []
+
+    def load(self, older):
+        """Put frames recorded before this ring existed in front of its own"""
+        items = (list(older) + self.latest())[-len(self._items):]
+        self._items = items + [None] * (len(self._items) - len(items))
+        self._next = len(items) % len(self._items)
+        self._count = len(items)
+        self.loaded = True
+
+
+class RoomHistory:
+    """Ring buffers of recent messages for every room, optionally backed by disk.
+
+    Rooms are spread over a fixed number of shards, each with its own lock
+    and its own share of max_rooms, so messages to different rooms rarely
+    contend. Segment writes are queued for a SegmentWriter, and segments are
+    only read on a room's first replay and outside the shard lock, so
+    record() never waits on the disk.
+    """
+
+    def __init__(self, capacity=DEFAULT_HISTORY, directory=None, max_rooms=MAX_ROOMS, shards=DEFAULT_SHARDS):
+        self.capacity = capacity
+        self.directory = directory
+        self.max_rooms_per_shard = max(1, -(-max_rooms // shards))
+        # [{room_name: RoomRing}], least recently used first
+        self._shards = [OrderedDict() for _ in range(shards)]
+        # [{room_name: RoomRing}] evicted with frames still queued for the writer
+        self._evicted = [{} for _ in range(shards)]
+        self._locks = [threading.Lock() for _ in range(shards)]
+        self._writer = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._writer = SegmentWriter(self._segment_path, max_rooms)
+            self._writer.start()
+
+    def _shard(self, room):
+        return hash(room) % len(self._shards)
+
+    def record(self, room, frame):
+        """Append an encoded frame to room's history"""
+        index = self._shard(room)
+        with self._locks[index]:
+            ring = self._ring(index, room)
+            ring.append(frame)
+            if self._writer:
+                # Queued under the lock so a room's frames reach the writer in order
+                self._writer.write(room, frame, ring)
+
+    def replay(self, room, limit=None):
+        """Return the room's latest frames joined into one payload"""
+        index = self._shard(room)
+        with self._locks[index]:
+            ring = self._ring(index, room)
+            if ring.loaded:
+                return b"".join(ring.latest(limit))
+        older = self._read_older(room, ring)
+        with self._locks[index]:
+            if not ring.loaded:
+                ring.load(older)
+            return b"".join(ring.latest(limit))
+
+    def _ring(self, index, room):
+        rings = self._shards[index]
+        ring = rings.get(room)
+        if ring is None:
+            evicted = self._evicted[index]
+            previous = evicted.pop(room, None)
+            if previous and previous.settled():
+                previous = None
+            ring = rings[room] = RoomRing(self.capacity, not self._writer, previous)
+            if len(rings) > self.max_rooms_per_shard:
+                oldest, oldest_ring = rings.popitem(last=False)
+                if self._writer and not oldest_ring.settled():
+                    evicted[oldest] = oldest_ring
+                    if len(evicted) > self.max_rooms_per_shard:
+                        for name, old in list(evicted.items()):
+                            if old.settled():
+                                del evicted[name]
+        else:
+            rings.move_to_end(room)
+        return ring
+
+    def _read_older(self, room, ring):
+        """Return the room's frames recorded before ring was created, oldest first"""
+        with self._writer.lock:
+            # Holding the writer's lock keeps the files and the written counts in step
+            tail = list(self._read_tail(room))
+            older = tail[:max(0, len(tail) - ring.written)]
+            queued = []
+            previous = ring.previous
+            while previous:
+                queued[:0] = previous.unwritten()
+                previous = previous.previous
+        return older + queued
+
+    def _segment_path(self, room):
+        # Quote the name so a room can never point outside the history directory
+        return os.path.join(self.directory, quote(room, safe="") + ".log")
+
+    def _read_tail(self, room):
+        path = self._segment_path(room)
+        tail = deque(maxlen=self.capacity)
+        for segment in (path + ".1", path):
+            try:
+                with open(segment, "rb") as f:
+                    tail.extend(f)
+            except FileNotFoundError:
+                pass
+        return tail
+
+    def close(self):
+        """Write out queued frames and close the segment files"""
+        if self._writer:
+            self._writer.stop()
+
+
+class SegmentWriter(threading.Thread):
+    """Background thread that appends frames to per-room segment files.
+
+    Frames queued while it writes are written together, one buffered write
+    per room and a flush per batch, so a busy room costs a few syscalls per
+    batch rather than one per message.
+    """
+
+    def __init__(self, segment_path, max_open=MAX_ROOMS):
+        super().__init__(name="history-writer", daemon=True)
+        self.segment_path = segment_path  # room name -> path of its current segment
+        self.max_open = max_open
+        self.lock = threading.Lock()  # Held while segments are written and their rings' counts updated
+        self._queue = queue.SimpleQueue()  # (room, frame, RoomRing), or None to stop
+        self._files = OrderedDict()  # {room_name: open segment file}, least recently used first
+
+    def write(self, room, frame, ring):
+        self._queue.put((room, frame, ring))
+
+    def stop(self, timeout=5.0):
+        if self.is_alive():
+            self._queue.put(None)
+            self.join(timeout)
+
+    def run(self):
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            while not self._queue.empty():
+                batch.append(self._queue.get())
+            frames = {}  # {room_name: ([frames], {RoomRing: count})} in the order they were queued
+            for item in batch:
+                if item is None:
+                    running = False
+                    continue
+                room, frame, ring = item
+                room_frames, counts = frames.setdefault(room, ([], {}))
+                room_frames.append(frame)
+                counts[ring] = counts.get(ring, 0) + 1
+            for room, (room_frames, counts) in frames.items():
+                with self.lock:
+                    try:
+                        self._append(room, b"".join(room_frames))
+                    except OSError as e:
+                        logging.error(f"Could not write history of {room}: {e}")
+                        continue
+                    for ring, count in counts.items():
+                        ring.written += count
+        for segment in self._files.values():
+            segment.close()
+        self._files.clear()
+
+    def _append(self, room, data):
+        segment = self._files.get(room)
+        if segment is None:
+            segment = self._files[room] = open(self.segment_path(room), "ab")
+            if len(self._files) > self.max_open:
+                _, evicted = self._files.popitem(last=False)
+                evicted.close()
+        else:
+            self._files.move_to_end(room)
+        segment.write(data)
+        segment.flush()
+        if segment.tell() >= SEGMENT_SIZE:
+            # Roll over, keeping the previous segment for catch-up after a restart
+            segment.close()
+            path = self.segment_path(room)
+            os.replace(path, path + ".1")
+            self._files[room] = open(path, "ab")
@@ -0,0 +1,96 @@
+"""Non-blocking logging for the chat servers.
+
+setup_logging() gives the root logger a QueueHandler that puts records on a
+bounded queue, and one QueueListener thread formats and writes them to a
+size-rotated file and any extra handlers. Records that do not fit in the
+queue are dropped and counted. The CONNECTION_LOGGER logger keeps only a
+sample of its routine messages; its warnings and errors are always kept.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import random
+
+LOG_FORMAT = '%(asctime)s [%(levelname)s] %(message)s'
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024  # Log file size before it is rotated
+DEFAULT_BACKUPS = 5  # Rotated log files kept
+DEFAULT_QUEUE_SIZE = 10000  # Records waiting for the writer before new ones are dropped
+CONNECTION_LOGGER = 'chat.connections'
+
+_listener = None
+
+
+class SamplingFilter(logging.Filter):
+    """Lets through a fraction of records below WARNING and every record at or above it"""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking or erroring when the queue is full"""
+
+    def __init__(self, records):
+        super().__init__(records)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(path='chat_server.log', level=logging.INFO, max_bytes=DEFAULT_MAX_BYTES,
+                  backups=DEFAULT_BACKUPS, sample_rate=1.0, console=True, handlers=(),
+                  queue_size=DEFAULT_QUEUE_SIZE):
+    """Route the root logger through a queue to one background writer and return the listener
+
+    path is a size-rotated log file (None for no file), console adds a stderr
+    handler and handlers are extra handlers run on the writer thread. Calling
+    it again, e.g. in a forked worker, replaces the previous configuration.
+    """
+    global _listener
+    stop_logging()
+    formatter = logging.Formatter(LOG_FORMAT)
+    targets = []
+    if path:
+        targets.append(logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+                                                            encoding='utf-8', delay=True))
+    if console:
+        targets.append(logging.StreamHandler())
+    for handler in targets:
+        handler.setFormatter(formatter)
+    targets.extend(handlers)
+
+    records = queue.Queue(queue_size)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(DroppingQueueHandler(records))
+    root.setLevel(level)
+    logging.getLogger(CONNECTION_LOGGER).filters = [SamplingFilter(sample_rate)]
+
+    _listener = logging.handlers.QueueListener(records, *targets, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Write out every queued record and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,116 @@
+"""Bounded, indexed message storage for the web chat rooms.
+
+A MessageStore keeps a room's most recent messages in arrival order with an
+id -> position index, so looking up, editing or deleting a message is O(1)
+and the tail replayed on join is cheap to slice. Once a room holds more than
+its cap the oldest messages are evicted. Deleted messages leave a hole
+behind that is squeezed out once holes outnumber live messages, which keeps
+every operation amortized O(1).
+"""
+
+DEFAULT_ROOM_CAP = 500  # Messages kept per room
+
+
+class MessageStore:
+    """Most recent messages of one room, indexed by message id"""
+
+    def __init__(self, cap=DEFAULT_ROOM_CAP):
+        self.cap = cap
+        self._slots = []  # Messages in arrival order, None where one was deleted
+        self._head = 0  # Position of the oldest slot still in use
+        self._base = 0  # Sequence number of _slots[0]
+        self._holes = 0  # Deleted slots at or after _head
+        self._index = {}  # {message_id: sequence number}
+
+    def __len__(self):
+        return len(self._index)
+
+    def __iter__(self):
+        return (m for m in self._slots[self._head:] if m is not None)
+
+    def __contains__(self, message_id):
+        return message_id in self._index
+
+    def append(self, message):
+        """Store a message, evicting the oldest ones beyond the cap"""
+        self._index[message['id']] = self._base + len(self._slots)
+        self._slots.append(message)
+        while len(self._index) > self.cap:
+            self._evict_oldest()
+
+    def get(self, message_id):
+        seq = self._index.get(message_id)
+        return None if seq is None else self._slots[seq - self._base]
+
+    def edit(self, message_id, **changes):
+        """Update fields of a stored message in place, return it or None"""
+        message = self.get(message_id)
+        if message is not None:
+            message.update(changes)
+        return message
+
+    def delete(self, message_id):
+        """Remove a message, return it or None if it is not stored"""
+        seq = self._index.pop(message_id, None)
+        if seq is None:
+            return None
+        position = seq - self._base
+        message = self._slots[position]
+        self._slots[position] = None
+        self._holes += 1
+        self._compact()
+        return message
+
+    def tail(self, n):
+        """Return the last n messages, oldest first"""
+        return self.page(limit=n)[0]
+
+    def page(self, before_id=None, limit=50):
+        """Return up to limit messages older than before_id (newest page by default).
+
+        The result is (messages oldest first, whether older messages remain).
+        A before_id that is no longer stored yields an empty page.
+        """
+        if before_id is None:
+            position = len(self._slots)
+        else:
+            seq = self._index.get(before_id)
+            if seq is None:
+                return [], False
+            position = seq - self._base
+        result = []
+        position -= 1
+        while position >= self._head:
+            message = self._slots[position]
+            if message is not None:
+                if len(result) == limit:
+                    break
+                result.append(message)
+            position -= 1
+        result.reverse()
+        return result, position >= self._head
+
+    def _evict_oldest(self):
+        while True:
+            message = self._slots[self._head]
+            self._slots[self._head] = None
+            self._head += 1
+            if message is not None:
+                del self._index[message['id']]
+                break
+            self._holes -= 1
+        self._compact()
+
+    def _compact(self):
+        if self._holes > len(self._index):
+            # Mostly holes, rebuild the slots from the live messages
+            live = [m for m in self._slots[self._head:] if m is not None]
+            self._base += len(self._slots)
+            self._slots = live
+            self._head = self._holes = 0
+            self._index = {m['id']: self._base + i for i, m in enumerate(live)}
+        elif self._head > 64 and self._head * 2 > len(self._slots):
+            # Drop the evicted prefix once it is the larger half of the list
+            del self._slots[:self._head]
+            self._base += self._head
+            self._head = 0
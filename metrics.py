@@ -0,0 +1,220 @@
+"""Prometheus-style counters, gauges and histograms for the chat servers.
+
+Metrics live in the module-level REGISTRY and render() writes them in the
+Prometheus text format; server.py serves them with serve(), web_server.py
+from a route. Until enable() is called every update returns after a single
+flag check. Gauges given a function are only evaluated when scraped.
+"""
+
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, registry, name, help, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.samples())
+        return lines
+
+
+class Counter(Metric):
+    """Monotonically increasing count, optionally split by label values"""
+
+    kind = 'counter'
+
+    def __init__(self, registry, name, help, labelnames=()):
+        super().__init__(registry, name, help, labelnames)
+        self._values = {} if labelnames else {(): 0}
+
+    def inc(self, amount=1, labels=()):
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}'
+                for labels, value in values]
+
+
+class Gauge(Metric):
+    """Value that goes up and down, or is computed by func at scrape time"""
+
+    kind = 'gauge'
+
+    def __init__(self, registry, name, help, func=None):
+        super().__init__(registry, name, help)
+        self.func = func
+        self._value = 0
+
+    def inc(self, amount=1):
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        if self.registry.enabled:
+            self._value = value
+
+    def value(self):
+        if self.func is None:
+            return self._value
+        try:
+            return self.func()
+        except Exception as e:
+            logging.warning(f"Could not compute gauge {self.name}: {e}")
+            return float('nan')
+
+    def samples(self):
+        return [f'{self.name} {_format_value(self.value())}']
+
+
+class Histogram(Metric):
+    """Distribution of observed values over fixed buckets, optionally split by label values"""
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help, buckets=LATENCY_BUCKETS, labelnames=()):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # {label values: [counts per bucket with +Inf last, sum, count]}
+        self._series = {} if labelnames else {(): self._new_series()}
+
+    def _new_series(self):
+        return [[0] * (len(self.buckets) + 1), 0, 0]
+
+    def observe(self, value, labels=()):
+        if not self.registry.enabled:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = self._new_series()
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            series = sorted((labels, (list(counts), total, count))
+                            for labels, (counts, total, count) in self._series.items())
+        lines = []
+        for labels, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}')
+            suffix = _format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{suffix} {_format_value(total)}')
+            lines.append(f'{self.name}_count{suffix} {count}')
+        return lines
+
+
+class Registry:
+    """Every metric of one process"""
+
+    def __init__(self):
+        self.enabled = False
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            # Modules may be imported twice (e.g. as __main__), keep the first definition
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(self, name, help, labelnames))
+
+    def gauge(self, name, help, func=None):
+        return self._register(Gauge(self, name, help, func))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, labelnames=()):
+        return self._register(Histogram(self, name, help, buckets, labelnames))
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def enable(registry=REGISTRY):
+    registry.enabled = True
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes every few seconds would drown out the chat log
+
+
+def serve(port, host='', registry=REGISTRY):
+    """Enable metrics and serve /metrics over HTTP from a daemon thread, return the server"""
+    enable(registry)
+    handler = type('Handler', (MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logging.info(f"📈 Metrics on http://{host or '0.0.0.0'}:{port}/metrics")
+    return server
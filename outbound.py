@@ -0,0 +1,286 @@
+"""Bounded per-client outbound queues for the chat server.
+
+Frames for a client are appended to its OutboundQueue and written later,
+coalescing whatever piled up into one sendmsg() (writev) call. A queue that
+reaches the high-water mark applies the slow consumer policy:
+
+    drop        discard the oldest queued frames to make room for new ones
+    skip        discard the new frame, keep what is already queued
+    disconnect  drop the client altogether
+"""
+
+import logging
+import os
+import selectors
+import socket
+import threading
+from collections import deque
+from itertools import islice
+
+from metrics import REGISTRY
+
+DEFAULT_HIGH_WATER = 256 * 1024  # Bytes queued per client before the policy kicks in
+SLOW_CONSUMER_POLICIES = ("drop", "skip", "disconnect")
+MAX_BATCH = 64 * 1024  # Coalesced bytes after which a batch is written without waiting
+
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 64
+
+# Per-call non-blocking sends let the reader thread keep the socket blocking
+CAN_SEND_NONBLOCKING = hasattr(socket.socket, "sendmsg") and hasattr(socket, "MSG_DONTWAIT")
+
+DROPPED_FRAMES = REGISTRY.counter("chat_dropped_frames_total", "Frames discarded by the slow consumer policy",
+                                  ("policy",))
+SLOW_DISCONNECTS = REGISTRY.counter("chat_slow_consumer_disconnects_total",
+                                    "Clients disconnected for falling behind")
+
+
+class SlowConsumer(ConnectionError):
+    """Raised when a client under the disconnect policy falls too far behind"""
+
+
+class OutboundQueue:
+    """Encoded frames waiting to be written to one client"""
+
+    def __init__(self, high_water=DEFAULT_HIGH_WATER, policy="drop"):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.high_water = high_water
+        self.policy = policy
+        self.frames = deque()
+        self.pending = 0  # Unsent bytes across all frames
+        self.offset = 0  # Bytes of frames[0] already written
+        self.dropped = 0
+
+    def __bool__(self):
+        return bool(self.frames)
+
+    def push(self, data, backlog=0):
+        """Queue a frame, return False if the policy discarded it.
+
+        backlog counts bytes already buffered further down the line (e.g.
+        in an asyncio transport) so they also count against the high-water mark.
+        """
+        if self.pending + backlog + len(data) > self.high_water:
+            if self.policy == "disconnect":
+                SLOW_DISCONNECTS.inc()
+                raise SlowConsumer(f"{self.pending + backlog} bytes pending")
+            if self.policy == "skip":
+                self.dropped += 1
+                DROPPED_FRAMES.inc(1, ("skip",))
+                return False
+            # drop: make room by discarding the oldest frames, but never cut
+            # the partially written head frame in half
+            keep = 1 if self.offset else 0
+            dropped = self.dropped
+            while len(self.frames) > keep and self.pending + backlog + len(data) > self.high_water:
+                if keep:
+                    head = self.frames.popleft()
+                    victim = self.frames.popleft()
+                    self.frames.appendleft(head)
+                else:
+                    victim = self.frames.popleft()
+                self.pending -= len(victim)
+                self.dropped += 1
+            DROPPED_FRAMES.inc(self.dropped - dropped, ("drop",))
+        self.frames.append(data)
+        self.pending += len(data)
+        return True
+
+    def buffers(self, limit=IOV_MAX):
+        """Return up to limit unsent buffers, ready for sendmsg()"""
+        buffers = list(islice(self.frames, limit))
+        if self.offset:
+            buffers[0] = memoryview(buffers[0])[self.offset:]
+        return buffers
+
+    def consume(self, sent):
+        """Account for sent bytes written from the front of the queue"""
+        self.pending -= sent
+        sent += self.offset
+        while self.frames and sent >= len(self.frames[0]):
+            sent -= len(self.frames.popleft())
+        self.offset = sent
+
+    def clear(self):
+        self.frames.clear()
+        self.pending = self.offset = 0
+
+
+class OutboundConnection:
+    """A client socket whose writes go through an OutboundQueue.
+
+    Offers the recv()/send()/close() subset of the socket API that ChatServer
+    uses, so it can stand in for the raw socket. send() never blocks; the
+    Flusher thread writes the queued frames out.
+    """
+
+    def __init__(self, sock, flusher, high_water=DEFAULT_HIGH_WATER, policy="drop"):
+        self.sock = sock
+        self.flusher = flusher
+        self.queue = OutboundQueue(high_water, policy)
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def pending_bytes(self):
+        return self.queue.pending
+
+    def recv(self, bufsize):
+        return self.sock.recv(bufsize)
+
+    def send(self, data):
+        with self._lock:
+            if self.closed:
+                raise ConnectionError("Connection closed")
+            idle = not self.queue
+            try:
+                queued = self.queue.push(data)
+            except SlowConsumer:
+                logging.warning(f"Disconnecting slow consumer {self.peername()}")
+                raise
+        if idle and queued:
+            self.flusher.schedule(self)
+        return len(data) if queued else 0
+
+    def flush(self):
+        """Write whatever the socket accepts without blocking, return True once drained"""
+        with self._lock:
+            while self.queue:
+                buffers = self.queue.buffers()
+                if CAN_SEND_NONBLOCKING:
+                    try:
+                        sent = self.sock.sendmsg(buffers, [], socket.MSG_DONTWAIT)
+                    except (BlockingIOError, InterruptedError):
+                        return False
+                else:
+                    # No per-call non-blocking send here, fall back to a blocking write
+                    # on the flusher thread, which still keeps it off the sender's thread
+                    data = b"".join(buffers)
+                    self.sock.sendall(data)
+                    sent = len(data)
+                self.queue.consume(sent)
+                if self.queue.offset:
+                    return False
+            return True
+
+    def peername(self):
+        try:
+            return self.sock.getpeername()
+        except OSError:
+            return None
+
+    def close(self):
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+        # Last chance for queued goodbyes, without waiting on a slow peer
+        try:
+            if CAN_SEND_NONBLOCKING:
+                self.flush()
+        except OSError:
+            pass
+        with self._lock:
+            self.queue.clear()
+        try:
+            # shutdown() wakes up the handler thread blocked in recv()
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        # Before close(), so a new connection reusing the fd can be watched
+        self.flusher.discard(self)
+        self.sock.close()
+
+
+class Flusher(threading.Thread):
+    """Background thread that drains OutboundConnection queues.
+
+    Connections are flushed as soon as they have data queued. Those whose
+    socket buffer is full are parked on a selector until they become
+    writable again, so one slow reader never holds up anybody else.
+    """
+
+    def __init__(self):
+        super().__init__(name="outbound-flusher", daemon=True)
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._ready = deque()
+        self._waiting = set()  # Connections parked until their socket is writable
+        self._lock = threading.Lock()
+
+    def schedule(self, conn):
+        """Ask the flusher thread to write out conn's queue"""
+        with self._lock:
+            self._ready.append(conn)
+        try:
+            self._wakeup_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass  # A wakeup is already pending
+
+    def run(self):
+        while True:
+            for key, _ in self._selector.select():
+                if key.fileobj is self._wakeup_r:
+                    try:
+                        while self._wakeup_r.recv(4096):
+                            pass
+                    except (BlockingIOError, InterruptedError):
+                        pass
+                else:
+                    self.discard(key.data)
+                    self._flush(key.data)
+
+            with self._lock:
+                ready, self._ready = self._ready, deque()
+            for conn in ready:
+                if not conn.closed and conn not in self._waiting:
+                    self._flush(conn)
+
+    def discard(self, conn):
+        """Stop watching conn's socket for room to write"""
+        with self._lock:
+            self._unpark(conn)
+
+    def _flush(self, conn):
+        try:
+            drained = conn.flush()
+        except OSError:
+            # The handler thread sees the broken socket and cleans up
+            drained = True
+            with conn._lock:
+                conn.queue.clear()
+        if drained:
+            return
+        with self._lock:
+            # close() sets closed before it discards, so a socket parked here is always unparked
+            if conn.closed:
+                return
+            try:
+                self._selector.register(conn.sock, selectors.EVENT_WRITE, conn)
+                self._waiting.add(conn)
+                return
+            except (KeyError, ValueError, OSError) as e:
+                error = e
+        if conn.closed:
+            with conn._lock:
+                conn.queue.clear()
+        else:
+            # Try again rather than leave the queue with nobody to flush it
+            logging.warning(f"Could not watch {conn.peername()} for writing, retrying: {error!r}")
+            self.schedule(conn)
+
+    def _unpark(self, conn):
+        if conn in self._waiting:
+            self._waiting.discard(conn)
+            try:
+                self._selector.unregister(conn.sock)
+            except (KeyError, ValueError):
+                pass
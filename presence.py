@@ -0,0 +1,81 @@
+"""Versioned, debounced presence updates for the web chat.
+
+Joins and leaves are collected for a short window and sent as one
+'presence' delta carrying the version it applies on top of. A client whose
+version does not match asks for a full snapshot with 'presence_sync'. With
+a shared state store, versions come from the store's counter so deltas from
+every instance form one sequence.
+"""
+
+import threading
+
+DEFAULT_WINDOW = 0.25  # Seconds of changes coalesced into one delta
+
+
+class Presence:
+    """Tracks presence changes and emits them as batched, versioned deltas"""
+
+    def __init__(self, socketio, window=DEFAULT_WINDOW, state=None):
+        self.socketio = socketio
+        self.window = window
+        self.state = state  # Shared store holding the version counter, if any
+        self._version = 0
+        self._joined = {}  # {sid: serialized user} since the last delta
+        self._left = set()  # sids gone since the last delta
+        self._flush_scheduled = False
+        self._lock = threading.Lock()
+
+    def joined(self, sid, user):
+        with self._lock:
+            self._joined[sid] = user
+            self._schedule()
+
+    def left(self, sid):
+        with self._lock:
+            # Joined and left within the same window, nobody needs to hear about it
+            if self._joined.pop(sid, None) is None:
+                self._left.add(sid)
+            self._schedule()
+
+    @property
+    def version(self):
+        return self.state.counter('presence_version') if self.state else self._version
+
+    def snapshot(self, get_users):
+        """Full presence payload for a client that is new or out of date.
+
+        The version is read before get_users() is called, so a delta that
+        races with the snapshot is applied again by the client, never lost.
+        """
+        version = self.version
+        return {'version': version, 'users': get_users()}
+
+    def _schedule(self):
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.socketio.start_background_task(self._flush_later)
+
+    def _flush_later(self):
+        self.socketio.sleep(self.window)
+        self.flush()
+
+    def flush(self):
+        """Emit everything that changed since the last delta as one event."""
+        with self._lock:
+            self._flush_scheduled = False
+            if not (self._joined or self._left):
+                return
+            if self.state:
+                version = self.state.incr('presence_version')
+            else:
+                self._version += 1
+                version = self._version
+            delta = {
+                'version': version,
+                'base_version': version - 1,
+                'joined': list(self._joined.values()),
+                'left': list(self._left)
+            }
+            self._joined = {}
+            self._left = set()
+        self.socketio.emit('presence', delta)
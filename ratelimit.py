@@ -0,0 +1,98 @@
+"""Rate limits for the chat servers.
+
+TokenBucket refills lazily, so a check is a few arithmetic operations.
+RateLimiter keeps a bucket per key (a room, a Socket.IO sid) and prunes
+refilled buckets whenever it has doubled in size. A message over a limit is
+handled by one of SHED_POLICIES:
+
+    drop        discard it silently
+    notify      discard it and tell the sender, once per run of drops
+    disconnect  disconnect a client over its own limit (rooms fall back to notify)
+"""
+
+import time
+
+DEFAULT_RATE = 5  # Messages per second a connection may keep up
+DEFAULT_BURST = 20  # Messages a connection may send at once, e.g. a pasted paragraph
+DEFAULT_ROOM_RATE = 0  # Messages per second fanned out to one room, off unless asked for
+DEFAULT_ROOM_BURST = 200
+DEFAULT_TYPING_RATE = 2  # Typing notifications per second per connection
+DEFAULT_TYPING_BURST = 4
+DEFAULT_MAX_CONNECTIONS = 0  # Open connections allowed at once, no cap unless asked for
+SHED_POLICIES = ("drop", "notify", "disconnect")
+# At the connection cap, leave new connections in the listen backlog or accept and close them
+OVERLOAD_POLICIES = ("wait", "reject")
+MIN_PRUNE_SIZE = 1024
+
+
+class TokenBucket:
+    """Allows rate events per second on average and up to burst at once"""
+
+    __slots__ = ("rate", "burst", "tokens", "stamp", "denied")
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic() if now is None else now
+        self.denied = 0  # Events refused since the last one that was allowed
+
+    def take(self, cost=1, now=None):
+        """Take cost tokens and return True, or return False if there are not enough"""
+        now = time.monotonic() if now is None else now
+        tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if tokens >= cost:
+            self.tokens = tokens - cost
+            self.denied = 0
+            return True
+        self.tokens = tokens
+        self.denied += 1
+        return False
+
+    def refilled(self, now=None):
+        now = time.monotonic() if now is None else now
+        return self.tokens + (now - self.stamp) * self.rate >= self.burst
+
+
+class RateLimiter:
+    """A TokenBucket per key, created on first use.
+
+    Under the threads engine several threads may take from the same room
+    bucket at once. Updates are not locked, so racing threads can each get
+    a message through that the limit would have refused, which is an
+    acceptable error for a flood guard.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._prune_at = MIN_PRUNE_SIZE
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self._prune_at:
+                self.prune()
+            bucket = self._buckets.setdefault(key, TokenBucket(self.rate, self.burst))
+        return bucket
+
+    def allow(self, key):
+        return self.bucket(key).take()
+
+    def forget(self, key):
+        self._buckets.pop(key, None)
+
+    def prune(self, now=None):
+        """Drop the buckets that have refilled, return how many were dropped"""
+        now = time.monotonic() if now is None else now
+        full = [key for key, bucket in list(self._buckets.items()) if bucket.refilled(now)]
+        for key in full:
+            self._buckets.pop(key, None)
+        # Prune again only once the dict has doubled, so the scan is amortised over the insertions
+        self._prune_at = max(MIN_PRUNE_SIZE, 2 * len(self._buckets))
+        return len(full)
@@ -0,0 +1,414 @@
+"""Minimal Redis-protocol server for running several web servers locally.
+
+Implements just the commands web_server.py uses through Flask-SocketIO's
+message queue and shared_state.RedisState, keeping everything in memory, so
+scaling out can be tried without installing Redis:
+
+    python redis_standin.py --port 6379
+    CHAT_MESSAGE_QUEUE=redis://localhost:6379/0 CHAT_PORT=5000 python web_server.py
+    CHAT_MESSAGE_QUEUE=redis://localhost:6379/0 CHAT_PORT=5001 python web_server.py
+
+It has no persistence, authentication or eviction and is not meant for
+production; use a real Redis (6.2 or newer) there.
+"""
+
+import argparse
+import fnmatch
+import logging
+import socket
+import threading
+import time
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class Status(str):
+    """Simple string reply, e.g. +OK"""
+
+
+class Push(list):
+    """Out of band pub/sub message, a push in RESP3 and an array in RESP2"""
+
+
+OK = Status("OK")
+PONG = Status("PONG")
+
+
+def encode(value, resp=2):
+    """Serialize a reply in RESP2 or, after HELLO 3, in RESP3"""
+    if value is None:
+        return b"_\r\n" if resp == 3 else b"$-1\r\n"
+    if isinstance(value, Status):
+        return b"+%s\r\n" % value.encode()
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, Exception):
+        return f"-ERR {value}\r\n".encode()
+    if isinstance(value, dict):
+        if resp == 3:
+            return b"%%%d\r\n" % len(value) + b"".join(encode(k, resp) + encode(v, resp) for k, v in value.items())
+        value = [item for pair in value.items() for item in pair]
+    if isinstance(value, (list, tuple, set)):
+        kind = b">" if resp == 3 and isinstance(value, Push) else b"*"
+        return kind + b"%d\r\n" % len(value) + b"".join(encode(v, resp) for v in value)
+    if isinstance(value, str):
+        value = value.encode()
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+class Store:
+    """Keyspace shared by every connection, guarded by one lock"""
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}  # {key: deadline}
+        self.channels = {}  # {channel: set of Connection}
+        self.lock = threading.RLock()
+
+    def get(self, key, kind=None, create=False):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self.data.pop(key, None)
+            del self.expires[key]
+        value = self.data.get(key)
+        if value is None and create:
+            value = self.data[key] = kind()
+        if value is not None and kind is not None and not isinstance(value, kind):
+            raise ProtocolError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def prune(self, key):
+        # Like Redis, empty containers do not exist
+        if not self.data.get(key, True):
+            del self.data[key]
+            self.expires.pop(key, None)
+
+
+class Connection:
+    def __init__(self, sock, store):
+        self.sock = sock
+        self.store = store
+        self.subscriptions = set()
+        self.resp = 2  # Protocol version, switched by HELLO
+        self.send_lock = threading.Lock()
+        self.buffer = b""
+
+    def send(self, value):
+        payload = encode(value, self.resp)
+        with self.send_lock:
+            self.sock.sendall(payload)
+
+    def read_line(self):
+        while b"\r\n" not in self.buffer:
+            data = self.sock.recv(65536)
+            if not data:
+                raise ConnectionError
+            self.buffer += data
+        line, self.buffer = self.buffer.split(b"\r\n", 1)
+        return line
+
+    def read_exact(self, size):
+        while len(self.buffer) < size + 2:
+            data = self.sock.recv(65536)
+            if not data:
+                raise ConnectionError
+            self.buffer += data
+        value, self.buffer = self.buffer[:size], self.buffer[size + 2:]
+        return value
+
+    def read_command(self):
+        line = self.read_line()
+        if not line.startswith(b"*"):
+            return line.decode().split()  # Inline command, e.g. from telnet
+        args = []
+        for _ in range(int(line[1:])):
+            header = self.read_line()
+            if not header.startswith(b"$"):
+                raise ProtocolError("expected a bulk string")
+            args.append(self.read_exact(int(header[1:])).decode())
+        return args
+
+    def serve(self):
+        try:
+            while True:
+                args = self.read_command()
+                if not args:
+                    continue
+                try:
+                    reply = self.execute(args[0].upper(), args[1:])
+                except ProtocolError as e:
+                    reply = e
+                except (IndexError, ValueError):
+                    reply = ProtocolError(f"wrong arguments for '{args[0]}' command")
+                if reply is not NotImplemented:
+                    self.send(reply)
+        except (ConnectionError, OSError, ProtocolError):
+            pass
+        finally:
+            with self.store.lock:
+                for channel in self.subscriptions:
+                    self.store.channels.get(channel, set()).discard(self)
+            self.sock.close()
+
+    def execute(self, command, args):
+        store = self.store
+        if command in ("SUBSCRIBE", "UNSUBSCRIBE"):
+            return self.subscribe(command, args)
+        if command == "HELLO":
+            if args and args[0] not in ("2", "3"):
+                raise ProtocolError("NOPROTO unsupported protocol version")
+            self.resp = int(args[0]) if args else self.resp
+            return {"server": "redis", "version": "7.0.0", "proto": self.resp, "mode": "standalone",
+                    "role": "master", "modules": []}
+        if command == "PING":
+            if self.subscriptions and self.resp == 2:
+                return ["pong", args[0] if args else ""]
+            return args[0] if args else PONG
+        if command in ("CLIENT", "SELECT", "AUTH"):
+            return OK
+        if command == "ECHO":
+            return args[0]
+        with store.lock:
+            handler = COMMANDS.get(command)
+            if handler is None:
+                raise ProtocolError(f"unknown command '{command}'")
+            return handler(store, *args)
+
+    def subscribe(self, command, args):
+        with self.store.lock:
+            channels = args or list(self.subscriptions)
+            for channel in channels:
+                if command == "SUBSCRIBE":
+                    self.subscriptions.add(channel)
+                    self.store.channels.setdefault(channel, set()).add(self)
+                else:
+                    self.subscriptions.discard(channel)
+                    self.store.channels.get(channel, set()).discard(self)
+                self.send(Push([command.lower(), channel, len(self.subscriptions)]))
+        return NotImplemented  # Replies already sent, one per channel
+
+
+def _publish(store, channel, message):
+    receivers = list(store.channels.get(channel, ()))
+    for connection in receivers:
+        try:
+            connection.send(Push(["message", channel, message]))
+        except OSError:
+            pass
+    return len(receivers)
+
+
+def _set(store, key, value, *options):
+    store.data[key] = value
+    store.expires.pop(key, None)
+    return OK
+
+
+def _get(store, key):
+    return store.get(key, str)
+
+
+def _delete(store, *keys):
+    removed = sum(1 for key in keys if store.get(key) is not None)
+    for key in keys:
+        store.data.pop(key, None)
+        store.expires.pop(key, None)
+    return removed
+
+
+def _exists(store, *keys):
+    return sum(1 for key in keys if store.get(key) is not None)
+
+
+def _expire(store, key, seconds):
+    if store.get(key) is None:
+        return 0
+    store.expires[key] = time.monotonic() + int(seconds)
+    return 1
+
+
+def _incrby(store, key, amount=1):
+    value = int(store.get(key, str) or 0) + int(amount)
+    store.data[key] = str(value)
+    return value
+
+
+def _hset(store, key, *pairs):
+    table = store.get(key, dict, create=True)
+    added = 0
+    for field, value in zip(pairs[::2], pairs[1::2]):
+        added += field not in table
+        table[field] = value
+    return added
+
+
+def _hsetnx(store, key, field, value):
+    table = store.get(key, dict, create=True)
+    if field in table:
+        return 0
+    table[field] = value
+    return 1
+
+
+def _hget(store, key, field):
+    return (store.get(key, dict) or {}).get(field)
+
+
+def _hmget(store, key, *fields):
+    table = store.get(key, dict) or {}
+    return [table.get(field) for field in fields]
+
+
+def _hdel(store, key, *fields):
+    table = store.get(key, dict) or {}
+    removed = sum(1 for field in fields if table.pop(field, None) is not None)
+    store.prune(key)
+    return removed
+
+
+def _hexists(store, key, field):
+    return int(field in (store.get(key, dict) or {}))
+
+
+def _hgetall(store, key):
+    return dict(store.get(key, dict) or {})
+
+
+def _hvals(store, key):
+    return list((store.get(key, dict) or {}).values())
+
+
+def _sadd(store, key, *members):
+    members_set = store.get(key, set, create=True)
+    added = len(set(members) - members_set)
+    members_set.update(members)
+    return added
+
+
+def _srem(store, key, *members):
+    members_set = store.get(key, set) or set()
+    removed = len(members_set & set(members))
+    members_set.difference_update(members)
+    store.prune(key)
+    return removed
+
+
+def _scard(store, key):
+    return len(store.get(key, set) or ())
+
+
+def _smembers(store, key):
+    return list(store.get(key, set) or ())
+
+
+def _rpush(store, key, *values):
+    items = store.get(key, list, create=True)
+    items.extend(values)
+    return len(items)
+
+
+def _lpop(store, key, count=None):
+    items = store.get(key, list)
+    if not items:
+        return None
+    n = 1 if count is None else int(count)
+    popped, items[:n] = items[:n], []
+    store.prune(key)
+    return popped[0] if count is None else popped
+
+
+def _llen(store, key):
+    return len(store.get(key, list) or ())
+
+
+def _lrange(store, key, start, stop):
+    items = store.get(key, list) or []
+    start, stop = int(start), int(stop)
+    stop = len(items) if stop == -1 else stop + 1
+    return items[start:stop]
+
+
+def _lrem(store, key, count, value):
+    items = store.get(key, list) or []
+    count = int(count)
+    removed = 0
+    i = 0
+    while i < len(items) and (count <= 0 or removed < count):
+        if items[i] == value:
+            del items[i]
+            removed += 1
+        else:
+            i += 1
+    store.prune(key)
+    return removed
+
+
+def _keys(store, pattern):
+    return [key for key in list(store.data) if store.get(key) is not None and fnmatch.fnmatchcase(key, pattern)]
+
+
+def _flushall(store, *options):
+    store.data.clear()
+    store.expires.clear()
+    return OK
+
+
+COMMANDS = {
+    "PUBLISH": _publish,
+    "SET": _set,
+    "GET": _get,
+    "DEL": _delete,
+    "EXISTS": _exists,
+    "EXPIRE": _expire,
+    "INCR": _incrby,
+    "INCRBY": _incrby,
+    "HSET": _hset,
+    "HSETNX": _hsetnx,
+    "HGET": _hget,
+    "HMGET": _hmget,
+    "HDEL": _hdel,
+    "HEXISTS": _hexists,
+    "HGETALL": _hgetall,
+    "HVALS": _hvals,
+    "SADD": _sadd,
+    "SREM": _srem,
+    "SCARD": _scard,
+    "SMEMBERS": _smembers,
+    "RPUSH": _rpush,
+    "LPOP": _lpop,
+    "LLEN": _llen,
+    "LRANGE": _lrange,
+    "LREM": _lrem,
+    "KEYS": _keys,
+    "FLUSHALL": _flushall,
+    "FLUSHDB": _flushall,
+}
+
+
+def serve(host="127.0.0.1", port=6379):
+    store = Store()
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((host, port))
+    server.listen(128)
+    logging.info(f"Redis stand-in listening on {host}:{port}")
+    try:
+        while True:
+            sock, _ = server.accept()
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=Connection(sock, store).serve, daemon=True).start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="In-memory Redis-protocol stand-in for local development")
+    parser.add_argument("--host", default="127.0.0.1", help="Host to bind to")
+    parser.add_argument("--port", type=int, default=6379, help="Port to bind to")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    serve(args.host, args.port)
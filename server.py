@@ -1,77 +1,138 @@
+import asyncio
 import socket
 import threading
 import logging
 import json
 import datetime
 import argparse
+import os
 import signal
 import sys
-from collections import defaultdict
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    handlers=[
-        logging.FileHandler('chat_server.log'),
-        logging.StreamHandler()
-    ]
-)
+import time
+
+from bus import BusClient, BusHub
+from framing import FrameDecoder, FrameTooLarge, encode_frame, iter_frames
+from heartbeat import (DEFAULT_KEEPALIVE, DEFAULT_PING_INTERVAL, DEFAULT_PING_TIMEOUT, PING_FRAME, PONG_FRAME, REAPED,
+                       Heartbeat, set_keepalive)
+from history import DEFAULT_HISTORY, RoomHistory
+from logqueue import CONNECTION_LOGGER, DEFAULT_BACKUPS, DEFAULT_MAX_BYTES, setup_logging, stop_logging
+from metrics import REGISTRY, SIZE_BUCKETS, serve as serve_metrics
+from outbound import (DEFAULT_HIGH_WATER, MAX_BATCH, SLOW_CONSUMER_POLICIES, Flusher,
+                      OutboundConnection, OutboundQueue, SlowConsumer)
+from ratelimit import (DEFAULT_BURST, DEFAULT_MAX_CONNECTIONS, DEFAULT_RATE, DEFAULT_ROOM_BURST, DEFAULT_ROOM_RATE,
+                       OVERLOAD_POLICIES, SHED_POLICIES, RateLimiter, TokenBucket)
+from state import ChatState
+
+# Connects and disconnects, sampled by --log-sample
+conn_log = logging.getLogger(CONNECTION_LOGGER)
+
+# Served on --metrics-port, no-ops until then
+ACCEPTED = REGISTRY.counter("chat_connections_accepted_total", "TCP connections accepted")
+OPEN_CONNECTIONS = REGISTRY.gauge("chat_open_connections", "TCP connections currently open")
+MESSAGES = REGISTRY.counter("chat_messages_total", "Messages and commands received from logged in clients")
+FANOUT = REGISTRY.histogram("chat_broadcast_recipients", "Clients a broadcast was queued for", SIZE_BUCKETS)
+BROADCAST_SECONDS = REGISTRY.histogram("chat_broadcast_seconds", "Time to queue a broadcast for every recipient")
+SEND_FAILURES = REGISTRY.counter("chat_send_failures_total", "Sends that failed and removed the client")
+RATE_LIMITED = REGISTRY.counter("chat_rate_limited_total", "Messages shed for going over a rate limit", ("scope",))
+REJECTED = REGISTRY.counter("chat_connections_rejected_total", "Connections turned away at the connection cap")
+
+_timestamp_cache = (None, "")
+
+
+def timestamp():
+    """Current time as HH:MM:SS, formatted at most once per second"""
+    global _timestamp_cache
+    now = int(time.time())
+    second, text = _timestamp_cache
+    if second != now:
+        text = datetime.datetime.fromtimestamp(now).strftime("%H:%M:%S")
+        _timestamp_cache = (now, text)
+    return text
+
 
 class ChatServer:
-    def __init__(self, host="localhost", port=9090):
+    def __init__(self, host="localhost", port=9090, high_water=DEFAULT_HIGH_WATER, slow_policy="drop",
+                 history=DEFAULT_HISTORY, history_dir=None, metrics_port=None,
+                 ping_interval=DEFAULT_PING_INTERVAL, ping_timeout=DEFAULT_PING_TIMEOUT, keepalive=DEFAULT_KEEPALIVE,
+                 rate=DEFAULT_RATE, burst=DEFAULT_BURST, room_rate=DEFAULT_ROOM_RATE, room_burst=DEFAULT_ROOM_BURST,
+                 shed_policy="notify", max_connections=DEFAULT_MAX_CONNECTIONS, overload="wait", backlog=100):
         self.host = host
         self.port = port
         self.server = None
-        self.clients = {}  # {client_socket: {"username": str, "join_time": datetime, "msgs_sent": int}}
-        self.rooms = defaultdict(set)  # {room_name: set(client_sockets)}
+        self.high_water = high_water  # Max bytes queued per client
+        self.slow_policy = slow_policy  # What to do when a client hits high_water
+        self.flusher = None
+        self.state = ChatState()  # Connected clients and room membership
+        self.bus = None  # BusClient when running as one of several worker processes
+        self.remote_users = {}  # {username: worker_id} for users logged in on other workers
+        # Last messages of each room, replayed on /join
+        self.history = RoomHistory(history, history_dir) if history else None
+        self.metrics_port = metrics_port  # Serve /metrics on this port, None to leave metrics off
+        self.keepalive = keepalive  # Seconds before TCP keepalive probes start, 0 to leave them off
+        # Pings clients quiet for ping_interval seconds and reaps those that do not answer
+        self.heartbeat = None
+        if ping_interval:
+            self.heartbeat = Heartbeat(self.send_ping, self.reap_client, ping_interval, ping_timeout)
+        # Messages per second per connection and per room, 0 for no limit
+        self.rate = rate
+        self.burst = burst
+        self.room_limits = RateLimiter(room_rate, room_burst) if room_rate else None
+        self.shed_policy = shed_policy  # What to do with a message over a limit
+        self.max_connections = max_connections  # Open connections allowed at once, 0 for no cap
+        self.overload = overload  # What to do with new connections at the cap
+        self.backlog = backlog  # Connections the kernel queues while we are not accepting
+        self.slots = None  # Semaphore of the engine, one slot per open connection under the cap
         self.commands = {
             "/help": self.cmd_help,
             "/msg": self.cmd_private_message,
             "/list": self.cmd_list_users,
             "/join": self.cmd_join_room,
             "/leave": self.cmd_leave_room,
+            "/say": self.cmd_say_room,
             "/rooms": self.cmd_list_rooms,
             "/stats": self.cmd_show_stats
         }
-        
-        # Setup logging
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s [%(levelname)s] %(message)s',
-            handlers=[
-                logging.FileHandler('chat_server.log'),
-                logging.StreamHandler()
-            ]
-        )
-
 
     def setup_server(self):
         """Initialize and setup the server socket"""
         try:
             self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.bus:
+                # Workers share the port, the kernel spreads new connections across them
+                self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             # Use an empty string for the host to bind to all available interfaces
             self.server.bind(("", self.port))
-            self.server.listen(100)  # Support up to 100 pending connections
+            # Connections waiting to be accepted, including those held back at the connection cap
+            self.server.listen(self.backlog)
             logging.info(f"🔥 Chat server started on {self.host}:{self.port} 🔥")
             return True
         except Exception as e:
             logging.error(f"Failed to start server: {e}")
             return False
 
-    def broadcast(self, message, sender=None, room=None):
+    def broadcast(self, message, sender=None, room=None, relay=True):
         """Send message to all clients in a room or all clients if room is None"""
-        timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-        formatted_message = f"[{timestamp}] {message}"
-        
-        targets = self.rooms[room] if room else self.clients.keys()
+        if relay and self.bus:
+            self.bus.publish("broadcast", message=message, room=room)
+
+        start = time.perf_counter()
+        # Serialize once, every recipient queues the same immutable payload
+        payload = encode_frame(f"[{timestamp()}] {message}")
+        if room and self.history:
+            self.history.record(room, payload)
+
+        # Both are snapshots, safe to iterate while other threads join or leave
+        targets = self.state.members(room) if room else self.state.client_list()
         for client in targets:
             if client != sender:
                 try:
-                    client.send(formatted_message.encode())
+                    client.send(payload)
                 except:
+                    SEND_FAILURES.inc()
                     self.remove_client(client)
+        FANOUT.observe(len(targets))
+        BROADCAST_SECONDS.observe(time.perf_counter() - start)
 
     def handle_client_commands(self, client, message):
         """Handle special commands starting with /"""
@@ -97,6 +158,7 @@ Available Commands:
 /list - List all connected users
 /join <room> - Join a chat room
 /leave <room> - Leave a chat room
+/say <room> <message> - Send a message to a room you joined
 /rooms - List all active rooms
 /stats - Show your chat statistics
         """
@@ -110,21 +172,27 @@ Available Commands:
 
         target_username = args[0]
         message = " ".join(args[1:])
-        sender_username = self.clients[client]["username"]
+        info = self.state.get(client)
+        if info is None:
+            return  # Removed meanwhile by a failed send on another thread
+        sender_username = info["username"]
 
-        for c, info in self.clients.items():
-            if info["username"] == target_username:
-                timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-                self.send_to_client(c, f"[{timestamp}] 💌 Private from {sender_username}: {message}")
-                self.send_to_client(client, f"[{timestamp}] 💌 Private to {target_username}: {message}")
-                return
+        target = self.state.find(target_username)
+        if target is not None:
+            self.send_to_client(target, f"💌 Private from {sender_username}: {message}")
+        elif self.bus and target_username in self.remote_users:
+            self.bus.publish("private", to=target_username, message=f"💌 Private from {sender_username}: {message}")
+        else:
+            self.send_to_client(client, f"⚠️ User {target_username} not found")
+            return
 
-        self.send_to_client(client, f"⚠️ User {target_username} not found")
+        self.send_to_client(client, f"💌 Private to {target_username}: {message}")
 
     def cmd_list_users(self, client, args):
         """List all connected users"""
         users = [f"{info['username']} (joined at {info['join_time'].strftime('%H:%M:%S')})"
-                for info in self.clients.values()]
+                for info in list(self.state.clients.values())]
+        users += [f"{username} (on worker {worker})" for username, worker in list(self.remote_users.items())]
         self.send_to_client(client, "Connected users:\n" + "\n".join(users))
 
     def cmd_join_room(self, client, args):
@@ -134,10 +202,38 @@ Available Commands:
             return
         
         room = args[0]
-        self.rooms[room].add(client)
-        username = self.clients[client]["username"]
-        self.broadcast(f"👋 {username} joined the room!", sender=client, room=room)
+        if not self.state.join(client, room):
+            return
+        backlog = self.history.replay(room) if self.history else b""
+        info = self.state.get(client)
+        if info is None:
+            return  # Removed meanwhile by a failed send on another thread
+        self.broadcast(f"👋 {info['username']} joined the room!", sender=client, room=room)
         self.send_to_client(client, f"You joined room: {room}")
+        if backlog:
+            # Catch up on the room in a single write
+            try:
+                client.send(backlog)
+            except:
+                self.remove_client(client)
+
+    def cmd_say_room(self, client, args):
+        """Send a message to a room"""
+        if len(args) < 2:
+            self.send_to_client(client, "Usage: /say <room> <message>")
+            return
+
+        room = args[0]
+        if client not in self.state.members(room):
+            self.send_to_client(client, f"⚠️ You are not in room {room}. Use /join {room} first")
+            return
+        if not self.room_allows(client, room):
+            return
+        info = self.state.get(client)
+        if info is None:
+            return  # Removed meanwhile by a failed send on another thread
+        info["msgs_sent"] += 1
+        self.broadcast(f"📁 {room} | {info['username']}: {' '.join(args[1:])}", sender=client, room=room)
 
     def cmd_leave_room(self, client, args):
         """Leave a chat room"""
@@ -146,32 +242,30 @@ Available Commands:
             return
         
         room = args[0]
-        if room in self.rooms and client in self.rooms[room]:
-            self.rooms[room].remove(client)
-            username = self.clients[client]["username"]
-            self.broadcast(f"👋 {username} left the room!", sender=client, room=room)
+        if self.state.leave(client, room):
+            info = self.state.get(client)
+            if info is None:
+                return  # Removed meanwhile by a failed send on another thread
+            self.broadcast(f"👋 {info['username']} left the room!", sender=client, room=room)
             self.send_to_client(client, f"You left room: {room}")
-            
-            # Clean up empty rooms
-            if not self.rooms[room]:
-                del self.rooms[room]
 
     def cmd_list_rooms(self, client, args):
         """List all active chat rooms"""
-        if not self.rooms:
+        rooms = self.state.rooms()
+        if not rooms:
             self.send_to_client(client, "No active rooms")
             return
-            
+
         room_info = []
-        for room, members in self.rooms.items():
-            users = [self.clients[c]["username"] for c in members]
+        for room, members in rooms:
+            users = [info["username"] for info in map(self.state.get, members) if info]
             room_info.append(f"📁 {room} ({len(users)} users): {', '.join(users)}")
         self.send_to_client(client, "Active rooms:\n" + "\n".join(room_info))
 
     def cmd_show_stats(self, client, args):
         """Show user statistics"""
-        if client in self.clients:
-            info = self.clients[client]
+        info = self.state.get(client)
+        if info:
             stats = f"""
 Your Chat Statistics:
 Username: {info['username']}
@@ -183,92 +277,455 @@ Messages sent: {info['msgs_sent']}
     def send_to_client(self, client, message):
         """Send a message to a specific client"""
         try:
-            timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-            client.send(f"[{timestamp}] {message}\n".encode())
+            client.send(encode_frame(f"[{timestamp()}] {message}"))
         except:
             self.remove_client(client)
 
+    def send_ping(self, client):
+        """Ping a client that has been silent, dropping it if the send fails"""
+        try:
+            client.send(encode_frame(PING_FRAME))
+        except:
+            self.remove_client(client)
+
+    def reap_client(self, client):
+        """Disconnect a client that did not answer a ping"""
+        info = self.state.get(client)
+        REAPED.inc(1, ("chat" if info else "login",))
+        conn_log.warning(f"Reaping {info['username'] if info else 'unnamed connection'}: no answer to ping")
+        self.remove_client(client)
+        client.close()
+
+    def track(self, client, sock):
+        """Start watching a new connection for silence and floods"""
+        client.bucket = TokenBucket(self.rate, self.burst) if self.rate else None
+        if self.keepalive:
+            set_keepalive(sock, self.keepalive)
+        if self.heartbeat:
+            self.heartbeat.track(client)
+        else:
+            client.last_seen = time.monotonic()
+
+    def login_client(self, client, username):
+        """Register a client under the given username, return False if it is taken"""
+        # Store client info
+        info = {
+            "username": username,
+            "join_time": datetime.datetime.now(),
+            "msgs_sent": 0
+        }
+        if username in self.remote_users or not self.state.add_client(client, info):
+            self.send_to_client(client, "⚠️ Username already taken. Please choose another: ")
+            return False
+        if self.bus:
+            self.bus.publish("login", username=username)
+
+        # Welcome messages
+        self.send_to_client(client, f"✅ Welcome {username}! Type /help for available commands.")
+        self.broadcast(f"🎉 {username} joined the chat!\n", client)
+        return True
+
+    def shed(self, client, bucket, scope, room=None):
+        """Apply the shedding policy to a message that went over a rate limit"""
+        RATE_LIMITED.inc(1, (scope,))
+        if self.shed_policy == "disconnect" and scope == "connection":
+            info = self.state.get(client)
+            conn_log.warning(f"Disconnecting {info['username'] if info else 'unnamed connection'}: flooding")
+            self.send_to_client(client, "⚠️ Too many messages, disconnecting.")
+            self.remove_client(client)
+            client.close()
+        elif self.shed_policy != "drop" and bucket.denied == 1:
+            # Once per run of dropped messages, or the notices would be a flood of their own
+            if scope == "room":
+                self.send_to_client(client, f"⚠️ {room or 'The chat'} is busy, your messages are being dropped.")
+            else:
+                self.send_to_client(client, "⚠️ Slow down, your messages are being dropped.")
+
+    def room_allows(self, client, room):
+        """Take a token for a message fanned out to room (None for everyone), shedding it if there is none"""
+        if self.room_limits is None:
+            return True
+        bucket = self.room_limits.bucket(room)
+        if bucket.take():
+            return True
+        self.shed(client, bucket, "room", room)
+        return False
+
+    def handle_message(self, client, message):
+        """Dispatch a message from a logged in client to a command or the chat"""
+        MESSAGES.inc()
+        bucket = client.bucket
+        if bucket is not None and not bucket.take():
+            self.shed(client, bucket, "connection")
+            return
+        if message.startswith('/'):
+            if not self.handle_client_commands(client, message):
+                self.send_to_client(client, "⚠️ Unknown command. Type /help for available commands.")
+        elif self.room_allows(client, None):
+            info = self.state.get(client)
+            if info is None:
+                return  # Removed meanwhile by a failed send on another thread
+            info["msgs_sent"] += 1
+            self.broadcast(f"{info['username']}: {message}\n", client)
+
     def handle_client(self, client):
         """Handle individual client connection"""
         try:
+            frames = self.heard_frames(client)
+
             # Get username
             self.send_to_client(client, "👤 Enter your username: ")
-            username = client.recv(1024).decode().strip()
-            
-            # Check for duplicate username
-            while any(info["username"] == username for info in self.clients.values()):
-                self.send_to_client(client, "⚠️ Username already taken. Please choose another: ")
-                username = client.recv(1024).decode().strip()
-            
-            # Store client info
-            self.clients[client] = {
-                "username": username,
-                "join_time": datetime.datetime.now(),
-                "msgs_sent": 0
-            }
-            
-            # Welcome messages
-            self.send_to_client(client, f"✅ Welcome {username}! Type /help for available commands.")
-            self.broadcast(f"🎉 {username} joined the chat!\n", client)
-            
+            for username in frames:
+                if username.strip() and self.login_client(client, username.strip()):
+                    break
+
             # Main message loop
-            while True:
-                message = client.recv(1024).decode().strip()
+            for message in frames:
+                if client.closed:
+                    break  # Disconnected by the heartbeat or for flooding
+                message = message.strip()
                 if message:
-                    if message.startswith('/'):
-                        if not self.handle_client_commands(client, message):
-                            self.send_to_client(client, "⚠️ Unknown command. Type /help for available commands.")
-                    else:
-                        self.clients[client]["msgs_sent"] += 1
-                        username = self.clients[client]["username"]
-                        self.broadcast(f"{username}: {message}\n", client)
+                    self.handle_message(client, message)
+        except FrameTooLarge:
+            self.send_to_client(client, "⚠️ Message too long, disconnecting.")
         except:
-            self.remove_client(client)
+            pass
+        self.remove_client(client)
+        client.close()
+        if self.heartbeat:
+            self.heartbeat.forget(client)
+        if self.slots:
+            self.slots.release()
+        OPEN_CONNECTIONS.dec()
+
+    def heard_frames(self, client):
+        """Frames from a client, noting when it was last heard from and swallowing pongs"""
+        for frame in iter_frames(client):
+            client.last_seen = time.monotonic()
+            if frame != PONG_FRAME:
+                yield frame
 
     def remove_client(self, client):
         """Remove a client and clean up their data"""
-        if client in self.clients:
-            username = self.clients[client]["username"]
-            # Remove from all rooms
-            for room in list(self.rooms.keys()):
-                if client in self.rooms[room]:
-                    self.rooms[room].remove(client)
-                if not self.rooms[room]:
-                    del self.rooms[room]
-            
-            # Remove client and notify others
-            del self.clients[client]
+        # Only the first caller gets the info back, so concurrent removals are harmless
+        info = self.state.remove_client(client)
+        if info:
+            username = info["username"]
+            if self.bus:
+                self.bus.publish("logout", username=username)
+            # Notify others
             self.broadcast(f"⚠️ {username} left the chat.\n")
             client.close()
-            logging.info(f"Client disconnected: {username}")
+            conn_log.info(f"Client disconnected: {username}")
+
+    def handle_bus_event(self, event):
+        """Apply an event published by another worker process"""
+        op = event["op"]
+        if op == "broadcast":
+            self.broadcast(event["message"], room=event["room"], relay=False)
+        elif op == "private":
+            target = self.state.find(event["to"])
+            if target is not None:
+                self.send_to_client(target, event["message"])
+        elif op == "login":
+            self.remote_users[event["username"]] = event["worker"]
+        elif op == "logout":
+            self.remote_users.pop(event["username"], None)
+
+    def close_clients(self):
+        """Notify and disconnect every connected client"""
+        for client in self.state.client_list():
+            self.send_to_client(client, "⚠️ Server is shutting down...")
+            self.remove_client(client)
 
     def shutdown(self, sig=None, frame=None):
         """Gracefully shutdown the server"""
         logging.info("Shutting down server...")
-        for client in list(self.clients.keys()):
-            self.send_to_client(client, "⚠️ Server is shutting down...")
-            self.remove_client(client)
+        self.close_clients()
         if self.server:
             self.server.close()
+        if self.history:
+            self.history.close()
         logging.info("Server shutdown complete")
         sys.exit(0)
 
-    def run(self):
+    def start_metrics(self):
+        """Serve /metrics on metrics_port, with gauges read from this server when scraped"""
+        def queued():
+            return [client.pending_bytes() for client in self.state.client_list()]
+
+        REGISTRY.gauge("chat_logged_in_users", "Users logged in on this server", lambda: len(self.state))
+        REGISTRY.gauge("chat_rooms", "Rooms with at least one member", lambda: len(self.state.rooms()))
+        REGISTRY.gauge("chat_send_queue_bytes", "Bytes queued for all clients", lambda: sum(queued()))
+        REGISTRY.gauge("chat_send_queue_max_bytes", "Bytes queued for the client furthest behind",
+                       lambda: max(queued(), default=0))
+        serve_metrics(self.metrics_port)
+
+    def run(self, engine="threads"):
         """Main server loop"""
         if not self.setup_server():
             return
+        if self.metrics_port:
+            self.start_metrics()
 
+        if engine == "asyncio":
+            self.run_asyncio()
+        else:
+            self.run_threads()
+
+    def run_threads(self):
+        """Serve every client from its own thread"""
         # Setup signal handlers for graceful shutdown
         signal.signal(signal.SIGINT, self.shutdown)
         signal.signal(signal.SIGTERM, self.shutdown)
 
+        self.flusher = Flusher()
+        self.flusher.start()
+        if self.bus:
+            self.bus.start(self.handle_bus_event)
+        if self.heartbeat:
+            threading.Thread(target=self.heartbeat.run, name="heartbeat", daemon=True).start()
+        if self.max_connections:
+            self.slots = threading.Semaphore(self.max_connections)
+        # Hold off accepting at the cap, so new connections queue in the kernel's listen backlog
+        hold_back = self.slots is not None and self.overload == "wait"
+
         while True:
+            if hold_back:
+                self.slots.acquire()
+            admitted = hold_back  # Whether this connection holds a slot
             try:
-                client, address = self.server.accept()
-                logging.info(f"New connection from {address}")
+                sock, address = self.server.accept()
+                if self.slots and not admitted:
+                    if not self.slots.acquire(blocking=False):
+                        self.reject(sock, address)
+                        continue
+                    admitted = True
+                conn_log.info(f"New connection from {address}")
+                ACCEPTED.inc()
+                OPEN_CONNECTIONS.inc()
+                client = OutboundConnection(sock, self.flusher, self.high_water, self.slow_policy)
+                self.track(client, sock)
                 threading.Thread(target=self.handle_client, args=(client,), daemon=True).start()
             except Exception as e:
                 logging.error(f"Error accepting connection: {e}")
+                if admitted:
+                    self.slots.release()
+
+    def run_asyncio(self):
+        """Serve every client from a single asyncio event loop"""
+        asyncio.run(self.serve_asyncio())
+        logging.info("Server shutdown complete")
+
+    async def serve_asyncio(self):
+        """Accept connections on the event loop until SIGINT/SIGTERM"""
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        if self.bus:
+            self.bus.start(lambda event: loop.call_soon_threadsafe(self.handle_bus_event, event))
+
+        if self.max_connections:
+            self.slots = asyncio.Semaphore(self.max_connections)
+        accepting = loop.create_task(self.accept_asyncio())
+        if self.heartbeat:
+            # Pings and reaps happen on the loop, like every other write
+            heartbeat = loop.create_task(self.heartbeat_loop())
+        await stop.wait()
+        accepting.cancel()
+        if self.heartbeat:
+            heartbeat.cancel()
+        logging.info("Shutting down server...")
+        self.server.close()
+        self.close_clients()
+        if self.history:
+            self.history.close()
+        # Give the transports a chance to flush the goodbye notices
+        await asyncio.sleep(0.1)
+
+    async def accept_asyncio(self):
+        """Accept connections on the loop, holding off at the connection cap like run_threads"""
+        loop = asyncio.get_running_loop()
+        self.server.setblocking(False)
+        hold_back = self.slots is not None and self.overload == "wait"
+        while True:
+            if hold_back:
+                await self.slots.acquire()
+            admitted = hold_back  # Whether this connection holds a slot
+            try:
+                sock, address = await loop.sock_accept(self.server)
+                if self.slots and not admitted:
+                    if self.slots.locked():
+                        self.reject(sock, address)
+                        continue
+                    await self.slots.acquire()  # A slot is free, so this returns at once
+                    admitted = True
+                await loop.connect_accepted_socket(lambda: AsyncioClient(self), sock)
+            except Exception as e:
+                logging.error(f"Error accepting connection: {e}")
+                if admitted:
+                    self.slots.release()
+
+
+    def reject(self, sock, address):
+        """Turn away a connection accepted while the server is at its connection cap"""
+        REJECTED.inc()
+        conn_log.warning(f"Rejecting connection from {address}: {self.max_connections} connections open")
+        try:
+            sock.sendall(encode_frame(f"[{timestamp()}] ⚠️ Server is full, please try again later."))
+        except OSError:
+            pass
+        sock.close()
+
+    async def heartbeat_loop(self):
+        """Run the heartbeat checks on the event loop, once per timer wheel tick"""
+        while True:
+            await asyncio.sleep(self.heartbeat.wheel.tick)
+            try:
+                self.heartbeat.check()
+            except Exception as e:
+                logging.error(f"Heartbeat check failed: {e}")
+
+
+class AsyncioClient(asyncio.Protocol):
+    """A client connection served by the asyncio engine.
+
+    Exposes the same send()/close() surface as a socket so the ChatServer
+    commands and broadcast work unchanged on either engine.
+    """
+
+    def __init__(self, chat_server):
+        self.chat_server = chat_server
+        self.transport = None
+        self.decoder = FrameDecoder()
+        self.queue = OutboundQueue(chat_server.high_water, chat_server.slow_policy)
+        self.flush_scheduled = False
+        self.logged_in = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.loop = asyncio.get_running_loop()
+        self.chat_server.track(self, transport.get_extra_info("socket"))
+        conn_log.info(f"New connection from {transport.get_extra_info('peername')}")
+        ACCEPTED.inc()
+        OPEN_CONNECTIONS.inc()
+        self.chat_server.send_to_client(self, "👤 Enter your username: ")
+
+    def data_received(self, data):
+        self.last_seen = time.monotonic()
+        try:
+            for message in self.decoder.feed(data):
+                message = message.strip()
+                if self.transport.is_closing():
+                    break  # Disconnected by the heartbeat or for flooding
+                if not message or message == PONG_FRAME:
+                    continue
+                if not self.logged_in:
+                    self.logged_in = self.chat_server.login_client(self, message)
+                else:
+                    self.chat_server.handle_message(self, message)
+        except FrameTooLarge:
+            self.chat_server.send_to_client(self, "⚠️ Message too long, disconnecting.")
+            self.chat_server.remove_client(self)
+            self.close()
+        except Exception as e:
+            logging.error(f"Error handling client message: {e}")
+            self.chat_server.remove_client(self)
+
+    def connection_lost(self, exc):
+        OPEN_CONNECTIONS.dec()
+        self.chat_server.remove_client(self)
+        if self.chat_server.heartbeat:
+            self.chat_server.heartbeat.forget(self)
+        if self.chat_server.slots:
+            self.chat_server.slots.release()
+
+    def pending_bytes(self):
+        # Frames handed to the transport but not yet written count as queued too
+        return self.queue.pending + self.transport.get_write_buffer_size()
+
+    def send(self, data):
+        # A closing transport is cleaned up by connection_lost
+        if self.transport.is_closing():
+            return 0
+        try:
+            queued = self.queue.push(data, self.transport.get_write_buffer_size())
+        except SlowConsumer:
+            logging.warning(f"Disconnecting slow consumer {self.transport.get_extra_info('peername')}")
+            raise
+        if self.queue.pending >= MAX_BATCH:
+            self.flush()
+        elif queued and not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.loop.call_soon(self.flush)
+        return len(data) if queued else 0
+
+    def flush(self):
+        """Hand every frame queued during this loop iteration to the transport in one write"""
+        self.flush_scheduled = False
+        if self.queue and not self.transport.is_closing():
+            self.transport.writelines(self.queue.frames)
+        self.queue.clear()
+
+    def close(self):
+        self.flush()
+        self.transport.close()
+
+
+def run_workers(count, engine, log_kwargs=None, **server_kwargs):
+    """Fork count ChatServer workers and relay messages between them until they exit"""
+    pairs = [socket.socketpair() for _ in range(count)]
+    pids = []
+    for worker_id, (hub_end, worker_end) in enumerate(pairs):
+        pid = os.fork()
+        if pid == 0:
+            for other_hub_end, other_worker_end in pairs:
+                other_hub_end.close()
+                if other_worker_end is not worker_end:
+                    other_worker_end.close()
+            if server_kwargs.get("history_dir"):
+                # Every worker sees every room message, so each keeps its own segments
+                server_kwargs["history_dir"] = os.path.join(server_kwargs["history_dir"], f"worker{worker_id}")
+            if server_kwargs.get("metrics_port"):
+                # One scrape target per worker, on consecutive ports
+                server_kwargs["metrics_port"] += worker_id
+            if log_kwargs is not None:
+                # The writer thread does not survive fork(), and rotating one file from
+                # several processes would lose lines, so each worker gets its own log
+                log_kwargs = dict(log_kwargs)
+                if log_kwargs.get("path"):
+                    base, ext = os.path.splitext(log_kwargs["path"])
+                    log_kwargs["path"] = f"{base}.worker{worker_id}{ext}"
+                setup_logging(**log_kwargs)
+            try:
+                server = ChatServer(**server_kwargs)
+                server.bus = BusClient(worker_end, worker_id)
+                try:
+                    server.run(engine)
+                finally:
+                    # Logouts published while shutting down still reach the other workers
+                    server.bus.stop()
+            finally:
+                # os._exit() skips atexit, write out queued log records first
+                stop_logging()
+                os._exit(0)
+        pids.append(pid)
+        worker_end.close()
+    logging.info(f"Started {count} workers: {pids}")
+
+    hub = BusHub([hub_end for hub_end, _ in pairs])
+    # Workers handle SIGINT/SIGTERM themselves, the hub just stops relaying
+    signal.signal(signal.SIGINT, hub.stop)
+    signal.signal(signal.SIGTERM, hub.stop)
+    hub.run()
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in pids:
+        os.waitpid(pid, 0)
 
 
 if __name__ == "__main__":
@@ -276,8 +733,65 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Advanced Python Chat Server")
     parser.add_argument("--host", default="127.0.0.1run", help="Host to bind to")
     parser.add_argument("--port", type=int, default=9090, help="Port to bind to")
+    parser.add_argument("--engine", choices=["asyncio", "threads"], default="threads",
+                        help="Serve clients from one event loop or one thread per client")
+    parser.add_argument("--high-water", type=int, default=DEFAULT_HIGH_WATER,
+                        help="Bytes queued per client before the slow consumer policy applies")
+    parser.add_argument("--slow-consumer", choices=SLOW_CONSUMER_POLICIES, default="drop",
+                        help="Drop old frames, skip new frames or disconnect clients that fall behind")
+    parser.add_argument("--history", type=int, default=DEFAULT_HISTORY,
+                        help="Messages kept per room and replayed on /join, 0 to disable")
+    parser.add_argument("--history-dir", help="Also append room messages to segment files in this directory")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes sharing the port through SO_REUSEPORT")
+    parser.add_argument("--log-file", default="chat_server.log", help="Log file, rotated by size")
+    parser.add_argument("--log-max-bytes", type=int, default=DEFAULT_MAX_BYTES,
+                        help="Size the log file reaches before it is rotated")
+    parser.add_argument("--log-backups", type=int, default=DEFAULT_BACKUPS, help="Rotated log files kept")
+    parser.add_argument("--log-sample", type=float, default=1.0,
+                        help="Fraction of per-connection log lines kept, warnings and errors are always kept")
+    parser.add_argument("--ping-interval", type=int, default=DEFAULT_PING_INTERVAL,
+                        help="Seconds a client may stay silent before it is pinged, 0 to never reap idle clients")
+    parser.add_argument("--ping-timeout", type=int, default=DEFAULT_PING_TIMEOUT,
+                        help="Seconds a pinged client has to answer before it is disconnected")
+    parser.add_argument("--keepalive", type=int, default=DEFAULT_KEEPALIVE,
+                        help="Seconds of silence before TCP keepalive probes start, 0 to turn them off")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE,
+                        help="Messages per second a client may keep up, 0 for no limit")
+    parser.add_argument("--burst", type=int, default=DEFAULT_BURST, help="Messages a client may send at once")
+    parser.add_argument("--room-rate", type=float, default=DEFAULT_ROOM_RATE,
+                        help="Messages per second sent to one room (or the main chat) per worker, "
+                             "off by default, the main chat is shared by every user")
+    parser.add_argument("--room-burst", type=int, default=DEFAULT_ROOM_BURST, help="Messages sent to one room at once")
+    parser.add_argument("--shed", choices=SHED_POLICIES, default="notify",
+                        help="Drop messages over a rate limit, drop them and tell the sender, or disconnect flooders")
+    parser.add_argument("--max-connections", type=int, default=DEFAULT_MAX_CONNECTIONS,
+                        help="Connections open at once per worker, no cap by default")
+    parser.add_argument("--overload", choices=OVERLOAD_POLICIES, default="wait",
+                        help="At the cap, leave new connections waiting in the backlog or turn them away")
+    parser.add_argument("--backlog", type=int, default=100, help="Connections the kernel queues until accepted")
+    parser.add_argument("--metrics-port", type=int,
+                        help="Serve Prometheus metrics on http://host:PORT/metrics (worker N uses PORT+N)")
     args = parser.parse_args()
+    if args.workers > 1 and not (hasattr(os, "fork") and hasattr(socket, "SO_REUSEPORT")):
+        parser.error("--workers needs fork() and SO_REUSEPORT support")
+    if not 0 <= args.log_sample <= 1:
+        parser.error("--log-sample must be between 0 and 1")
+
+    # All log output goes through one background writer thread
+    log_kwargs = dict(path=args.log_file, max_bytes=args.log_max_bytes, backups=args.log_backups,
+                      sample_rate=args.log_sample)
+    setup_logging(**log_kwargs)
 
     # Start server
-    server = ChatServer(args.host, args.port)
-    server.run()
\ No newline at end of file
+    server_kwargs = dict(host=args.host, port=args.port, high_water=args.high_water,
+                         slow_policy=args.slow_consumer, history=args.history, history_dir=args.history_dir,
+                         metrics_port=args.metrics_port, ping_interval=args.ping_interval,
+                         ping_timeout=args.ping_timeout, keepalive=args.keepalive, rate=args.rate, burst=args.burst,
+                         room_rate=args.room_rate, room_burst=args.room_burst, shed_policy=args.shed,
+                         max_connections=args.max_connections, overload=args.overload, backlog=args.backlog)
+    if args.workers > 1:
+        run_workers(args.workers, args.engine, log_kwargs, **server_kwargs)
+    else:
+        server = ChatServer(**server_kwargs)
+        server.run(args.engine)
\ No newline at end of file
@@ -0,0 +1,261 @@
+"""Users, rooms and room history for one or many web_server.py instances.
+
+A single instance keeps everything in process (LocalState). To run several
+instances behind a load balancer, point CHAT_MESSAGE_QUEUE at a Redis URL:
+Flask-SocketIO then fans every emit out to all instances through Redis
+pub/sub, and RedisState keeps what the instances have to agree on in Redis:
+online users, room metadata and membership, each room's recent messages and
+the presence version counter. Any server that speaks the Redis protocol
+works, including redis_standin.py for local development.
+
+Socket.IO needs sticky sessions, so each sid is served by exactly one
+instance and only that instance writes its user record. Users are kept in a
+hash per instance that expires unless the instance keeps refreshing it, so
+the users of an instance that dies drop out of the online list.
+"""
+
+import json
+import threading
+import time
+import uuid
+
+from message_store import DEFAULT_ROOM_CAP, MessageStore
+
+try:
+    import redis
+except ImportError:  # Only needed with a message queue
+    redis = None
+
+KEY_PREFIX = 'chat:'
+INSTANCE_TTL = 30  # Seconds an instance's users stay listed without a refresh
+
+
+class LocalState:
+    """State of a single web server instance, kept in process"""
+
+    def __init__(self, room_cap=DEFAULT_ROOM_CAP):
+        self.room_cap = room_cap
+        self._users = {}  # {sid: serialized user}
+        self._rooms = {}  # {room_name: metadata}
+        self._members = {}  # {room_name: set of usernames}
+        self._messages = {}  # {room_name: MessageStore}
+        self._counters = {}
+
+    def set_user(self, sid, user):
+        self._users[sid] = user
+
+    def remove_user(self, sid):
+        self._users.pop(sid, None)
+
+    def users(self):
+        return list(self._users.values())
+
+    def find_sids(self, username):
+        return [sid for sid, u in self._users.items() if u.get('username') == username]
+
+    def create_room(self, name, meta):
+        """Add a room, return False if it already exists."""
+        if name in self._rooms:
+            return False
+        self._rooms[name] = meta
+        return True
+
+    def room(self, name):
+        return self._rooms.get(name)
+
+    def rooms(self):
+        return dict(self._rooms)
+
+    def add_member(self, room, username):
+        self._members.setdefault(room, set()).add(username)
+
+    def remove_member(self, room, username):
+        self._members.get(room, set()).discard(username)
+
+    def member_count(self, room):
+        return len(self._members.get(room, ()))
+
+    def messages(self, room):
+        store = self._messages.get(room)
+        if store is None:
+            store = self._messages[room] = MessageStore(self.room_cap)
+        return store
+
+    def incr(self, name):
+        self._counters[name] = self._counters.get(name, 0) + 1
+        return self._counters[name]
+
+    def counter(self, name):
+        return self._counters.get(name, 0)
+
+
+class RedisMessageStore:
+    """MessageStore interface over a Redis list of message ids and a hash of messages"""
+
+    def __init__(self, client, key, cap=DEFAULT_ROOM_CAP):
+        self.redis = client
+        self.cap = cap
+        self._ids = key + ':ids'
+        self._messages = key + ':messages'
+
+    def __len__(self):
+        return self.redis.llen(self._ids)
+
+    def __contains__(self, message_id):
+        return bool(self.redis.hexists(self._messages, message_id))
+
+    def append(self, message):
+        """Store a message, evicting the oldest ones beyond the cap"""
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hset(self._messages, message['id'], json.dumps(message))
+        pipe.rpush(self._ids, message['id'])
+        length = pipe.execute()[1]
+        if length > self.cap:
+            # LPOP is atomic, so instances appending at once never evict the same id twice
+            evicted = self.redis.lpop(self._ids, length - self.cap)
+            if evicted:
+                self.redis.hdel(self._messages, *evicted)
+
+    def get(self, message_id):
+        data = self.redis.hget(self._messages, message_id)
+        return None if data is None else json.loads(data)
+
+    def edit(self, message_id, **changes):
+        """Update fields of a stored message, return it or None"""
+        message = self.get(message_id)
+        if message is not None:
+            message.update(changes)
+            self.redis.hset(self._messages, message_id, json.dumps(message))
+        return message
+
+    def delete(self, message_id):
+        """Remove a message, return it or None if it is not stored"""
+        message = self.get(message_id)
+        if message is not None:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hdel(self._messages, message_id)
+            pipe.lrem(self._ids, 1, message_id)
+            pipe.execute()
+        return message
+
+    def tail(self, n):
+        """Return the last n messages, oldest first"""
+        return self.page(limit=n)[0]
+
+    def page(self, before_id=None, limit=50):
+        """Return up to limit messages older than before_id (newest page by default).
+
+        The result is (messages oldest first, whether older messages remain).
+        """
+        # The id list is bounded by the cap, so fetching it whole is cheap
+        ids = self.redis.lrange(self._ids, 0, -1)
+        if before_id is None:
+            end = len(ids)
+        else:
+            try:
+                end = ids.index(before_id)
+            except ValueError:
+                return [], False
+        start = max(end - limit, 0)
+        if start == end:
+            return [], False
+        found = self.redis.hmget(self._messages, ids[start:end])
+        return [json.loads(m) for m in found if m is not None], start > 0
+
+
+class RedisState:
+    """State shared by every web server instance through Redis"""
+
+    def __init__(self, url, room_cap=DEFAULT_ROOM_CAP, prefix=KEY_PREFIX):
+        if redis is None:
+            raise RuntimeError('A Redis message queue needs the redis package (pip install redis)')
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.room_cap = room_cap
+        self.prefix = prefix
+        self.instance = uuid.uuid4().hex
+        self._users_key = f'{prefix}users:{self.instance}'
+        self._refresher = None
+
+    def set_user(self, sid, user):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hset(self._users_key, sid, json.dumps(user))
+        pipe.expire(self._users_key, INSTANCE_TTL)
+        pipe.sadd(self.prefix + 'instances', self.instance)
+        pipe.execute()
+        if self._refresher is None:
+            self._refresher = threading.Thread(target=self._refresh, name='state-refresh', daemon=True)
+            self._refresher.start()
+
+    def _refresh(self):
+        # Keep this instance's users listed for as long as the process lives. Re-adding
+        # the instance also heals a prune that raced with its first user being added.
+        while True:
+            time.sleep(INSTANCE_TTL / 3)
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                pipe.expire(self._users_key, INSTANCE_TTL)
+                pipe.sadd(self.prefix + 'instances', self.instance)
+                pipe.execute()
+            except redis.RedisError:
+                pass
+
+    def remove_user(self, sid):
+        self.redis.hdel(self._users_key, sid)
+
+    def _all_users(self):
+        """{instance: {sid: user json}} for every live instance"""
+        instances = self.redis.smembers(self.prefix + 'instances')
+        pipe = self.redis.pipeline(transaction=False)
+        for instance in instances:
+            pipe.hgetall(f'{self.prefix}users:{instance}')
+        result = dict(zip(instances, pipe.execute()))
+        for instance, found in result.items():
+            # Instances that expired or have nobody online right now; they re-add themselves
+            if not found and instance != self.instance:
+                self.redis.srem(self.prefix + 'instances', instance)
+        return result
+
+    def users(self):
+        return [json.loads(u) for found in self._all_users().values() for u in found.values()]
+
+    def find_sids(self, username):
+        sids = []
+        for found in self._all_users().values():
+            sids.extend(sid for sid, u in found.items() if json.loads(u).get('username') == username)
+        return sids
+
+    def create_room(self, name, meta):
+        """Add a room, return False if it already exists."""
+        return bool(self.redis.hsetnx(self.prefix + 'rooms', name, json.dumps(meta)))
+
+    def room(self, name):
+        data = self.redis.hget(self.prefix + 'rooms', name)
+        return None if data is None else json.loads(data)
+
+    def rooms(self):
+        return {name: json.loads(meta) for name, meta in self.redis.hgetall(self.prefix + 'rooms').items()}
+
+    def add_member(self, room, username):
+        self.redis.sadd(f'{self.prefix}members:{room}', username)
+
+    def remove_member(self, room, username):
+        self.redis.srem(f'{self.prefix}members:{room}', username)
+
+    def member_count(self, room):
+        return self.redis.scard(f'{self.prefix}members:{room}')
+
+    def messages(self, room):
+        return RedisMessageStore(self.redis, f'{self.prefix}room:{room}', self.room_cap)
+
+    def incr(self, name):
+        return self.redis.incr(self.prefix + name)
+
+    def counter(self, name):
+        return int(self.redis.get(self.prefix + name) or 0)
+
+
+def make_state(url=None, room_cap=DEFAULT_ROOM_CAP):
+    """RedisState when a message queue URL is configured, LocalState otherwise"""
+    if url:
+        return RedisState(url, room_cap)
+    return LocalState(room_cap)
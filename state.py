@@ -0,0 +1,112 @@
+"""Thread-safe client and room registry for the chat server.
+
+Room membership is copy-on-write: every room maps to a frozenset that is
+replaced, never mutated, so a broadcast iterates the snapshot it fetched
+without holding a lock while joins and leaves carry on. Writers to a room
+serialize on one of a fixed number of lock shards, so busy rooms do not
+contend with each other. The client registry (clients, usernames and the
+client -> rooms index) sits behind its own lock.
+
+No code path ever holds two of these locks at once. A join re-checks that
+the client is still registered while holding the room lock, which keeps a
+join racing a disconnect from leaving a ghost member behind.
+"""
+
+import threading
+
+DEFAULT_SHARDS = 64
+
+
+class ChatState:
+    """Registry of connected clients and the rooms they joined"""
+
+    def __init__(self, shards=DEFAULT_SHARDS):
+        self.clients = {}  # {client: {"username": str, "join_time": datetime, "msgs_sent": int}}
+        self.usernames = {}  # {username: client}
+        self._client_rooms = {}  # {client: set(room_names)}
+        self._rooms = {}  # {room_name: frozenset(clients)}
+        self._clients_lock = threading.Lock()
+        self._room_locks = [threading.Lock() for _ in range(shards)]
+
+    def __len__(self):
+        return len(self.clients)
+
+    def _room_lock(self, room):
+        return self._room_locks[hash(room) % len(self._room_locks)]
+
+    def add_client(self, client, info):
+        """Register a client, return False if its username is already taken"""
+        with self._clients_lock:
+            if info["username"] in self.usernames:
+                return False
+            self.usernames[info["username"]] = client
+            self.clients[client] = info
+            self._client_rooms[client] = set()
+            return True
+
+    def remove_client(self, client):
+        """Unregister a client and drop it from its rooms, return its info or None"""
+        with self._clients_lock:
+            info = self.clients.pop(client, None)
+            if info is None:
+                return None
+            del self.usernames[info["username"]]
+            rooms = self._client_rooms.pop(client, ())
+        for room in rooms:
+            self._discard_member(room, client)
+        return info
+
+    def get(self, client):
+        return self.clients.get(client)
+
+    def find(self, username):
+        """Return the client logged in as username, or None"""
+        return self.usernames.get(username)
+
+    def client_list(self):
+        """Snapshot of every registered client"""
+        return list(self.clients)
+
+    def join(self, client, room):
+        """Add a registered client to room, return False if it is not registered"""
+        with self._clients_lock:
+            rooms = self._client_rooms.get(client)
+            if rooms is None:
+                return False
+            rooms.add(room)
+        with self._room_lock(room):
+            # A disconnect may have slipped in, never add an unregistered client
+            if client not in self.clients:
+                return False
+            self._rooms[room] = self._rooms.get(room, frozenset()) | {client}
+        return True
+
+    def leave(self, client, room):
+        """Remove client from room, return False if it was not a member"""
+        with self._clients_lock:
+            rooms = self._client_rooms.get(client)
+            if rooms is None or room not in rooms:
+                return False
+            rooms.discard(room)
+        self._discard_member(room, client)
+        return True
+
+    def _discard_member(self, room, client):
+        with self._room_lock(room):
+            members = self._rooms.get(room)
+            if members is None or client not in members:
+                return
+            members = members - {client}
+            if members:
+                self._rooms[room] = members
+            else:
+                # Clean up empty rooms
+                del self._rooms[room]
+
+    def members(self, room):
+        """Immutable snapshot of the clients in room"""
+        return self._rooms.get(room, frozenset())
+
+    def rooms(self):
+        """Snapshot of (room_name, members) pairs for every active room"""
+        return list(self._rooms.items())
@@ -4,20 +4,75 @@ document.addEventListener('DOMContentLoaded', () => {
     window.socket = socket;
     let currentRoom = null;
     let typingTimeout = null;
+    // Paging state for scrolling back through the current room's history
+    let oldestMessageId = null;
+    let hasMoreHistory = false;
+    let loadingHistory = false;
+    // The activity stream is opt-in, nothing is sent to this socket until the panel is switched on
+    const activityToggle = document.getElementById('activity-live');
+    const activityRoomOnly = document.getElementById('activity-room-only');
+    let activityCursor = 0;
+    let activityPending = null; // live entries that arrive while the initial page loads
+
+    function activityFilters() {
+        return activityRoomOnly && activityRoomOnly.checked && currentRoom ? { rooms: [currentRoom] } : {};
+    }
+
+    function startActivity() {
+        const filters = activityFilters();
+        const params = new URLSearchParams({ limit: 100 });
+        (filters.rooms || []).forEach(room => params.append('room', room));
+        activityPending = [];
+        // Subscribe first so nothing published while the page loads is missed
+        socket.emit('subscribe_activity', filters);
+        fetch(`/activity?${params}`)
+            .then(response => response.json())
+            .then(data => {
+                renderActivityLogs(data.logs || []);
+                activityCursor = data.cursor || 0;
+                const pending = activityPending || [];
+                activityPending = null;
+                pending.forEach(showActivity);
+            });
+    }
+
+    function stopActivity() {
+        socket.emit('unsubscribe_activity');
+        activityPending = null;
+    }
+
+    function showActivity(entry) {
+        // Skip entries the initial page already contained
+        if (entry.id <= activityCursor) return;
+        activityCursor = entry.id;
+        prependActivity(entry);
+    }
+
+    if (activityToggle) {
+        activityToggle.addEventListener('change', () => {
+            activityToggle.checked ? startActivity() : stopActivity();
+        });
+    }
+    if (activityRoomOnly) {
+        activityRoomOnly.addEventListener('change', () => {
+            if (activityToggle && activityToggle.checked) startActivity();
+        });
+    }
 
     // Connect to socket.io
     socket.on('connect', () => {
         console.log('Connected to server');
+        // A reconnect starts without subscriptions, resubscribe if the panel is live
+        if (activityToggle && activityToggle.checked) startActivity();
     });
 
-    // Activity log: initial load and updates
-    socket.on('activity_log', data => {
-        const logs = (data && data.logs) || [];
-        renderActivityLogs(logs);
-    });
-
-    socket.on('activity', entry => {
-        prependActivity(entry);
+    socket.on('activity_batch', data => {
+        const entries = (data && data.entries) || [];
+        if (activityPending) {
+            activityPending.push(...entries);
+        } else {
+            entries.forEach(showActivity);
+        }
     });
 
     // Helper to render a message element (returns the created element)
@@ -29,9 +84,12 @@ document.addEventListener('DOMContentLoaded', () => {
 
         let content = '';
         if (data.type === 'text') {
-            content = data.content;
+            content = `<span class="message-text">${data.content}</span>`;
         } else if (data.type === 'image') {
-            content = `<img src="${data.file_url}" class="img-fluid" alt="Shared image">`;
+            // Show the thumbnail when there is one, the full image opens on click
+            content = data.thumb_url
+                ? `<a href="${data.file_url}" target="_blank"><img src="${data.thumb_url}" class="img-fluid" alt="Shared image" loading="lazy"></a>`
+                : `<img src="${data.file_url}" class="img-fluid" alt="Shared image">`;
         } else if (data.type === 'file') {
             content = `<a href="${data.file_url}" target="_blank">
                         <i class="fas fa-file"></i> Download File
@@ -52,7 +110,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     <i class="far fa-smile"></i>
                 </button>
                 ${isOwn ? `
-                    <button class="btn class=\"btn-sm btn-link edit-btn\">">
+                    <button class="btn btn-sm btn-link edit-btn">
                         <i class="fas fa-edit"></i>
                     </button>
                     <button class="btn btn-sm btn-link delete-btn">
@@ -88,6 +146,45 @@ document.addEventListener('DOMContentLoaded', () => {
         messageList.scrollTop = messageList.scrollHeight;
     });
 
+    // Room history arrives as one page: the latest on join, older ones on scroll back
+    socket.on('history', data => {
+        if (data.room !== currentRoom) return;
+        const messageList = document.getElementById('messages');
+        const fragment = document.createDocumentFragment();
+        (data.messages || []).forEach(msg => {
+            fragment.appendChild(buildMessageElement(msg, msg.user_id === currentUser.id));
+        });
+        if (data.messages && data.messages.length) oldestMessageId = data.messages[0].id;
+        hasMoreHistory = !!data.has_more;
+        loadingHistory = false;
+
+        if (data.before_id) {
+            // Older page: prepend and keep the visible messages where they were
+            const previousHeight = messageList.scrollHeight;
+            messageList.insertBefore(fragment, messageList.firstChild);
+            messageList.scrollTop += messageList.scrollHeight - previousHeight;
+        } else {
+            messageList.insertBefore(fragment, messageList.firstChild);
+            messageList.scrollTop = messageList.scrollHeight;
+        }
+    });
+
+    document.getElementById('messages').addEventListener('scroll', e => {
+        if (e.target.scrollTop > 0 || !hasMoreHistory || loadingHistory || !oldestMessageId) return;
+        loadingHistory = true;
+        socket.emit('load_history', { room: currentRoom, before_id: oldestMessageId, limit: 50 });
+    });
+
+    // Handle edits made by the author
+    socket.on('message_edited', data => {
+        const messageElement = document.querySelector(`[data-message-id="${data.message_id}"]`);
+        if (!messageElement) return;
+        const text = messageElement.querySelector('.message-text');
+        if (text) text.textContent = data.content;
+        const info = messageElement.querySelector('.message-info');
+        if (info && !info.textContent.includes('(edited)')) info.append(' (edited)');
+    });
+
     // Handle user status updates
     socket.on('user_status', data => {
         const userElement = document.querySelector(`[data-user-id="${data.user_id}"]`);
@@ -97,13 +194,39 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
-    // Handle full user list updates (presence)
+    // Presence: a versioned snapshot of online users, kept current by batched deltas
+    const presenceUsers = new Map();
+    let presenceVersion = null;
+    let presenceSyncing = false;
+
     socket.on('update_users', data => {
-        const users = data.users || [];
+        presenceUsers.clear();
+        (data.users || []).forEach(u => presenceUsers.set(u.sid, u));
+        presenceVersion = data.version;
+        presenceSyncing = false;
+        renderUserList();
+    });
+
+    socket.on('presence', delta => {
+        if (delta.base_version !== presenceVersion) {
+            // Missed a delta, ask for a fresh snapshot instead of guessing
+            if (!presenceSyncing) {
+                presenceSyncing = true;
+                socket.emit('presence_sync');
+            }
+            return;
+        }
+        (delta.left || []).forEach(sid => presenceUsers.delete(sid));
+        (delta.joined || []).forEach(u => presenceUsers.set(u.sid, u));
+        presenceVersion = delta.version;
+        renderUserList();
+    });
+
+    function renderUserList() {
         const container = document.getElementById('online-users');
         if (!container) return;
         container.innerHTML = '';
-        users.forEach(u => {
+        presenceUsers.forEach(u => {
             const div = document.createElement('div');
             div.className = 'd-flex justify-content-between align-items-center mb-1';
             div.dataset.userId = u.username;
@@ -124,7 +247,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 alert(`Invite sent to ${to} to join ${currentRoom}`);
             });
         });
-    });
+    }
 
     // Handle reactions
     socket.on('reaction_update', data => {
@@ -146,7 +269,12 @@ document.addEventListener('DOMContentLoaded', () => {
                 socket.emit('leave_room', { room: currentRoom });
             }
             currentRoom = roomId;
+            oldestMessageId = null;
+            hasMoreHistory = false;
             socket.emit('join_room', { room: roomId });
+            if (activityToggle && activityToggle.checked && activityRoomOnly && activityRoomOnly.checked) {
+                startActivity();
+            }
             
             // Clear messages
             document.getElementById('messages').innerHTML = '';
@@ -165,7 +293,19 @@ document.addEventListener('DOMContentLoaded', () => {
 
         const input = document.getElementById('message-input');
         const message = input.value.trim();
-        
+
+        // Editing an existing message instead of sending a new one
+        if (message && input.dataset.editMessageId) {
+            socket.emit('edit_message', {
+                message_id: input.dataset.editMessageId,
+                message: message,
+                room: currentRoom
+            });
+            delete input.dataset.editMessageId;
+            input.value = '';
+            return;
+        }
+
         if (message) {
             // create a temporary client-side id to render optimistically
             const clientId = 'c_' + Date.now() + '_' + Math.random().toString(36).slice(2,9);
@@ -242,6 +382,8 @@ document.addEventListener('DOMContentLoaded', () => {
         if (confirm(`${from} invited you to join room '${room}'. Join now?`)) {
             if (currentRoom) socket.emit('leave_room', { room: currentRoom });
             currentRoom = room;
+            oldestMessageId = null;
+            hasMoreHistory = false;
             socket.emit('join_room', { room: room });
             // UI: set active
             document.querySelectorAll('.room-item').forEach(r => r.classList.remove('active'));
@@ -311,7 +453,8 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         if (e.target.closest('.edit-btn')) {
-            const content = messageElement.querySelector('.message-bubble').textContent.trim();
+            const text = messageElement.querySelector('.message-text');
+            const content = (text || messageElement.querySelector('.message-bubble')).textContent.trim();
             messageInput.value = content;
             messageInput.focus();
             messageInput.dataset.editMessageId = messageElement.dataset.messageId;
@@ -0,0 +1,34 @@
+import threading
+
+from activity import ActivityLog
+
+
+class FakeSocketIO:
+    def __init__(self):
+        self.emitted = []
+
+    def start_background_task(self, target):
+        return target
+
+    def emit(self, event, data, to=None):
+        self.emitted.append((event, data, to))
+
+
+def test_ids_follow_ring_order_when_logged_from_many_threads():
+    activity = ActivityLog(FakeSocketIO(), maxlen=10000)
+
+    def log(n):
+        for i in range(500):
+            activity.log('message', f'{n}-{i}', {'room': f'room{n}'})
+
+    threads = [threading.Thread(target=log, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    activity.flush()
+
+    assert [e['id'] for e in activity.entries] == list(range(1, 4001))
+    entries, more = activity.since(3990, limit=100)
+    assert [e['id'] for e in entries] == list(range(3991, 4001))
+    assert not more
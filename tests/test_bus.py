@@ -0,0 +1,58 @@
+import json
+import socket
+import threading
+
+from bus import MAX_EVENT_SIZE, BusClient, BusHub
+from framing import FrameDecoder, iter_frames
+
+
+def test_stalled_worker_does_not_block_the_others():
+    pairs = [socket.socketpair() for _ in range(3)]
+    hub = BusHub([hub_end for hub_end, _ in pairs])
+    relay = threading.Thread(target=hub.run, daemon=True)
+    relay.start()
+    stalled, publisher, reader = (worker_end for _, worker_end in pairs)
+
+    received = []
+    events = 200
+    done = threading.Event()
+
+    def read():
+        for frame in iter_frames(reader, FrameDecoder(2 * 1024 * 1024)):
+            received.append(json.loads(frame))
+            if len(received) == events:
+                done.set()
+
+    threading.Thread(target=read, daemon=True).start()
+    # Far more than the socket buffers of the worker that never reads
+    bus = BusClient(publisher, 1)
+    bus.start(lambda event: None)
+    for i in range(events):
+        bus.publish("broadcast", message="x" * 64 * 1024, room=str(i))
+
+    assert done.wait(10)
+    assert [event["room"] for event in received] == [str(i) for i in range(events)]
+    hub.stop()
+    relay.join(5)
+    for hub_end, worker_end in pairs:
+        worker_end.close()
+
+
+def test_oversized_event_disconnects_only_that_worker():
+    pairs = [socket.socketpair() for _ in range(3)]
+    hub = BusHub([hub_end for hub_end, _ in pairs])
+    relay = threading.Thread(target=hub.run, daemon=True)
+    relay.start()
+    rogue, publisher, reader = (worker_end for _, worker_end in pairs)
+
+    rogue.settimeout(5)
+    rogue.sendall(b"x" * (MAX_EVENT_SIZE + 2) + b"\n")
+    assert rogue.recv(1) == b""  # The hub closed its end
+    publisher.sendall(b'{"op": "broadcast"}\n')
+    reader.settimeout(5)
+    assert next(iter_frames(reader)) == '{"op": "broadcast"}'
+    assert relay.is_alive()
+    hub.stop()
+    relay.join(5)
+    for hub_end, worker_end in pairs:
+        worker_end.close()
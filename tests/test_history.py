@@ -0,0 +1,64 @@
+import threading
+
+from history import RoomHistory
+
+
+def test_history_survives_a_restart(tmp_path):
+    history = RoomHistory(capacity=3, directory=str(tmp_path))
+    for i in range(5):
+        history.record("general", f"m{i}\n".encode())
+    history.record("other/room", b"x\n")
+    history.close()
+
+    reloaded = RoomHistory(capacity=3, directory=str(tmp_path))
+    assert reloaded.replay("general") == b"m2\nm3\nm4\n"
+    assert reloaded.replay("other/room") == b"x\n"
+    reloaded.close()
+
+
+def test_frames_recorded_before_the_first_replay_follow_the_reloaded_ones(tmp_path):
+    history = RoomHistory(capacity=3, directory=str(tmp_path))
+    for i in range(3):
+        history.record("general", f"m{i}\n".encode())
+    history.close()
+
+    reloaded = RoomHistory(capacity=3, directory=str(tmp_path))
+    reloaded.record("general", b"m3\n")
+    assert reloaded.replay("general") == b"m1\nm2\nm3\n"
+    reloaded.close()
+
+
+def test_evicted_room_reloads_frames_still_queued(tmp_path):
+    history = RoomHistory(capacity=10, directory=str(tmp_path), max_rooms=1, shards=1)
+    history.record("a", b"1\n")
+    history.record("b", b"2\n")  # Evicts a from memory
+    assert history.replay("a") == b"1\n"
+    history.close()
+
+
+def test_record_does_not_wait_on_the_disk(tmp_path):
+    history = RoomHistory(directory=str(tmp_path))
+    with history._writer.lock:  # As if the writer were stuck in a slow write
+        recorder = threading.Thread(target=history.record, args=("new room", b"1\n"))
+        recorder.start()
+        recorder.join(1)
+        assert not recorder.is_alive()
+    assert history.replay("new room") == b"1\n"
+    history.close()
+
+
+def test_concurrent_rooms(tmp_path):
+    history = RoomHistory(capacity=1000, directory=str(tmp_path))
+
+    def chat(room):
+        for i in range(500):
+            history.record(room, f"{i}\n".encode())
+
+    threads = [threading.Thread(target=chat, args=(f"room{n}",)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    history.close()
+    for n in range(8):
+        assert (tmp_path / f"room{n}.log").read_bytes() == b"".join(f"{i}\n".encode() for i in range(500))
@@ -0,0 +1,42 @@
+import socket
+import time
+
+from outbound import Flusher, OutboundConnection
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_reused_fd_of_a_closed_parked_connection_still_flushes():
+    flusher = Flusher()
+    flusher.start()
+    server_end, client_end = socket.socketpair()
+    parked = OutboundConnection(server_end, flusher, high_water=16 * 1024 * 1024)
+    while parked not in flusher._waiting:  # The client never reads, so the socket fills up
+        parked.send(b"x" * 65536)
+        time.sleep(0.001)
+    fd = parked.fileno()
+    parked.close()
+    assert parked not in flusher._waiting
+    client_end.close()
+
+    server_end, client_end = socket.socketpair()
+    assert fd in (server_end.fileno(), client_end.fileno())
+    if client_end.fileno() == fd:
+        server_end, client_end = client_end, server_end
+    conn = OutboundConnection(server_end, flusher, high_water=16 * 1024 * 1024)
+    payload = b"y" * 4 * 1024 * 1024
+    conn.send(payload)
+    wait_for(lambda: conn in flusher._waiting)
+    received = bytearray()
+    client_end.settimeout(5)
+    while len(received) < len(payload):
+        received += client_end.recv(65536)
+    assert received == payload
+    wait_for(lambda: not conn.pending_bytes())
+    conn.close()
+    client_end.close()
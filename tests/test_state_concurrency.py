@@ -0,0 +1,90 @@
+import itertools
+import random
+import threading
+import time
+
+from server import ChatServer
+
+ROOMS = [f"room{i}" for i in range(8)]
+
+
+class FakeConnection:
+    """In-memory client, optionally failing its sends like a dead socket"""
+
+    def __init__(self, flaky=False):
+        self.flaky = flaky
+        self.closed = False
+
+    def send(self, data):
+        if self.closed or (self.flaky and random.random() < 0.01):
+            raise ConnectionError("Connection reset")
+        return len(data)
+
+    def close(self):
+        self.closed = True
+
+
+def churn(server, names, deadline, errors):
+    """Log clients in, hop between rooms, broadcast into them and disconnect"""
+    try:
+        while time.monotonic() < deadline:
+            conn = FakeConnection(flaky=random.random() < 0.3)
+            if not server.login_client(conn, f"user{next(names)}"):
+                continue
+            for _ in range(random.randint(1, 20)):
+                room = random.choice(ROOMS)
+                action = random.random()
+                if action < 0.4:
+                    server.cmd_join_room(conn, [room])
+                elif action < 0.6:
+                    server.cmd_leave_room(conn, [room])
+                else:
+                    server.broadcast("stress message", sender=conn, room=room)
+            server.remove_client(conn)
+    except Exception as e:
+        errors.append(repr(e))
+
+
+def check_invariants(state):
+    """Return the ways the room, client and username indexes disagree"""
+    problems = []
+    for room, members in state.rooms():
+        if not members:
+            problems.append(f"empty room {room} left behind")
+        for client in members:
+            if state.get(client) is None:
+                problems.append(f"ghost member in {room}")
+            elif room not in state._client_rooms[client]:
+                problems.append(f"{room} missing from a member's room index")
+    for client, rooms in state._client_rooms.items():
+        for room in rooms:
+            if client not in state.members(room):
+                problems.append(f"index says member of {room}, room disagrees")
+    for username, client in state.usernames.items():
+        if state.get(client)["username"] != username:
+            problems.append(f"username index out of sync for {username}")
+    return problems
+
+
+def test_membership_stays_consistent_under_concurrent_join_leave_broadcast():
+    server = ChatServer()
+    # Sits in on a room throughout, so broadcasts always have a long-lived member to fan out to
+    watcher = FakeConnection()
+    assert server.login_client(watcher, "watcher")
+    server.cmd_join_room(watcher, [ROOMS[0]])
+
+    names = itertools.count()
+    errors = []
+    deadline = time.monotonic() + 1.0
+    workers = [threading.Thread(target=churn, args=(server, names, deadline, errors)) for _ in range(16)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert errors == []
+    assert check_invariants(server.state) == []
+    # Every churned client left, so only the watcher and its room remain
+    assert len(server.state) == 1
+    assert [(room, set(members)) for room, members in server.state.rooms()] == [(ROOMS[0], {watcher})]
+    assert list(server.state.usernames) == ["watcher"]
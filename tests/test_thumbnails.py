@@ -0,0 +1,21 @@
+import os
+import stat
+
+import pytest
+
+from thumbnails import Thumbnailer
+from upload_store import FILE_MODE
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def test_rendered_variant_gets_the_default_file_mode(tmp_path):
+    source, cache = tmp_path / "uploads", tmp_path / "thumbs"
+    source.mkdir()
+    Image.new("RGB", (800, 400)).save(source / "a.png")
+    thumbnailer = Thumbnailer(str(source), str(cache), lambda func, *args: func(*args))
+
+    name = thumbnailer.get("thumb", "a.png")
+
+    assert stat.S_IMODE(os.stat(cache / name).st_mode) == FILE_MODE
+    assert thumbnailer.get("thumb", "missing.png") is None
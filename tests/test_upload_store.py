@@ -0,0 +1,13 @@
+import io
+import os
+import stat
+
+from upload_store import FILE_MODE, UploadStore
+
+
+def test_stored_upload_gets_the_default_file_mode(tmp_path):
+    store = UploadStore(str(tmp_path))
+    name = store.save(io.BytesIO(b"hello"), "hello.txt")
+
+    assert (tmp_path / name).read_bytes() == b"hello"
+    assert stat.S_IMODE(os.stat(tmp_path / name).st_mode) == FILE_MODE
@@ -0,0 +1,44 @@
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, func, select
+
+from write_behind import WriteBehind
+
+metadata = MetaData()
+reactions = Table('reaction', metadata,
+                  Column('id', Integer, primary_key=True),
+                  Column('emoji', String(20), nullable=False))
+
+
+def make_writes(tmp_path, **kwargs):
+    engine = create_engine(f"sqlite:///{tmp_path / 'chat.db'}")
+    metadata.create_all(engine)
+    return engine, WriteBehind(engine, **kwargs)
+
+
+def count(engine):
+    with engine.connect() as connection:
+        return connection.execute(select(func.count()).select_from(reactions)).scalar()
+
+
+def test_bad_row_does_not_block_the_batch(tmp_path):
+    engine, writes = make_writes(tmp_path)
+    for emoji in ('👍', None, '🎉', '❤️'):
+        writes.add(reactions, {'emoji': emoji})
+
+    assert writes.flush() == 3
+    assert writes.pending() == 0
+    assert count(engine) == 3
+
+    # Later flushes are not held up by the rejected row
+    writes.add(reactions, {'emoji': '🔥'})
+    assert writes.flush() == 1
+    assert count(engine) == 4
+
+
+def test_full_buffer_flushes_past_a_bad_row(tmp_path):
+    engine, writes = make_writes(tmp_path, max_rows=3)
+    writes.add(reactions, {'emoji': None})
+    writes.add(reactions, {'emoji': '👍'})
+    writes.add(reactions, {'emoji': '🎉'})
+
+    assert writes.pending() == 0
+    assert count(engine) == 2
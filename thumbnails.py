@@ -0,0 +1,163 @@
+"""Downscaled variants of uploaded images.
+
+A small pool of background workers renders every variant in VARIANTS of an
+uploaded image into a cache directory, which is capped by total size and
+evicts the least recently served files first. Missing variants are rendered
+on request. Rendering needs Pillow; without it clients get the originals.
+"""
+
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict, deque
+
+from upload_store import FILE_MODE, run_inline
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Thumbnails are optional
+    Image = None
+
+VARIANTS = {'thumb': 320, 'preview': 1024}  # {variant: longest side in pixels}
+IMAGE_EXTENSIONS = {'.png': 'PNG', '.jpg': 'JPEG', '.jpeg': 'JPEG', '.webp': 'WEBP'}
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024  # Size budget of the thumbnail cache
+DEFAULT_WORKERS = 2  # Images rendered at the same time
+
+
+class Thumbnailer:
+    """Renders image variants in the background and keeps them in a size-bounded cache"""
+
+    def __init__(self, source_dir, cache_dir, spawn, offload=run_inline,
+                 max_bytes=DEFAULT_CACHE_BYTES, workers=DEFAULT_WORKERS):
+        self.source_dir = source_dir
+        self.cache_dir = cache_dir
+        self.spawn = spawn  # Starts a background task, e.g. socketio.start_background_task
+        self.offload = offload  # Runs the CPU-heavy resize, e.g. in eventlet's tpool
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self._jobs = deque()
+        self._queued = set()
+        self._active = 0
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # {cache file name: size}, least recently used first
+        self._cache_bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        # Pick up what an earlier run left behind, oldest first
+        entries = []
+        for entry in os.scandir(cache_dir):
+            if entry.is_file() and not entry.name.startswith('.'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._cache[name] = size
+            self._cache_bytes += size
+
+    @property
+    def available(self):
+        return Image is not None
+
+    def supports(self, filename):
+        # Plain names only, so a request can never read or write outside the two directories
+        if not self.available or filename != os.path.basename(filename) or filename.startswith('.'):
+            return False
+        return os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS
+
+    def has_source(self, filename):
+        """Whether filename is a plain name of an existing upload"""
+        if filename != os.path.basename(filename) or filename.startswith('.'):
+            return False
+        return os.path.isfile(os.path.join(self.source_dir, filename))
+
+    def submit(self, filename):
+        """Queue every variant of an uploaded image for rendering."""
+        if not self.supports(filename):
+            return
+        with self._lock:
+            if filename in self._queued:
+                return
+            self._queued.add(filename)
+            self._jobs.append(filename)
+            if self._active >= self.workers:
+                return
+            self._active += 1
+        self.spawn(self._work)
+
+    def _work(self):
+        while True:
+            with self._lock:
+                if not self._jobs:
+                    self._active -= 1
+                    return
+                filename = self._jobs.popleft()
+            try:
+                for variant in VARIANTS:
+                    if not self._cached(variant, filename):
+                        self._add(*self.offload(self._render, variant, filename))
+            except Exception as e:
+                logging.warning(f"Could not render thumbnails of {filename}: {e}")
+            finally:
+                with self._lock:
+                    self._queued.discard(filename)
+
+    def cache_name(self, variant, filename):
+        return f'{variant}-{filename}'
+
+    def _cached(self, variant, filename):
+        return self.cache_name(variant, filename) in self._cache
+
+    def get(self, variant, filename):
+        """Return the cache file name of a variant, rendering it now if needed, or None."""
+        if variant not in VARIANTS or not self.supports(filename) or not self.has_source(filename):
+            return None
+        name = self.cache_name(variant, filename)
+        with self._lock:
+            if name in self._cache:
+                self._cache.move_to_end(name)
+                return name
+        try:
+            self._add(*self.offload(self._render, variant, filename))
+        except Exception as e:
+            logging.warning(f"Could not render {variant} of {filename}: {e}")
+            return None
+        return name
+
+    def _render(self, variant, filename):
+        # Runs in the offload thread, so it only touches files; the caller updates the cache
+        source = os.path.join(self.source_dir, filename)
+        size = VARIANTS[variant]
+        image_format = IMAGE_EXTENSIONS[os.path.splitext(filename)[1].lower()]
+        with Image.open(source) as image:
+            # draft() lets JPEG decode at a fraction of the full size
+            image.draft('RGB', (size, size))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((size, size))
+            if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            # Write next to the cache and rename, so readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.thumb-')
+            os.fchmod(fd, FILE_MODE)  # Readable by a fronting server, like the uploads
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    image.save(f, image_format, optimize=image_format == 'JPEG', quality=85)
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+        name = self.cache_name(variant, filename)
+        os.replace(tmp_path, os.path.join(self.cache_dir, name))
+        return name, os.path.getsize(os.path.join(self.cache_dir, name))
+
+    def _add(self, name, size):
+        with self._lock:
+            self._cache_bytes += size - self._cache.pop(name, 0)
+            self._cache[name] = size
+            evicted = []
+            while self._cache_bytes > self.max_bytes and len(self._cache) > 1:
+                old, old_size = self._cache.popitem(last=False)
+                self._cache_bytes -= old_size
+                evicted.append(old)
+        for old in evicted:
+            try:
+                os.unlink(os.path.join(self.cache_dir, old))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,137 @@
+"""Timing and profiling of the Socket.IO event handlers in web_server.py.
+
+EventTimer wraps every registered handler, records its wall time in a
+per-event histogram and logs calls slower than a threshold with their
+arguments. SamplingProfiler samples every thread's stack from a real OS
+thread on demand and returns them in the collapsed flame graph format.
+"""
+
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+try:
+    # The sampler must keep running while the event loop is busy, so it needs
+    # a real thread and a real sleep even when eventlet has patched both
+    from eventlet.patcher import original
+    _thread = original('_thread')
+    _sleep = original('time').sleep
+except ImportError:  # eventlet is optional
+    import _thread
+    _sleep = time.sleep
+
+DEFAULT_SLOW_SECONDS = 0.1  # Handler calls slower than this are logged
+DEFAULT_SLOW_KEPT = 100  # Slow calls kept for the admin endpoint
+MAX_ARGS_REPR = 500  # Characters of a slow call's arguments that are kept
+DEFAULT_PROFILE_INTERVAL = 0.005  # Seconds between stack samples
+MAX_PROFILE_SECONDS = 120
+
+
+class EventTimer:
+    """Times every event handler of a python-socketio server"""
+
+    def __init__(self, histogram, threshold=DEFAULT_SLOW_SECONDS, describe=None, keep=DEFAULT_SLOW_KEPT):
+        self.histogram = histogram  # Labelled by event
+        self.threshold = threshold
+        self.describe = describe  # Optional sid -> user name, for the slow event log
+        self.slow_events = deque(maxlen=keep)
+
+    def instrument(self, server):
+        """Wrap every handler registered on server so far."""
+        for handlers in server.handlers.values():
+            for event, handler in list(handlers.items()):
+                if not getattr(handler, 'timed', False):
+                    handlers[event] = self.wrap(event, handler)
+
+    def wrap(self, event, handler):
+        @functools.wraps(handler)
+        def timed_handler(*args):
+            start = time.perf_counter()
+            try:
+                return handler(*args)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.histogram.observe(elapsed, (event,))
+                if elapsed >= self.threshold:
+                    self.record_slow(event, elapsed, args)
+
+        timed_handler.timed = True
+        return timed_handler
+
+    def record_slow(self, event, elapsed, args):
+        sid = args[0] if args else None
+        # connect gets the whole WSGI environ, only its auth payload is of interest
+        payload = args[2:] if event == 'connect' else args[1:]
+        captured = repr(payload)[:MAX_ARGS_REPR]
+        user = None
+        if self.describe and sid:
+            try:
+                user = self.describe(sid)
+            except Exception:
+                pass
+        self.slow_events.append({'event': event, 'ms': round(elapsed * 1000, 1), 'sid': sid, 'user': user,
+                                 'args': captured, 'at': time.time()})
+        logging.warning(f"🐢 Slow event '{event}' took {elapsed * 1000:.1f} ms for {user or sid}: {captured}")
+
+
+class SamplingProfiler:
+    """Samples every thread's stack for a while, one profile at a time"""
+
+    def __init__(self):
+        self.running = False
+        self.samples = 0
+        self.stacks = Counter()  # {collapsed stack: samples}
+        self._labels = {}  # {code object: frame label}
+        self._lock = _thread.allocate_lock()
+
+    def start(self, seconds, interval=DEFAULT_PROFILE_INTERVAL):
+        """Start sampling in the background, return False if a profile is already running."""
+        with self._lock:
+            if self.running:
+                return False
+            self.running = True
+        self.samples = 0
+        self.stacks = Counter()
+        _thread.start_new_thread(self._run, (min(seconds, MAX_PROFILE_SECONDS), interval))
+        return True
+
+    def _run(self, seconds, interval):
+        me = _thread.get_ident()
+        deadline = time.monotonic() + seconds
+        try:
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident != me:
+                        self.stacks[self._collapse(frame, names.get(ident, f'thread-{ident}'))] += 1
+                self.samples += 1
+                _sleep(interval)
+        except Exception as e:
+            logging.error(f"Profiler stopped: {e}")
+        finally:
+            self.running = False
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            # ';' separates frames in the collapsed format
+            label = f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'.replace(';', ':')
+            self._labels[code] = label
+        return label
+
+    def _collapse(self, frame, root):
+        labels = []
+        while frame is not None:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        labels.append(root.replace(';', ':'))
+        labels.reverse()
+        return ';'.join(labels)
+
+    def collapsed(self):
+        """The last profile as 'frame;frame;frame count' lines, busiest stacks first"""
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
@@ -0,0 +1,138 @@
+"""Streaming, content-addressed storage for chat uploads.
+
+The form parser writes each uploaded file into a HashingFile, which hashes
+the data as it arrives; the finished file is renamed to its SHA-256 digest,
+so identical uploads share one file. Disk writes go through an offload
+function (eventlet's tpool in web_server.py). send_upload() serves stored
+files with caching headers, since a name never points at other content.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+
+from flask import abort, current_app, send_file
+from werkzeug.security import safe_join
+from werkzeug.utils import secure_filename
+
+CHUNK_SIZE = 64 * 1024  # Bytes per write when copying a stream
+UPLOAD_MAX_AGE = 365 * 24 * 3600  # Seconds clients may cache an upload
+DIGEST_NAME = re.compile(r'([0-9a-f]{64})(\.\w+)?$')  # Names given by UploadStore.commit()
+
+# mkstemp() creates files readable by their owner only. Stored files get the mode
+# open() would have given them, so a fronting server running as another user can read them
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
+
+
+def run_inline(func, *args):
+    """Offload function that just calls func, for servers without a thread pool"""
+    return func(*args)
+
+
+class HashingFile:
+    """Temporary upload file that hashes everything written to it"""
+
+    def __init__(self, directory, offload=run_inline):
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        os.fchmod(fd, FILE_MODE)
+        self._file = os.fdopen(fd, 'w+b')
+        self._hash = hashlib.sha256()
+        self._offload = offload
+        self.size = 0
+        self.stored = False  # Set once the file has been moved into the store
+
+    def write(self, data):
+        self._offload(self._write, data)
+        return len(data)
+
+    def _write(self, data):
+        # hashlib releases the GIL for large chunks, so this runs in parallel in a pool thread
+        self._hash.update(data)
+        self._file.write(data)
+        self.size += len(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def __getattr__(self, name):
+        # seek(), read(), flush() etc. for the form parser and FileStorage
+        return getattr(self._file, name)
+
+    def close(self):
+        self._file.close()
+        if not self.stored:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class UploadStore:
+    """Directory of uploads named by the SHA-256 of their content"""
+
+    def __init__(self, directory, offload=run_inline):
+        self.directory = directory
+        self.offload = offload
+        os.makedirs(directory, exist_ok=True)
+
+    def open_temp(self):
+        """Return a HashingFile for the form parser to stream an upload into."""
+        return HashingFile(self.directory, self.offload)
+
+    def commit(self, upload, filename=''):
+        """Move a complete HashingFile into the store and return its stored name.
+
+        The original file extension is kept so the file is served with the
+        right content type. An identical file already stored is reused.
+        """
+        ext = os.path.splitext(secure_filename(filename or ''))[1].lower()
+        name = upload.hexdigest() + ext
+        self.offload(self._store, upload, os.path.join(self.directory, name))
+        return name
+
+    def _store(self, upload, target):
+        upload.flush()
+        if os.path.exists(target):
+            os.unlink(upload.path)  # Duplicate content, keep the stored copy
+        else:
+            os.replace(upload.path, target)
+        upload.stored = True
+
+    def save(self, stream, filename=''):
+        """Copy a readable stream into the store and return its stored name."""
+        upload = self.open_temp()
+        try:
+            while True:
+                chunk = self.offload(stream.read, CHUNK_SIZE)
+                if not chunk:
+                    break
+                upload.write(chunk)
+            return self.commit(upload, filename)
+        finally:
+            upload.close()
+
+
+def send_upload(directory, filename):
+    """Serve an upload with a strong ETag, immutable caching and Range support.
+
+    Content-addressed files use their digest as ETag. Older uuid-named
+    uploads use their size and mtime, which is just as stable since those
+    files are never rewritten. If-None-Match, If-Modified-Since and Range
+    are answered by Werkzeug's conditional responses. With USE_X_SENDFILE
+    set, the body is left to the fronting web server to send with
+    sendfile().
+    """
+    # Relative upload folders are relative to the app, as with send_from_directory()
+    path = safe_join(os.path.join(current_app.root_path, directory), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    stat = os.stat(path)
+    match = DIGEST_NAME.match(os.path.basename(path))
+    etag = match.group(1) if match else f'{stat.st_size:x}-{stat.st_mtime_ns:x}'
+    response = send_file(path, etag=etag, last_modified=stat.st_mtime, max_age=UPLOAD_MAX_AGE, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
@@ -1,60 +1,148 @@
-from flask import Flask, render_template, request, session, redirect, url_for, jsonify, send_from_directory, flash
-from flask_socketio import SocketIO, emit, join_room, leave_room
-from werkzeug.utils import secure_filename
 import os
+
+if os.environ.get('CHAT_MESSAGE_QUEUE'):
+    # the Redis client behind the message queue must use eventlet's green sockets
+    import eventlet
+    eventlet.monkey_patch()
+
+from flask import Flask, Request, abort, render_template, request, session, redirect, url_for, jsonify, flash
+from flask_socketio import ConnectionRefusedError, SocketIO, disconnect, emit, join_room, leave_room
 import datetime
+import hmac
+import time
 import uuid
 import logging
-import threading
 import sys
+from collections import deque
+
+from activity import ActivityLog
+from logqueue import setup_logging
+from message_store import DEFAULT_ROOM_CAP
+from metrics import CONTENT_TYPE, REGISTRY, SIZE_BUCKETS, enable as enable_metrics
+from presence import DEFAULT_WINDOW, Presence
+from ratelimit import (DEFAULT_BURST, DEFAULT_MAX_CONNECTIONS, DEFAULT_RATE, DEFAULT_ROOM_BURST, DEFAULT_ROOM_RATE,
+                       DEFAULT_TYPING_BURST, DEFAULT_TYPING_RATE, RateLimiter)
+from shared_state import make_state
+from thumbnails import DEFAULT_CACHE_BYTES, Thumbnailer
+from tracing import DEFAULT_PROFILE_INTERVAL, DEFAULT_SLOW_SECONDS, EventTimer, SamplingProfiler
+from upload_store import UploadStore, run_inline, send_upload
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key'  # Change this in production
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
-socketio = SocketIO(app)
+app.config['THUMBNAIL_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'thumbs')
+app.config['THUMBNAIL_CACHE_BYTES'] = DEFAULT_CACHE_BYTES  # disk budget for image variants
+# let a fronting server (Apache mod_xsendfile, lighttpd) send uploads with sendfile()
+app.config['USE_X_SENDFILE'] = os.environ.get('CHAT_X_SENDFILE') == '1'
+app.config['ROOM_HISTORY_CAP'] = DEFAULT_ROOM_CAP  # messages kept per room
+app.config['HISTORY_PAGE_SIZE'] = 50  # messages per history page
+app.config['MAX_HISTORY_PAGE_SIZE'] = 200
+app.config['ACTIVITY_PAGE_SIZE'] = 100  # activity entries per /activity request
+app.config['MAX_ACTIVITY_PAGE_SIZE'] = 500
+app.config['PRESENCE_WINDOW'] = DEFAULT_WINDOW  # seconds of joins/leaves batched per update
+# expose Prometheus metrics on /metrics, instrumentation is a no-op otherwise
+app.config['METRICS_ENABLED'] = os.environ.get('CHAT_METRICS') == '1'
+# time every Socket.IO handler and log the slow ones with their arguments
+app.config['EVENT_TIMING'] = os.environ.get('CHAT_EVENT_TIMING') == '1'
+app.config['SLOW_EVENT_SECONDS'] = float(os.environ.get('CHAT_SLOW_EVENT_SECONDS', DEFAULT_SLOW_SECONDS))
+# enables the /admin endpoints (profiler, slow events) for requests carrying this token
+app.config['ADMIN_TOKEN'] = os.environ.get('CHAT_ADMIN_TOKEN')
+# messages per second per connection and per room, typing notifications per connection, 0 for no limit;
+# the room limit is off by default
+app.config['RATE_LIMIT'] = float(os.environ.get('CHAT_RATE_LIMIT', DEFAULT_RATE))
+app.config['RATE_BURST'] = int(os.environ.get('CHAT_RATE_BURST', DEFAULT_BURST))
+app.config['ROOM_RATE_LIMIT'] = float(os.environ.get('CHAT_ROOM_RATE_LIMIT', DEFAULT_ROOM_RATE))
+app.config['ROOM_RATE_BURST'] = int(os.environ.get('CHAT_ROOM_RATE_BURST', DEFAULT_ROOM_BURST))
+app.config['TYPING_RATE_LIMIT'] = float(os.environ.get('CHAT_TYPING_RATE_LIMIT', DEFAULT_TYPING_RATE))
+app.config['TYPING_RATE_BURST'] = int(os.environ.get('CHAT_TYPING_RATE_BURST', DEFAULT_TYPING_BURST))
+# drop, notify or disconnect, see ratelimit.py; typing notifications over the limit are always just dropped
+app.config['SHED_POLICY'] = os.environ.get('CHAT_SHED_POLICY', 'notify')
+# Socket.IO connections per instance, 0 (the default) for no cap
+app.config['MAX_CONNECTIONS'] = int(os.environ.get('CHAT_MAX_CONNECTIONS', DEFAULT_MAX_CONNECTIONS))
+# requests eventlet serves at once, websockets and keep-alive HTTP connections alike; beyond that it
+# stops accepting and new connections wait in the listen backlog. Leaves eventlet's usual 1024 for HTTP
+app.config['WSGI_MAX_SIZE'] = int(os.environ.get('CHAT_WSGI_MAX_SIZE', app.config['MAX_CONNECTIONS'] + 1024))
+# e.g. redis://localhost:6379/0 to run several instances that serve the same rooms
+app.config['MESSAGE_QUEUE'] = os.environ.get('CHAT_MESSAGE_QUEUE')
+socketio = SocketIO(app, message_queue=app.config['MESSAGE_QUEUE'])
+# Users, rooms and room history, shared through the message queue's Redis when there is one
+state = make_state(app.config['MESSAGE_QUEUE'], app.config['ROOM_HISTORY_CAP'])
+presence = Presence(socketio, app.config['PRESENCE_WINDOW'], state)
+
+# Disk I/O and image resizing run in eventlet's thread pool so they never block other sockets
+if socketio.async_mode == 'eventlet':
+    from eventlet import tpool
+    offload = tpool.execute
+else:
+    offload = run_inline
+# Uploads are stored under their content hash
+upload_store = UploadStore(app.config['UPLOAD_FOLDER'], offload)
+thumbnailer = Thumbnailer(app.config['UPLOAD_FOLDER'], app.config['THUMBNAIL_FOLDER'],
+                          socketio.start_background_task, offload, app.config['THUMBNAIL_CACHE_BYTES'])
+
+
+class UploadRequest(Request):
+    """Request that streams uploaded files into the upload store while the body is parsed."""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return upload_store.open_temp()
+
+
+app.request_class = UploadRequest
+
+if app.config['METRICS_ENABLED']:
+    enable_metrics()
+CONNECTS = REGISTRY.counter('chat_connections_accepted_total', 'Socket.IO connections accepted')
+DISCONNECTS = REGISTRY.counter('chat_disconnects_total', 'Socket.IO connections closed')
+MESSAGES = REGISTRY.counter('chat_messages_total', 'Chat messages received')
+FANOUT = REGISTRY.histogram('chat_broadcast_recipients', 'Room members a message was sent to', SIZE_BUCKETS)
+BROADCAST_SECONDS = REGISTRY.histogram('chat_broadcast_seconds', 'Time to emit a message to its room')
+UPLOADS = REGISTRY.counter('chat_uploads_total', 'Files uploaded')
+UPLOAD_BYTES = REGISTRY.counter('chat_upload_bytes_total', 'Bytes uploaded')
+REGISTRY.gauge('chat_open_connections', 'Socket.IO connections open on this instance', lambda: len(connected))
+REGISTRY.gauge('chat_logged_in_users', 'Logged in Socket.IO clients on this instance', lambda: len(users))
+REGISTRY.gauge('chat_rooms', 'Rooms that exist', lambda: len(state.rooms()))
+RATE_LIMITED = REGISTRY.counter('chat_rate_limited_total', 'Events shed for going over a rate limit', ('scope',))
+REJECTED = REGISTRY.counter('chat_connections_rejected_total', 'Socket.IO connections refused at MAX_CONNECTIONS')
+EVENT_SECONDS = REGISTRY.histogram('chat_event_seconds', 'Socket.IO handler wall time', labelnames=('event',))
+event_timer = EventTimer(EVENT_SECONDS, app.config['SLOW_EVENT_SECONDS'],
+                         describe=lambda sid: users.get(sid, {}).get('username'))
+profiler = SamplingProfiler()
+
+
+def make_limiter(rate, burst):
+    return RateLimiter(rate, burst) if rate else None
+
+
+message_limits = make_limiter(app.config['RATE_LIMIT'], app.config['RATE_BURST'])  # by sid
+room_limits = make_limiter(app.config['ROOM_RATE_LIMIT'], app.config['ROOM_RATE_BURST'])  # by room
+typing_limits = make_limiter(app.config['TYPING_RATE_LIMIT'], app.config['TYPING_RATE_BURST'])  # by sid
+connected = set()  # sids of every Socket.IO connection on this instance, for MAX_CONNECTIONS
+
+
+def make_room(description='', created_by='System', category='Other', is_private=False):
+    """Return the metadata record for a new room."""
+    return {
+        'description': description,
+        'created_by': created_by,
+        'created_at': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'category': category,
+        'is_private': is_private
+    }
 
-# Ensure upload folder exists
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-# Store connected users and their rooms
+# Users connected to this instance and their rooms; the shared list of everyone online is in state
 users = {}
-rooms = {
-    'General': {
-        'users': set(),
-        'messages': [],
-        'description': 'Main chat room for everyone',
-        'created_by': 'System',
-        'created_at': datetime.datetime.now(),
-        'category': 'General',
-        'is_private': False
-    }
-}
+state.create_room('General', make_room('Main chat room for everyone', category='General'))
 
 # Track user data
 user_data = {}
-# Activity log (in-memory)
-activity_log = []
-server_logs = []
-log_lock = threading.Lock()
+# Activity log (in-memory), published in batches to the activity room
+activity = ActivityLog(socketio)
+server_logs = deque(maxlen=2000)
 
 def log_activity(event_type, description, meta=None):
-    entry = {
-        'id': uuid.uuid4().hex,
-        'event': event_type,
-        'description': description,
-        'meta': meta or {},
-        'timestamp': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    }
-    activity_log.append(entry)
-    # keep the log bounded
-    if len(activity_log) > 1000:
-        del activity_log[0]
-    # broadcast to all clients
-    try:
-        socketio.emit('activity', entry, broadcast=True)
-    except Exception:
-        pass
+    return activity.log(event_type, description, meta)
 
 
 def serialize_user(u: dict) -> dict:
@@ -68,38 +156,39 @@ def serialize_user(u: dict) -> dict:
     }
 
 
-def broadcast_user_list():
-    try:
-        sanitized = [serialize_user(u) for u in users.values()]
-        socketio.emit('update_users', {'users': sanitized}, broadcast=True)
-    except Exception:
-        pass
+def rate_allows(limits, key, scope, room=None):
+    """Take a token from key's bucket, or shed the current event according to SHED_POLICY"""
+    if limits is None:
+        return True
+    bucket = limits.bucket(key)
+    if bucket.take():
+        return True
+    RATE_LIMITED.inc(1, (scope,))
+    policy = app.config['SHED_POLICY']
+    if scope == 'typing':
+        return False
+    if policy == 'disconnect' and scope == 'connection':
+        logging.warning(f"Disconnecting {users.get(request.sid, {}).get('username', request.sid)}: flooding")
+        disconnect()
+    elif policy != 'drop' and bucket.denied == 1:
+        # once per run of dropped messages, or the notices would be a flood of their own
+        msg = f'⚠️ {room} is busy, your messages are being dropped.' if scope == 'room' \
+            else '⚠️ Slow down, your messages are being dropped.'
+        emit('status', {'msg': msg, 'timestamp': datetime.datetime.now().strftime('%H:%M:%S')})
+    return False
+
+def send_user_snapshot(sid):
+    """Send the full, versioned user list to a single client."""
+    emit('update_users', presence.snapshot(state.users), room=sid)
 
 
 class ServerLogHandler(logging.Handler):
-    """Custom logging handler that pushes server logs into activity_log and broadcasts them."""
+    """Custom logging handler that queues server logs into the activity log."""
     def emit(self, record):
         try:
             msg = self.format(record)
-            entry = {
-                'id': uuid.uuid4().hex,
-                'event': 'server',
-                'description': msg,
-                'meta': {'level': record.levelname, 'logger': record.name},
-                'timestamp': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            }
-            with log_lock:
-                server_logs.append(entry)
-                if len(server_logs) > 2000:
-                    del server_logs[0]
-            # also record into activity_log for UI
-            activity_log.append(entry)
-            if len(activity_log) > 2000:
-                del activity_log[0]
-            try:
-                socketio.emit('activity', entry, broadcast=True)
-            except Exception:
-                pass
+            entry = log_activity('server', msg, {'level': record.levelname, 'logger': record.name})
+            server_logs.append(entry)
         except Exception:
             pass
 
@@ -149,13 +238,13 @@ def get_rooms():
     public_rooms = {
         name: {
             'description': info['description'],
-            'users_count': len(info['users']),
+            'users_count': state.member_count(name),
             'category': info.get('category', 'Other'),
             'created_by': info['created_by'],
-            'created_at': info['created_at'].strftime('%Y-%m-%d %H:%M:%S'),
+            'created_at': info['created_at'],
             'is_private': info.get('is_private', False)
         }
-        for name, info in rooms.items()
+        for name, info in state.rooms().items()
         if not info.get('is_private', False)
     }
     return jsonify(public_rooms)
@@ -170,18 +259,9 @@ def create_room():
     is_private = data.get('is_private', False)
     if not name:
         return jsonify({'ok': False, 'error': 'Invalid name'}), 400
-    if name in rooms:
-        return jsonify({'ok': False, 'error': 'Room exists'}), 400
     created_by = session.get('username', 'System')
-    rooms[name] = {
-        'users': set(),
-        'messages': [],
-        'description': description,
-        'created_by': created_by,
-        'created_at': datetime.datetime.now(),
-        'category': category,
-        'is_private': is_private
-    }
+    if not state.create_room(name, make_room(description, created_by, category, is_private)):
+        return jsonify({'ok': False, 'error': 'Room exists'}), 400
     # log activity
     log_activity('create_room', f"Room '{name}' created", {'room': name, 'created_by': created_by})
     # broadcast updated rooms to clients (clients fetch /rooms periodically anyway)
@@ -195,10 +275,13 @@ def upload_file():
     file = request.files['file']
     if file.filename == '':
         return jsonify({'error': 'Empty filename'}), 400
-    filename = secure_filename(f"{uuid.uuid4().hex}_{file.filename}")
-    path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(path)
+    # the body has already been streamed to disk and hashed, this just names it by its hash
+    filename = upload_store.commit(file.stream, file.filename)
+    UPLOADS.inc()
+    UPLOAD_BYTES.inc(file.stream.size)
     url = url_for('uploaded_file', filename=filename)
+    # render image variants in the background, before the message is even sent
+    thumbnailer.submit(filename)
     # log activity
     user = session.get('username', 'Anonymous')
     log_activity('upload', f'File uploaded by {user}: {filename}', {'filename': filename, 'user': user})
@@ -207,7 +290,17 @@ def upload_file():
 
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return send_upload(app.config['UPLOAD_FOLDER'], filename)
+
+@app.route('/thumbs/<variant>/<filename>')
+def thumbnail(variant, filename):
+    if not thumbnailer.has_source(filename):
+        abort(404)  # before any rendering, so made-up names cost a stat and nothing else
+    # renders the variant now if the background workers have not (or it was evicted)
+    name = thumbnailer.get(variant, filename)
+    if name is None:
+        return redirect(url_for('uploaded_file', filename=filename))
+    return send_upload(app.config['THUMBNAIL_FOLDER'], name)
 
 @app.route('/chat', methods=['GET', 'POST'])
 def chat():
@@ -215,11 +308,17 @@ def chat():
         username = request.form.get('username')
         if username:
             session['username'] = username
-            return render_template('chat.html', username=username, rooms=rooms)
+            return render_template('chat.html', username=username, rooms=state.rooms())
     return redirect(url_for('index'))
 
 @socketio.on('connect')
 def handle_connect(auth=None):
+    cap = app.config['MAX_CONNECTIONS']
+    if cap and len(connected) >= cap:
+        REJECTED.inc()
+        raise ConnectionRefusedError('Server is full, please try again later.')
+    connected.add(request.sid)
+    CONNECTS.inc()
     username = session.get('username')
     if username:
         users[request.sid] = {
@@ -230,41 +329,63 @@ def handle_connect(auth=None):
             'connected_at': datetime.datetime.now().isoformat()
         }
         # Add to General room users set
-        rooms['General']['users'].add(username)
+        state.add_member('General', username)
+        state.set_user(request.sid, serialize_user(users[request.sid]))
         join_room('General')
         emit('status', {
             'msg': f'🎉 {username} has joined the chat!',
             'timestamp': datetime.datetime.now().strftime('%H:%M:%S')
         }, room='General')
-        # Send user list update to all clients (sanitized)
-        broadcast_user_list()
-        # send recent activity log to this client
-        try:
-            emit('activity_log', {'logs': activity_log}, room=request.sid)
-        except Exception:
-            pass
+        # Everyone else gets a batched presence delta, the newcomer a full snapshot
+        presence.joined(request.sid, serialize_user(users[request.sid]))
+        send_user_snapshot(request.sid)
         # record activity
         log_activity('connect', f'{username} connected', {'username': username})
 
 @socketio.on('disconnect')
 def handle_disconnect():
+    DISCONNECTS.inc()
+    connected.discard(request.sid)
+    for limits in (message_limits, typing_limits):
+        if limits is not None:
+            limits.forget(request.sid)
+    activity.unsubscribe(request.sid)
     if request.sid in users:
         username = users[request.sid]['username']
         user_rooms = users[request.sid]['rooms'].copy()
         for room in user_rooms:
             leave_room(room)
-            if room in rooms:
-                rooms[room]['users'].discard(username)
+            state.remove_member(room, username)
             emit('status', {
                 'msg': f'⚠️ {username} has left the chat.',
                 'timestamp': datetime.datetime.now().strftime('%H:%M:%S')
             }, room=room)
         del users[request.sid]
-        # broadcast sanitized user list
-        broadcast_user_list()
+        state.remove_user(request.sid)
+        presence.left(request.sid)
         # log disconnect
         log_activity('disconnect', f'{username} disconnected', {'username': username})
 
+@socketio.on('subscribe_activity')
+def on_subscribe_activity(data=None):
+    # optional filters: {'events': [...], 'rooms': [...]}, subscribing again replaces them
+    data = data or {}
+    previous = activity.unsubscribe(request.sid)
+    if previous:
+        leave_room(previous)
+    join_room(activity.subscribe(request.sid, data.get('events'), data.get('rooms')))
+
+@socketio.on('unsubscribe_activity')
+def on_unsubscribe_activity(data=None):
+    previous = activity.unsubscribe(request.sid)
+    if previous:
+        leave_room(previous)
+
+@socketio.on('presence_sync')
+def on_presence_sync(data=None):
+    # client missed a presence delta and needs the full list again
+    send_user_snapshot(request.sid)
+
 @socketio.on('message')
 def handle_message(data):
     username = users.get(request.sid, {}).get('username', 'Unknown')
@@ -275,6 +396,10 @@ def handle_message(data):
     file_url = data.get('file_url')
     if not (message or file_url):
         return
+    MESSAGES.inc()
+    if not (rate_allows(message_limits, request.sid, 'connection')
+            and rate_allows(room_limits, room, 'room', room)):
+        return
 
     timestamp = datetime.datetime.now().strftime('%H:%M:%S')
     msg_data = {
@@ -290,15 +415,26 @@ def handle_message(data):
     # If client provided a temporary id, echo it back so the client can match/replace optimistic UI
     if client_id:
         msg_data['client_id'] = client_id
+    # Point clients at a thumbnail of uploaded images, the original is loaded on click
+    upload_prefix = url_for('uploaded_file', filename='')
+    if msg_type == 'image' and file_url and file_url.startswith(upload_prefix):
+        upload_name = file_url[len(upload_prefix):]
+        if thumbnailer.supports(upload_name):
+            msg_data['thumb_url'] = url_for('thumbnail', variant='thumb', filename=upload_name)
     # Ensure room exists
-    if room not in rooms:
-        rooms[room] = {'users': set(), 'messages': [], 'description': '', 'created_by': 'System', 'created_at': datetime.datetime.now(), 'category': 'Other', 'is_private': False}
+    if state.room(room) is None:
+        state.create_room(room, make_room())
 
-    rooms[room]['messages'].append(msg_data)
+    state.messages(room).append(msg_data)
+    start = time.perf_counter()
     try:
         emit('message', msg_data, room=room)
     except Exception:
         pass
+    BROADCAST_SECONDS.observe(time.perf_counter() - start)
+    if REGISTRY.enabled:
+        # a Redis round trip with a message queue, so only when someone is scraping
+        FANOUT.observe(state.member_count(room))
     # log activity
     log_activity('message', f"{username} sent a message in {room}", {'room': room, 'username': username, 'message': message[:200]})
 
@@ -308,19 +444,35 @@ def on_join(data):
     room = data.get('room')
     if not room or not username:
         return
-    if room not in rooms:
+    if state.room(room) is None:
         # create room if missing
-        rooms[room] = {'users': set(), 'messages': [], 'description': '', 'created_by': username, 'created_at': datetime.datetime.now(), 'category': 'Other', 'is_private': False}
+        state.create_room(room, make_room(created_by=username))
     join_room(room)
     users[request.sid]['rooms'].add(room)
-    rooms[room]['users'].add(username)
+    state.add_member(room, username)
+    state.set_user(request.sid, serialize_user(users[request.sid]))
     emit('status', {
         'msg': f'👋 {username} has joined {room}!',
         'timestamp': datetime.datetime.now().strftime('%H:%M:%S')
     }, room=room)
-    # Send room history
-    for msg in rooms[room]['messages'][-50:]:  # Last 50 messages
-        emit('message', msg)
+    # Send the latest page of room history in a single packet
+    messages, has_more = state.messages(room).page(limit=app.config['HISTORY_PAGE_SIZE'])
+    emit('history', {'room': room, 'messages': messages, 'has_more': has_more})
+
+@socketio.on('load_history')
+def on_load_history(data):
+    """Send the page of messages just older than before_id, for scrolling back."""
+    room = data.get('room')
+    before_id = data.get('before_id')
+    if state.room(room) is None:
+        return
+    try:
+        limit = int(data.get('limit') or app.config['HISTORY_PAGE_SIZE'])
+    except (TypeError, ValueError):
+        limit = app.config['HISTORY_PAGE_SIZE']
+    limit = max(1, min(limit, app.config['MAX_HISTORY_PAGE_SIZE']))
+    messages, has_more = state.messages(room).page(before_id, limit)
+    emit('history', {'room': room, 'messages': messages, 'has_more': has_more, 'before_id': before_id})
 
 @socketio.on('leave')
 def on_leave(data):
@@ -328,10 +480,11 @@ def on_leave(data):
     room = data.get('room')
     if not room or not username:
         return
-    if room in rooms and room != 'General':
+    if room != 'General' and state.room(room) is not None:
         leave_room(room)
         users[request.sid]['rooms'].discard(room)
-        rooms[room]['users'].discard(username)
+        state.remove_member(room, username)
+        state.set_user(request.sid, serialize_user(users[request.sid]))
         emit('status', {
             'msg': f'👋 {username} has left {room}.',
             'timestamp': datetime.datetime.now().strftime('%H:%M:%S')
@@ -350,6 +503,9 @@ def on_join_room(data):
 def on_typing(data):
     room = data.get('room')
     typing = data.get('typing', False)
+    # sent on every keystroke, a dropped one is covered by the next
+    if not rate_allows(typing_limits, request.sid, 'typing'):
+        return
     username = users.get(request.sid, {}).get('username')
     emit('typing_status', {'room': room, 'typing': typing, 'username': username, 'user_id': username}, room=room)
 
@@ -358,28 +514,92 @@ def on_delete_message(data):
     room = data.get('room')
     message_id = data.get('message_id')
     # Remove from server store if present
-    if room in rooms:
-        rooms[room]['messages'] = [m for m in rooms[room]['messages'] if m.get('id') != message_id]
+    if state.room(room) is not None:
+        state.messages(room).delete(message_id)
     emit('delete_message', {'message_id': message_id}, room=room)
 
+@socketio.on('edit_message')
+def on_edit_message(data):
+    room = data.get('room')
+    message_id = data.get('message_id')
+    content = data.get('message', '').strip()
+    username = users.get(request.sid, {}).get('username')
+    if not content or state.room(room) is None:
+        return
+    store = state.messages(room)
+    msg = store.get(message_id)
+    # only the author may edit a message
+    if not msg or msg.get('username') != username:
+        return
+    store.edit(message_id, content=content, edited=True)
+    emit('message_edited', {'message_id': message_id, 'content': content}, room=room)
+
 @socketio.on('invite')
 def on_invite(data):
     target = data.get('to')
     room = data.get('room')
     from_user = users.get(request.sid, {}).get('username')
-    # find the sid(s) for target username
-    for sid, u in users.items():
-        if u.get('username') == target:
-            emit('invited', {'from': from_user, 'room': room}, room=sid)
-            # log activity
-            log_activity('invite', f'{from_user} invited {target} to {room}', {'from': from_user, 'to': target, 'room': room})
-            break
+    # find the sid(s) for target username, possibly connected to another instance
+    for sid in state.find_sids(target):
+        emit('invited', {'from': from_user, 'room': room}, room=sid)
+        # log activity
+        log_activity('invite', f'{from_user} invited {target} to {room}', {'from': from_user, 'to': target, 'room': room})
+        break
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if not REGISTRY.enabled:
+        return jsonify({'error': 'Metrics are disabled, set CHAT_METRICS=1'}), 404
+    return REGISTRY.render(), 200, {'Content-Type': CONTENT_TYPE}
+
+
+def admin_allowed():
+    token = app.config['ADMIN_TOKEN']
+    given = request.headers.get('X-Admin-Token') or request.args.get('token', '')
+    return bool(token) and hmac.compare_digest(given.encode(), token.encode())
+
+
+@app.route('/admin/profile')
+def admin_profile():
+    # ?seconds=10&interval=0.005, returns collapsed stacks for flamegraph.pl or speedscope
+    if not admin_allowed():
+        return jsonify({'error': 'Not found'}), 404
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = max(0.001, float(request.args.get('interval', DEFAULT_PROFILE_INTERVAL)))
+    except ValueError:
+        return jsonify({'error': 'Invalid seconds or interval'}), 400
+    if not profiler.start(seconds, interval):
+        return jsonify({'error': 'A profile is already running'}), 409
+    # the sampler has its own OS thread, this request only waits for it
+    while profiler.running:
+        socketio.sleep(0.1)
+    return profiler.collapsed(), 200, {'Content-Type': 'text/plain; charset=utf-8',
+                                       'X-Profile-Samples': str(profiler.samples)}
+
+
+@app.route('/admin/slow-events')
+def admin_slow_events():
+    if not admin_allowed():
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify({'enabled': app.config['EVENT_TIMING'], 'threshold_ms': app.config['SLOW_EVENT_SECONDS'] * 1000,
+                    'events': list(event_timer.slow_events)})
 
 
 @app.route('/activity')
 def get_activity():
-    # return recent activity logs
-    return jsonify({'logs': activity_log})
+    # recent activity, or entries after ?since=<id> to catch up, filtered by ?event= and ?room=
+    try:
+        since = request.args.get('since')
+        since = int(since) if since else None
+        limit = int(request.args.get('limit') or app.config['ACTIVITY_PAGE_SIZE'])
+    except ValueError:
+        return jsonify({'error': 'since and limit must be integers'}), 400
+    limit = max(1, min(limit, app.config['MAX_ACTIVITY_PAGE_SIZE']))
+    logs, has_more = activity.since(since, limit, request.args.getlist('event'), request.args.getlist('room'))
+    cursor = logs[-1]['id'] if logs else since
+    return jsonify({'logs': logs, 'cursor': cursor, 'has_more': has_more})
 
 @socketio.on('create_room')
 def on_create_room(data):
@@ -388,17 +608,8 @@ def on_create_room(data):
     category = data.get('category', 'Other')
     is_private = data.get('is_private', False)
     
-    if room_name and room_name not in rooms:
-        username = users[request.sid]['username']
-        rooms[room_name] = {
-            'users': set(),
-            'messages': [],
-            'description': description,
-            'created_by': username,
-            'created_at': datetime.datetime.now(),
-            'category': category,
-            'is_private': is_private
-        }
+    username = users[request.sid]['username']
+    if room_name and state.create_room(room_name, make_room(description, username, category, is_private)):
         emit('room_created', {
             'room': room_name,
             'description': description,
@@ -408,17 +619,27 @@ def on_create_room(data):
         }, broadcast=True)
         log_activity('create_room', f"Room '{room_name}' created by {username}", {'room': room_name, 'created_by': username})
 
+if app.config['EVENT_TIMING']:
+    # every @socketio.on above has registered its handler by now
+    event_timer.instrument(socketio.server)
+
 if __name__ == '__main__':
-    # configure logging to capture server stdout/stderr into activity log
-    root_logger = logging.getLogger()
-    root_logger.setLevel(logging.INFO)
+    # capture server logs into the activity log through one background writer
+    # thread, so a log call never blocks the request that made it
     handler = ServerLogHandler()
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    handler.setFormatter(formatter)
-    root_logger.addHandler(handler)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    setup_logging(path=None, console=False, handlers=[handler])
+    # the writer thread feeds the activity log, so start its batching task from here
+    activity.start()
+    root_logger = logging.getLogger()
 
     # redirect stdout/stderr to logger so prints also appear in activity
     sys.stdout = StreamToLogger(root_logger, logging.INFO)
     sys.stderr = StreamToLogger(root_logger, logging.ERROR)
 
-    socketio.run(app, host='0.0.0.0', port=5000, debug=True, use_reloader=False)
\ No newline at end of file
+    # give each instance its own port when running several on one host
+    run_kwargs = {}
+    if socketio.async_mode == 'eventlet':
+        run_kwargs['max_size'] = app.config['WSGI_MAX_SIZE']
+    socketio.run(app, host='0.0.0.0', port=int(os.environ.get('CHAT_PORT', 5000)), debug=True, use_reloader=False,
+                 **run_kwargs)
\ No newline at end of file
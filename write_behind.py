@@ -0,0 +1,138 @@
+"""Batched database writes for the chat events in app.py.
+
+Handlers hand their rows to a WriteBehind buffer, which assigns ids at once
+and inserts the rows in one transaction, grouped by table, every `interval`
+seconds, when `max_rows` rows are waiting, and at exit. Rows still buffered
+are lost if the process is killed outright. The buffer must be the only
+writer of its tables, since ids are allocated in memory.
+"""
+
+import itertools
+import logging
+import threading
+
+from sqlalchemy import event, func, select
+from sqlalchemy.exc import OperationalError
+
+DEFAULT_INTERVAL = 0.5  # Seconds between flushes
+DEFAULT_MAX_ROWS = 500  # Rows waiting before a flush is forced
+
+
+def use_wal(engine):
+    """Open every SQLite connection of engine in WAL mode.
+
+    Readers no longer wait for writers, and a commit appends to the log
+    instead of rewriting the database file. synchronous=NORMAL syncs at
+    checkpoints rather than at every commit, which WAL keeps consistent.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(connection, record):
+        cursor = connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+
+class WriteBehind:
+    """Buffer of rows to insert, written out in grouped transactions"""
+
+    def __init__(self, engine, interval=DEFAULT_INTERVAL, max_rows=DEFAULT_MAX_ROWS):
+        self.engine = engine
+        self.interval = interval
+        self.max_rows = max_rows
+        self.flushed = 0  # Rows written so far
+        self._pending = []  # [(table, row)] in the order they were added
+        self._ids = {}  # {table name: itertools.count of the next ids}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # One transaction at a time, in order
+        self._running = False
+
+    def next_id(self, table):
+        with self._lock:
+            ids = self._ids.get(table.name)
+            if ids is None:
+                with self.engine.connect() as connection:
+                    highest = connection.execute(select(func.max(table.c.id))).scalar() or 0
+                ids = self._ids[table.name] = itertools.count(highest + 1)
+            return next(ids)
+
+    def add(self, table, row):
+        """Queue a row for table, giving it an id if it has none, and return the row."""
+        if row.get('id') is None:
+            row['id'] = self.next_id(table)
+        with self._lock:
+            self._pending.append((table, row))
+            # Every max_rows rows, so rows queued again after a failure do not force a flush per add()
+            full = len(self._pending) % self.max_rows == 0
+        if full:
+            self.flush()
+        return row
+
+    def pending(self):
+        return len(self._pending)
+
+    def flush(self):
+        """Write every queued row in one transaction and return how many were written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            # Tables in order of their first row, so a message is inserted before its reactions
+            groups = {}
+            for table, row in batch:
+                groups.setdefault(table, []).append(row)
+            try:
+                with self.engine.begin() as connection:
+                    for table, rows in groups.items():
+                        connection.execute(table.insert(), rows)
+            except Exception as e:
+                logging.error(f"❌ Could not write {len(batch)} rows together, writing them one by one: {e}")
+                written = self._write_each(batch)
+            else:
+                written = len(batch)
+            self.flushed += written
+            return written
+
+    def _write_each(self, batch):
+        """Write rows in their own transactions, dropping the ones the database rejects.
+
+        A row that breaks a constraint would fail every batch it is part of,
+        so it is logged and dropped. When the database itself is unavailable
+        the rest of the batch is queued again for the next flush.
+        """
+        written = 0
+        for index, (table, row) in enumerate(batch):
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(table.insert(), [row])
+            except OperationalError as e:
+                logging.error(f"❌ Could not write {len(batch) - index} rows, retrying: {e}")
+                with self._lock:
+                    self._pending[:0] = batch[index:]
+                break
+            except Exception as e:
+                logging.error(f"❌ Dropping {table.name} row {row.get('id')}: {e}")
+            else:
+                written += 1
+        return written
+
+    def start(self, spawn, sleep):
+        """Flush every interval from a background task, e.g. socketio.start_background_task."""
+        if self._running:
+            return
+        self._running = True
+        spawn(self._run, sleep)
+
+    def _run(self, sleep):
+        while self._running:
+            sleep(self.interval)
+            self.flush()
+
+    def stop(self):
+        """Stop the background task and write out whatever is left"""
+        self._running = False
+        self.flush()